@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''A module for computing carbonate chemistry of bottle data with PyCO2SYS.
+
+The notebooks compute the aragonite saturation state with
+
+    c07 = pyco2.sys(df07['ALKALI'], df07['TCARBN'], 1, 2,
+                    salinity=df07['CTDSAL'], temperature=df07['CTDTMP'],
+                    pressure=df07['CTDPRS'])
+    df07['OmegaA'] = c07['saturation_aragonite']
+
+co2sys_cached does the same calculation, but saves the results of every row
+to a cache file. Rows that were computed before (with the same inputs and
+options) are read from the cache, so only new or changed rows are computed.
+
+co2sys_parallel splits the rows into chunks that are computed by a pool of
+processes, for archives with millions of bottles.
+'''
+
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import PyCO2SYS as pyco2
+
+from exchange import DATA_DIR
+
+CACHE_DIR = os.path.join(DATA_DIR, '.co2sys_cache')
+
+# bottle data columns used for each PyCO2SYS input
+CO2SYS_COLUMNS = {'par1': 'ALKALI', 'par2': 'TCARBN', 'salinity': 'CTDSAL',
+                  'temperature': 'CTDTMP', 'pressure': 'CTDPRS'}
+
+
+def co2sys_inputs(df, columns=None):
+    '''
+    Collect the PyCO2SYS inputs from a bottle data table
+
+    Inputs:
+        df - DataFrame with bottle data
+        columns - dictionary mapping par1, par2, salinity, temperature and
+                  pressure to column names (default: CO2SYS_COLUMNS)
+    Returns: (N, 5) float64 array with one row per bottle
+    '''
+
+    if columns is None:
+        columns = CO2SYS_COLUMNS
+    names = [columns[k] for k in ('par1', 'par2', 'salinity', 'temperature',
+                                  'pressure')]
+    return np.column_stack([np.asarray(df[n], dtype=np.float64) for n in names])
+
+
+def split_kwargs(kwargs, nrows):
+    '''
+    Separate the pyco2.sys options that are the same for every row from the
+    ones with one value per row (e.g. total_silicate=df['SILCAT'])
+
+    Inputs:
+        kwargs - dictionary of options passed to pyco2.sys
+        nrows - number of rows of inputs
+    Returns: dictionary of scalar options, and dictionary of per-row options
+             as float64 arrays
+    '''
+
+    scalars = {}
+    columns = {}
+    for name, value in kwargs.items():
+        if isinstance(value, str) or np.ndim(value) == 0:
+            scalars[name] = value
+            continue
+        values = np.asarray(value, dtype=np.float64)
+        if values.ndim != 1 or len(values) != nrows:
+            raise ValueError('option {} must be a scalar or have one value per '
+                             'row ({} values, got shape {})'.format(
+                                 name, nrows, values.shape))
+        columns[name] = values
+    return scalars, columns
+
+
+def run_co2sys(inputs, par1_type=1, par2_type=2, outputs=None, **kwargs):
+    '''
+    Run pyco2.sys on an array of inputs from co2sys_inputs
+
+    Inputs:
+        inputs - (N, 5) array of par1, par2, salinity, temperature, pressure
+        par1_type, par2_type - PyCO2SYS parameter types (1 = alkalinity,
+                               2 = DIC)
+        outputs - list of result fields to keep (None keeps all of them)
+        kwargs - other options passed to pyco2.sys (scalars, or arrays with
+                 one value per row)
+    Returns: dictionary of result arrays
+    '''
+
+    results = pyco2.sys(inputs[:, 0], inputs[:, 1], par1_type, par2_type,
+                        salinity=inputs[:, 2], temperature=inputs[:, 3],
+                        pressure=inputs[:, 4], **kwargs)
+    if outputs is None:
+        outputs = [k for k, v in results.items() if np.size(v) == len(inputs)]
+    return {k: np.broadcast_to(results[k], len(inputs)).astype(np.float64)
+            for k in outputs}
+
+
+def _co2sys_chunk(input_name, output_name, nrows, start, stop, par1_type,
+                  par2_type, outputs, kwargs, row_names):
+    '''
+    Worker for co2sys_parallel: compute rows start:stop of the shared input
+    array and write the results into the shared output array. The columns
+    after the first five are the per-row options named in row_names.
+    '''
+
+    input_shm = shared_memory.SharedMemory(name=input_name)
+    output_shm = shared_memory.SharedMemory(name=output_name)
+    try:
+        inputs = np.ndarray((nrows, 5 + len(row_names)), dtype=np.float64,
+                            buffer=input_shm.buf)
+        results = np.ndarray((len(outputs), nrows), dtype=np.float64,
+                             buffer=output_shm.buf)
+        rows = inputs[start:stop]
+        row_kwargs = {name: rows[:, 5 + i] for i, name in enumerate(row_names)}
+        chunk = run_co2sys(rows[:, :5], par1_type, par2_type, outputs,
+                           **kwargs, **row_kwargs)
+        for i, field in enumerate(outputs):
+            results[i, start:stop] = chunk[field]
+        del inputs, results, rows, row_kwargs
+    finally:
+        input_shm.close()
+        output_shm.close()
+
+
+def co2sys_parallel(inputs, par1_type=1, par2_type=2,
+                    outputs=('saturation_aragonite',), processes=None,
+                    chunksize=100000, **kwargs):
+    '''
+    Run pyco2.sys on chunks of rows in a pool of processes
+
+    The inputs and results are kept in shared memory, so the workers only
+    receive the row range they compute and nothing large is pickled. Each
+    worker writes its results into its own rows of the output, so the row
+    order is the same as the input no matter which chunk finishes first.
+
+    Inputs:
+        inputs - DataFrame with bottle data, or (N, 5) array from co2sys_inputs
+        par1_type, par2_type - PyCO2SYS parameter types
+        outputs - list of result fields to return
+        processes - number of worker processes (default: number of CPUs);
+                    1 runs everything in this process
+        chunksize - number of rows computed by a worker at a time
+        kwargs - other options passed to pyco2.sys; arrays with one value
+                 per row are split into chunks along with the inputs
+    Returns: dictionary of result arrays, one value per row
+    '''
+
+    if isinstance(inputs, pd.DataFrame):
+        inputs = co2sys_inputs(inputs)
+    inputs = np.asarray(inputs, dtype=np.float64)
+    outputs = list(outputs)
+    nrows = len(inputs)
+    kwargs, row_kwargs = split_kwargs(kwargs, nrows)
+
+    if processes is None:
+        processes = os.cpu_count()
+    if processes == 1 or nrows <= chunksize:
+        return run_co2sys(inputs, par1_type, par2_type, outputs, **kwargs,
+                          **row_kwargs)
+
+    # per-row options are extra columns of the shared input array
+    row_names = list(row_kwargs)
+    inputs = np.ascontiguousarray(np.column_stack(
+        [inputs] + [row_kwargs[name] for name in row_names]))
+
+    input_shm = shared_memory.SharedMemory(create=True, size=max(inputs.nbytes, 1))
+    output_shm = shared_memory.SharedMemory(create=True,
+                                            size=max(8 * len(outputs) * nrows, 1))
+    try:
+        shared_inputs = np.ndarray(inputs.shape, dtype=np.float64,
+                                   buffer=input_shm.buf)
+        shared_inputs[:] = inputs
+        results = np.ndarray((len(outputs), nrows), dtype=np.float64,
+                             buffer=output_shm.buf)
+
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(_co2sys_chunk, input_shm.name,
+                                   output_shm.name, nrows, start,
+                                   min(start + chunksize, nrows), par1_type,
+                                   par2_type, outputs, kwargs, row_names)
+                       for start in range(0, nrows, chunksize)]
+            for future in futures:
+                future.result()
+
+        output = {field: results[i].copy() for i, field in enumerate(outputs)}
+        del shared_inputs, results
+    finally:
+        input_shm.close()
+        input_shm.unlink()
+        output_shm.close()
+        output_shm.unlink()
+
+    return output
+
+
+def _options_key(par1_type, par2_type, kwargs, row_names=()):
+    '''
+    Hash of the PyCO2SYS options, which name the cache file. Per-row options
+    are part of the inputs of each row, so only their names are included.
+    '''
+
+    options = dict(kwargs, par1_type=par1_type, par2_type=par2_type,
+                   row_options=sorted(row_names), version=pyco2.__version__)
+    text = json.dumps(options, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def _row_hashes(inputs):
+    '''One 64-bit hash for each row of inputs.'''
+
+    return pd.util.hash_pandas_object(pd.DataFrame(inputs),
+                                      index=False).to_numpy()
+
+
+def _same_rows(a, b):
+    '''True for rows of a and b that are identical (NaNs compare equal).'''
+
+    return ((a == b) | (np.isnan(a) & np.isnan(b))).all(axis=1)
+
+
+def _load_cache(cache_file, ncols=5):
+    if not os.path.isfile(cache_file):
+        return {'keys': np.zeros(0, dtype=np.uint64),
+                'inputs': np.zeros((0, ncols))}
+    with np.load(cache_file) as f:
+        return {k: f[k] for k in f.files}
+
+
+def _save_cache(cache, cache_file):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp_file = cache_file + '.tmp' + str(os.getpid()) + '.npz'
+    np.savez(tmp_file, **cache)
+    os.replace(tmp_file, cache_file)
+
+
+def co2sys_cached(df, par1_type=1, par2_type=2,
+                  outputs=('saturation_aragonite',), columns=None,
+                  cache_dir=CACHE_DIR, processes=1, **kwargs):
+    '''
+    Compute carbonate chemistry with pyco2.sys, reusing earlier results
+
+    Every row of inputs is hashed. Results for rows already in the cache
+    are looked up, and pyco2.sys is only run on rows that are new (or whose
+    inputs changed). The cache is a .npz file named after the PyCO2SYS
+    options, so results computed with different options are kept apart.
+    Options with one value per row (e.g. total_silicate=df['SILCAT']) are
+    treated as extra input columns: they are hashed with each row.
+
+    Inputs:
+        df - DataFrame with bottle data
+        par1_type, par2_type - PyCO2SYS parameter types
+        outputs - list of result fields to return
+        columns - dictionary of input columns (default: CO2SYS_COLUMNS)
+        cache_dir - directory where the cache files are stored
+        processes - number of processes used to compute the missing rows
+                    (see co2sys_parallel)
+        kwargs - other options passed to pyco2.sys (scalars, or arrays with
+                 one value per row of df)
+    Returns: dictionary of result arrays, one value per row of df
+    '''
+
+    outputs = list(outputs)
+    inputs = co2sys_inputs(df, columns)
+    if len(inputs) == 0:
+        return {field: np.zeros(0) for field in outputs}
+    kwargs, row_kwargs = split_kwargs(kwargs, len(inputs))
+    row_names = sorted(row_kwargs)
+    inputs = np.column_stack([inputs] + [row_kwargs[name] for name in row_names])
+    keys = _row_hashes(inputs)
+
+    cache_file = os.path.join(cache_dir, _options_key(par1_type, par2_type,
+                                                      kwargs, row_names) + '.npz')
+    cache = _load_cache(cache_file, inputs.shape[1])
+
+    # find each row in the cache (cache keys are kept sorted)
+    pos = np.searchsorted(cache['keys'], keys)
+    pos = np.minimum(pos, len(cache['keys']) - 1)
+    found = np.zeros(len(keys), dtype=bool)
+    if len(cache['keys']) > 0:
+        found = cache['keys'][pos] == keys
+        found[found] = _same_rows(cache['inputs'][pos[found]], inputs[found])
+    for field in outputs:
+        if field in cache:
+            done = np.zeros(len(keys), dtype=bool)
+            done[found] = cache[field + '__done'][pos[found]]
+            found = found & done
+        else:
+            found[:] = False
+
+    # compute each missing row once, even if it appears more than once
+    missing = np.flatnonzero(~found)
+    if len(missing) > 0:
+        new_keys, first = np.unique(keys[missing], return_index=True)
+        new_rows = missing[first]
+        new_inputs = inputs[new_rows]
+        new_row_kwargs = {name: new_inputs[:, 5 + i]
+                          for i, name in enumerate(row_names)}
+        results = co2sys_parallel(new_inputs[:, :5], par1_type, par2_type,
+                                  outputs, processes=processes, **kwargs,
+                                  **new_row_kwargs)
+
+        # add the new rows to the cache (or update rows missing a field)
+        n_old = len(cache['keys'])
+        in_cache = np.isin(new_keys, cache['keys'])
+        all_keys = np.concatenate([cache['keys'], new_keys[~in_cache]])
+        all_inputs = np.concatenate([cache['inputs'],
+                                     inputs[new_rows[~in_cache]]])
+        target = np.zeros(len(new_keys), dtype=np.int64)
+        target[in_cache] = np.searchsorted(cache['keys'], new_keys[in_cache])
+        target[~in_cache] = n_old + np.arange(np.sum(~in_cache))
+
+        fields = set(outputs) | {k for k in cache
+                                 if k not in ('keys', 'inputs')
+                                 and not k.endswith('__done')}
+        updated = {}
+        for field in fields:
+            values = np.full(len(all_keys), np.nan)
+            done = np.zeros(len(all_keys), dtype=bool)
+            if field in cache:
+                values[:n_old] = cache[field]
+                done[:n_old] = cache[field + '__done']
+            if field in results:
+                values[target] = results[field]
+                done[target] = True
+            updated[field] = values
+            updated[field + '__done'] = done
+
+        order = np.argsort(all_keys, kind='stable')
+        cache = {k: v[order] for k, v in updated.items()}
+        cache['keys'] = all_keys[order]
+        cache['inputs'] = all_inputs[order]
+        _save_cache(cache, cache_file)
+
+    pos = np.searchsorted(cache['keys'], keys)
+    return {field: cache[field][pos] for field in outputs}
+
+
+if __name__ == '__main__':
+    import time
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from exchange import read_exchange
+
+    df07 = read_exchange('data/wcoa_cruise_2007/32WC20070511.exc.csv')
+    cache_dir = os.path.join(CACHE_DIR, 'example')
+
+    t0 = time.perf_counter()
+    c07 = pyco2.sys(df07['ALKALI'], df07['TCARBN'], 1, 2,
+                    salinity=df07['CTDSAL'], temperature=df07['CTDTMP'],
+                    pressure=df07['CTDPRS'])
+    t1 = time.perf_counter()
+    co2sys_cached(df07, cache_dir=cache_dir)
+    t2 = time.perf_counter()
+    cached = co2sys_cached(df07, cache_dir=cache_dir)
+    t3 = time.perf_counter()
+
+    print('pyco2.sys:        {:8.1f} ms'.format(1e3*(t1-t0)))
+    print('first cached run: {:8.1f} ms'.format(1e3*(t2-t1)))
+    print('second run:       {:8.1f} ms'.format(1e3*(t3-t2)))
+    print('same results:', np.allclose(c07['saturation_aragonite'],
+                                       cached['saturation_aragonite'],
+                                       equal_nan=True))
+
+    # scaling of co2sys_parallel on a synthetic archive, by resampling the
+    # 2007 cruise (python carbonate.py [number of bottles])
+    nbottles = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000_000
+    rng = np.random.default_rng(0)
+    inputs = co2sys_inputs(df07)
+    inputs = inputs[~np.isnan(inputs).any(axis=1)]
+    inputs = inputs[rng.integers(0, len(inputs), nbottles)]
+    print(nbottles, 'bottles')
+
+    reference = None
+    for processes in sorted({1, 2, 4, os.cpu_count()}):
+        t0 = time.perf_counter()
+        result = co2sys_parallel(inputs, processes=processes)
+        t1 = time.perf_counter()
+        if reference is None:
+            reference = result['saturation_aragonite']
+            t_serial = t1 - t0
+        same = np.array_equal(reference, result['saturation_aragonite'])
+        print('{:3d} processes: {:8.2f} s, speedup {:5.2f}, same results: {}'
+              .format(processes, t1 - t0, t_serial / (t1 - t0), same))
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''A module for searching bottle data across many cruises by place and time.
+
+A CruiseCatalog keeps the position, pressure and time of every bottle from a
+set of WHP-exchange files, with a k-d tree over the bottle positions. Queries
+like "all bottles within 50 km of 45N 125W between 30 and 300 dbar from 2007
+to 2013" use the tree to find the matching rows, and then read only those
+rows from the binary columnar copies of the files (see exchange.py):
+
+    cat = CruiseCatalog()
+    cat.add('data/wcoa_cruise_2007/32WC20070511.exc.csv')
+    cat.add('data/wcoa_cruise/WCOA2013_hy1.csv')
+    df = cat.query(lat=45, lon=-125, radius_km=50, pressure_range=(30, 300),
+                   time_range=('2007-01-01', '2013-12-31'))
+'''
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from exchange import DATA_DIR, CACHE_DIR, exchange_cache_entry, load_cached_frame
+
+CATALOG_DIR = os.path.join(DATA_DIR, '.cruise_catalog')
+EARTH_RADIUS_KM = 6371.0
+
+
+def lonlat_to_xyz(lon, lat):
+    '''
+    Convert longitude and latitude to Cartesian coordinates on the Earth
+
+    Inputs: longitude and latitude in degrees (arrays)
+    Returns: (N, 3) array of x, y, z in km
+    '''
+
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    return EARTH_RADIUS_KM * np.column_stack([np.cos(lat) * np.cos(lon),
+                                              np.cos(lat) * np.sin(lon),
+                                              np.sin(lat)])
+
+
+def _chord(distance_km):
+    '''Straight-line distance between two points a great-circle distance apart.'''
+    return 2 * EARTH_RADIUS_KM * np.sin(distance_km / (2 * EARTH_RADIUS_KM))
+
+
+def _to_ns(t):
+    '''Times (strings or datetimes) as int64 nanoseconds.'''
+    return np.datetime64(pd.Timestamp(t), 'ns').astype(np.int64)
+
+
+def _in_lon_range(lon, lon_range):
+    '''Longitude range test that also works across the dateline (e.g. 170, -170).'''
+
+    lon0, lon1 = lon_range
+    if lon0 <= lon1:
+        return (lon >= lon0) & (lon <= lon1)
+    return (lon >= lon0) | (lon <= lon1)
+
+
+class CruiseCatalog:
+    '''
+    Persistent index of the bottles in a collection of WHP-exchange files
+
+    Inputs:
+        catalog_dir - directory where the catalog is saved
+        cache_dir - directory of the columnar copies of the files
+    '''
+
+    def __init__(self, catalog_dir=CATALOG_DIR, cache_dir=CACHE_DIR):
+        self.catalog_dir = catalog_dir
+        self.cache_dir = cache_dir
+        self.cruises = []
+        self.coords = {'lat': np.zeros(0), 'lon': np.zeros(0),
+                       'pressure': np.zeros(0),
+                       'time': np.zeros(0, dtype=np.int64),
+                       'cruise': np.zeros(0, dtype=np.int32),
+                       'row': np.zeros(0, dtype=np.int64)}
+        self._tree = None
+
+        catalog_file = os.path.join(catalog_dir, 'catalog.json')
+        if os.path.isfile(catalog_file):
+            with open(catalog_file) as f:
+                self.cruises = json.load(f)
+            with np.load(os.path.join(catalog_dir, 'coords.npz')) as f:
+                self.coords = {k: f[k] for k in f.files}
+
+    def __len__(self):
+        return len(self.coords['row'])
+
+    def save(self):
+        '''Write the catalog to catalog_dir.'''
+
+        os.makedirs(self.catalog_dir, exist_ok=True)
+        np.savez(os.path.join(self.catalog_dir, 'coords.npz'), **self.coords)
+        with open(os.path.join(self.catalog_dir, 'catalog.json'), 'w') as f:
+            json.dump(self.cruises, f, indent=1)
+
+    def add(self, file_name, header=None, save=True):
+        '''
+        Add a WHP-exchange file to the catalog
+
+        If the file changed since it was added, its bottles are replaced by
+        those of the new contents.
+
+        Inputs:
+            file_name - path to the exchange (.csv) file
+            header - row number of the column names (None to find it)
+            save - write the catalog to disk after adding the file
+        Returns: number of the cruise in the catalog
+        '''
+
+        entry = exchange_cache_entry(file_name, header, cache_dir=self.cache_dir)
+        key = os.path.basename(entry)
+        for i, cruise in enumerate(self.cruises):
+            if cruise['key'] == key:
+                return i
+
+        # a file that changed since it was added replaces its old bottles
+        for i, cruise in enumerate(self.cruises):
+            if (os.path.abspath(cruise['file_name']) == os.path.abspath(file_name)
+                    and cruise['header'] == header):
+                break
+        else:
+            i = len(self.cruises)
+            self.cruises.append({'file_name': file_name, 'header': header})
+        self._index_cruise(i, entry)
+
+        if save:
+            self.save()
+        return i
+
+    def _index_cruise(self, i, entry):
+        '''Replace the bottles of cruise i with those of a cache entry.'''
+
+        df = load_cached_frame(entry, mmap_mode='r',
+                               columns=['LATITUDE', 'LONGITUDE', 'CTDPRS',
+                                        'DATE_TIME'])
+        self.cruises[i].update({'key': os.path.basename(entry), 'nrows': len(df)})
+
+        time = np.asarray(df['DATE_TIME'], dtype='datetime64[ns]')
+        new = {'lat': np.asarray(df['LATITUDE'], dtype=np.float64),
+               'lon': np.asarray(df['LONGITUDE'], dtype=np.float64),
+               'pressure': np.asarray(df['CTDPRS'], dtype=np.float64),
+               'time': time.astype(np.int64),
+               'cruise': np.full(len(df), i, dtype=np.int32),
+               'row': np.arange(len(df), dtype=np.int64)}
+        old = self.coords['cruise'] == i
+        for k in self.coords:
+            self.coords[k] = np.concatenate([self.coords[k][~old], new[k]])
+        self._tree = None
+
+    def _cruise_entry(self, i):
+        '''
+        Cache entry of cruise i, parsing the file again if its columnar copy
+        was evicted from the cache
+
+        If the file changed since it was added, the new copy has a different
+        key and different rows, so the cruise is indexed again.
+
+        Returns: path of the cache entry, and whether the cruise was indexed
+                 again
+        '''
+
+        info = self.cruises[i]
+        entry = os.path.join(self.cache_dir, info['key'])
+        if os.path.isfile(os.path.join(entry, 'schema.json')):
+            return entry, False
+        entry = exchange_cache_entry(info['file_name'], info['header'],
+                                     cache_dir=self.cache_dir)
+        if os.path.basename(entry) == info['key']:
+            return entry, False
+        self._index_cruise(i, entry)
+        self.save()
+        return entry, True
+
+    @property
+    def tree(self):
+        '''k-d tree over the bottle positions (built the first time it is used).'''
+
+        if self._tree is None:
+            xyz = lonlat_to_xyz(self.coords['lon'], self.coords['lat'])
+            # bottles without a position are put far away from any query
+            xyz[~np.isfinite(xyz).all(axis=1)] = 10 * EARTH_RADIUS_KM
+            self._tree = cKDTree(xyz)
+        return self._tree
+
+    def _box_candidates(self, lat_range, lon_range):
+        '''Rows inside the bounding sphere of a latitude/longitude box.'''
+
+        lon0, lon1 = lon_range
+        if lon1 < lon0:
+            lon1 = lon1 + 360
+        if lon1 - lon0 > 90 or lat_range[1] - lat_range[0] > 90:
+            return np.arange(len(self))
+
+        # sample the box to find its center and the distance to its edges
+        glon, glat = np.meshgrid(np.linspace(lon0, lon1, 17),
+                                 np.linspace(lat_range[0], lat_range[1], 17))
+        xyz = lonlat_to_xyz(glon.ravel(), glat.ravel())
+        center = xyz.mean(axis=0)
+        center = EARTH_RADIUS_KM * center / np.linalg.norm(center)
+        radius = np.max(np.linalg.norm(xyz - center, axis=1))
+        return np.array(self.tree.query_ball_point(center, 1.01 * radius + 1.0),
+                        dtype=np.int64)
+
+    def find(self, lat=None, lon=None, radius_km=None, lat_range=None,
+             lon_range=None, pressure_range=None, time_range=None):
+        '''
+        Find the bottles matching a query
+
+        Inputs:
+            lat, lon, radius_km - center and radius of a circle
+            lat_range, lon_range - (min, max) of a latitude/longitude box
+            pressure_range - (min, max) pressure in dbar
+            time_range - (start, end) as strings or datetimes
+            (all ranges are inclusive; None means no limit)
+        Returns: positions in the catalog of the matching bottles, sorted
+        '''
+
+        if radius_km is not None:
+            center = lonlat_to_xyz([lon], [lat])[0]
+            rows = np.array(self.tree.query_ball_point(center, _chord(radius_km)),
+                            dtype=np.int64)
+        elif lat_range is not None or lon_range is not None:
+            rows = self._box_candidates(lat_range or (-90, 90),
+                                        lon_range or (-180, 180))
+        else:
+            rows = np.arange(len(self))
+        rows = np.sort(rows)
+
+        keep = np.ones(len(rows), dtype=bool)
+        if lat_range is not None:
+            lat_i = self.coords['lat'][rows]
+            keep &= (lat_i >= lat_range[0]) & (lat_i <= lat_range[1])
+        if lon_range is not None:
+            keep &= _in_lon_range(self.coords['lon'][rows], lon_range)
+        if pressure_range is not None:
+            p = self.coords['pressure'][rows]
+            keep &= (p >= pressure_range[0]) & (p <= pressure_range[1])
+        if time_range is not None:
+            t = self.coords['time'][rows]
+            keep &= (t >= _to_ns(time_range[0])) & (t <= _to_ns(time_range[1]))
+
+        return rows[keep]
+
+    def query(self, columns=None, **kwargs):
+        '''
+        Read the bottles matching a query from the columnar cache
+
+        Files whose columnar copies were evicted from the cache are parsed
+        again, and indexed again if they changed since they were added.
+
+        Inputs:
+            columns - list of columns to read (default: all of them)
+            kwargs - query arguments, see find
+        Returns: Pandas dataframe with the matching bottles of every cruise,
+                 with the source file in a 'file_name' column
+        '''
+
+        found = self.find(**kwargs)
+        entries = {}
+        reindexed = True
+        while reindexed:
+            reindexed = False
+            for i in np.unique(self.coords['cruise'][found]):
+                if i not in entries:
+                    entries[i], changed = self._cruise_entry(i)
+                    reindexed |= changed
+            if reindexed:
+                # the rows of a changed file are different: search again
+                found = self.find(**kwargs)
+
+        cruise = self.coords['cruise'][found]
+        frames = []
+        for i in np.unique(cruise):
+            info = self.cruises[i]
+            rows = self.coords['row'][found[cruise == i]]
+            df = load_cached_frame(entries[i], mmap_mode='r', columns=columns,
+                                   rows=rows)
+            df['file_name'] = info['file_name']
+            frames.append(df)
+
+        if len(frames) == 0:
+            return pd.DataFrame(columns=list(columns or []) + ['file_name'])
+        return pd.concat(frames, ignore_index=True)
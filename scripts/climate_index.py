@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''A module for reading climate index files from the NOAA Physical Sciences
+Laboratory (PSL), e.g. https://psl.noaa.gov/data/climateindices/list/
+
+The files have a line with the first and last year, one line per year with
+the twelve monthly values, a line with the missing value, and a few lines of
+description. For a description of the format see:
+https://psl.noaa.gov/gcos_wgsp/Timeseries/standard/
+
+read_psl parses a file in one pass and returns the values as a year x month
+array, with a mask of the missing values. Parsed files are cached by the
+hash of their contents. read_psl_file is a drop-in replacement for the
+function in the Poisson regression notes, and load_psl_directory loads many
+indices into one xarray Dataset:
+
+    ds = load_psl_directory('data/tropical-storms')
+    ds['soi'].sel(month=[5, 6]).mean('month')
+'''
+
+import os
+import glob
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from exchange import DATA_DIR
+
+CACHE_DIR = os.path.join(DATA_DIR, '.psl_cache')
+
+# files already read in this session, keyed by the hash of their contents
+_parsed = {}
+
+
+def parse_psl(text):
+    '''
+    Parse the contents of a PSL file
+
+    Input: contents of the file (string)
+    Returns: dictionary with the 'years' (array), 'values' (years x 12 array,
+             NaN where missing), 'missing' (boolean mask of the missing
+             values), the 'missing_value' flag and the 'description' (the
+             lines after the missing value)
+    '''
+
+    lines = text.splitlines()
+    start_year, end_year = (int(v) for v in lines[0].split()[:2])
+    nyears = end_year - start_year + 1
+    table = np.array(' '.join(lines[1:1 + nyears]).split(), dtype=np.float64)
+    table = table.reshape(nyears, 13)
+    missing_value = float(lines[1 + nyears].split()[0])
+
+    values = table[:, 1:]
+    missing = values == missing_value
+    values[missing] = np.nan
+    return {'years': table[:, 0].astype(np.int64), 'values': values,
+            'missing': missing, 'missing_value': missing_value,
+            'description': '\n'.join(line.strip() for line in lines[2 + nyears:]
+                                     if line.strip())}
+
+
+def read_psl(psl_file, cache_dir=CACHE_DIR):
+    '''
+    Read a PSL file, using the parsed copy if the file was read before
+
+    Parsed files are kept in memory and, if cache_dir is given, saved to
+    disk, both keyed by the hash of the file contents, so a file that
+    changes is parsed again. (For the usual monthly files parsing is about
+    as fast as loading from disk; the disk cache pays off for long files.)
+
+    Inputs:
+        psl_file - path to the PSL data file
+        cache_dir - directory of the cache (None for no disk cache)
+    Returns: dictionary, see parse_psl (the arrays are shared between
+             calls, so copy them before modifying them)
+    '''
+
+    with open(psl_file, 'rb') as f:
+        contents = f.read()
+    key = hashlib.sha1(contents).hexdigest()
+    if key in _parsed:
+        return _parsed[key]
+
+    cache_file = None if cache_dir is None else os.path.join(cache_dir, key + '.npz')
+    if cache_file is not None and os.path.isfile(cache_file):
+        with np.load(cache_file) as f:
+            result = {k: f[k] for k in f.files}
+        result['missing_value'] = float(result['missing_value'])
+        result['description'] = str(result['description'])
+    else:
+        result = parse_psl(contents.decode())
+        if cache_file is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_file = cache_file + '.tmp.npz'
+            np.savez(tmp_file, **result)
+            os.replace(tmp_file, cache_file)
+
+    for k in ('years', 'values', 'missing'):
+        result[k].flags.writeable = False
+    _parsed[key] = result
+    return result
+
+
+def read_psl_file(psl_file):
+    '''
+    Read a data file in NOAA Physical Sciences Laboratory (PSL) format
+
+    Input: String containing the path to a PSL data file
+    Returns: Pandas dataframe with monthly data in columns and the year as the index
+    '''
+
+    result = read_psl(psl_file)
+    df = pd.DataFrame(result['values'].copy(), columns=np.arange(1, 13),
+                      index=pd.Index(result['years'], name='year'))
+    return df
+
+
+def load_psl_directory(directory, pattern='*.data', cache_dir=CACHE_DIR):
+    '''
+    Load all of the PSL files in a directory into one xarray Dataset
+
+    Inputs:
+        directory - directory containing the files
+        pattern - file name pattern of the PSL files
+        cache_dir - directory of the cache (None for no cache)
+    Returns: xarray Dataset with one (year, month) variable per file, named
+             after the file (e.g. soi for soi.data), on the union of the
+             years of all the files (NaN where a file has no data), with the
+             description of each file as an attribute
+    '''
+
+    import xarray as xr
+
+    indices = {}
+    for psl_file in sorted(glob.glob(os.path.join(directory, pattern))):
+        name = os.path.splitext(os.path.basename(psl_file))[0]
+        indices[name] = read_psl(psl_file, cache_dir)
+
+    years = np.unique(np.concatenate([r['years'] for r in indices.values()])
+                      if indices else np.zeros(0, dtype=np.int64))
+    data_vars = {}
+    for name, result in indices.items():
+        values = np.full((len(years), 12), np.nan)
+        values[np.searchsorted(years, result['years'])] = result['values']
+        data_vars[name] = (('year', 'month'), values,
+                           {'description': result['description'],
+                            'missing_value': result['missing_value']})
+    return xr.Dataset(data_vars, coords={'year': years, 'month': np.arange(1, 13)})
+
+
+if __name__ == '__main__':
+    import time
+
+    directory = 'data/tropical-storms'
+    soi_file = os.path.join(directory, 'soi.data')
+
+    t0 = time.perf_counter()
+    n = 200
+    for i in range(n):
+        with open(soi_file) as f:
+            parse_psl(f.read())
+    t1 = time.perf_counter()
+    for i in range(n):
+        read_psl(soi_file)
+    t2 = time.perf_counter()
+    ds = load_psl_directory(directory)
+    t3 = time.perf_counter()
+
+    print('parse:       {:8.1f} us'.format(1e6*(t1-t0)/n))
+    print('cached read: {:8.1f} us'.format(1e6*(t2-t1)/n))
+    print('directory:   {:8.1f} ms'.format(1e3*(t3-t2)))
+    print(ds)
+    print(ds.sel(month=[5, 6]).mean('month').to_dataframe().dropna().tail())
@@ -0,0 +1,75 @@
+import os
+import sys
+
+import pytest
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPTS_DIR)
+
+DATA_DIR = os.path.join(os.path.dirname(SCRIPTS_DIR), 'data')
+FILE07 = os.path.join(DATA_DIR, 'wcoa_cruise_2007', '32WC20070511.exc.csv')
+FILE13 = os.path.join(DATA_DIR, 'wcoa_cruise', 'WCOA2013_hy1.csv')
+STORMS_DIR = os.path.join(DATA_DIR, 'tropical-storms')
+
+
+@pytest.fixture(scope='session')
+def file07():
+    return FILE07
+
+
+@pytest.fixture(scope='session')
+def file13():
+    return FILE13
+
+
+@pytest.fixture(scope='session')
+def storms_dir():
+    return STORMS_DIR
+
+
+@pytest.fixture(scope='session', autouse=True)
+def psl_cache_dir(tmp_path_factory):
+    '''Keep the PSL files parsed by read_psl_file out of the data directory.'''
+
+    import climate_index
+    cache_dir = str(tmp_path_factory.mktemp('psl_cache'))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(climate_index.read_psl, '__defaults__', (cache_dir,))
+        yield cache_dir
+
+
+@pytest.fixture(scope='session')
+def df07():
+    from exchange import read_exchange
+    return read_exchange(FILE07)
+
+
+@pytest.fixture
+def trawl_file(tmp_path):
+    '''Small synthetic file laid out like the trawl specimen netCDF file.'''
+
+    import numpy as np
+    import netCDF4 as nc4
+
+    rng = np.random.default_rng(0)
+    n = 5000
+    species = np.array(['Engraulis mordax', 'Sardinops sagax',
+                        'Icichthys lockingtoni', 'Trachurus symmetricus'])
+    name = species[rng.integers(0, len(species), n)]
+    length = rng.uniform(20, 180, n).astype(np.float32)
+    length[rng.random(n) < 0.02] = 1e9
+    weight = (1e-5 * length.astype(np.float64)**3).astype(np.float32)
+    weight[rng.random(n) < 0.05] = np.nan
+
+    file_name = str(tmp_path / 'trawl.nc')
+    with nc4.Dataset(file_name, 'w') as ds:
+        ds.createDimension('row', n)
+        ds.createDimension('name_strlen', 24)
+        v = ds.createVariable('scientific_name', 'S1', ('row', 'name_strlen'))
+        v._Encoding = 'ascii'
+        v[:] = name.astype('S24')
+        ds.createVariable('weight', 'f4', ('row',), fill_value=np.nan)[:] = weight
+        ds.createVariable('standard_length', 'f4', ('row',),
+                          fill_value=np.nan)[:] = length
+        ds.createVariable('cruise', 'i4', ('row',))[:] = rng.integers(0, 12, n)
+    return file_name
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''A module for derived variables of bottle data, computed only when needed.
+
+Derived variables like the temperature in Fahrenheit (CTDTMP_F), the
+aragonite saturation state (OmegaA) or a region label are registered once,
+together with the columns they depend on:
+
+    @register('CTDTMP_F', ['CTDTMP'])
+    def ctdtmp_f(CTDTMP):
+        return 9/5*CTDTMP + 32
+
+Wrapping a DataFrame in a DerivedFrame makes the derived variables available
+as if they were columns. Each one is computed the first time it is used and
+kept until one of the columns it depends on changes:
+
+    dfd = DerivedFrame(df07)
+    dfd['OmegaA']        # runs PyCO2SYS
+    dfd['OmegaA']        # cached
+    dfd['CTDTMP'] = ...  # OmegaA and CTDTMP_F will be recomputed, but not region
+'''
+
+import numpy as np
+import pandas as pd
+
+# name -> (list of dependencies, function)
+DERIVED = {}
+
+
+def register(name, depends, registry=DERIVED):
+    '''
+    Decorator that registers a function computing a derived variable
+
+    Inputs:
+        name - name of the derived variable
+        depends - list of the columns (or other derived variables) it uses;
+                  they are passed to the function as arguments, in order
+        registry - dictionary to add the variable to
+    Returns: the decorator
+    '''
+
+    def decorator(func):
+        registry[name] = (list(depends), func)
+        return func
+    return decorator
+
+
+@register('CTDTMP_F', ['CTDTMP'])
+def ctdtmp_f(CTDTMP):
+    '''CTD temperature in degrees F.'''
+    return 9/5*CTDTMP + 32
+
+
+@register('OmegaA', ['ALKALI', 'TCARBN', 'CTDSAL', 'CTDTMP', 'CTDPRS'])
+def omega_a(ALKALI, TCARBN, CTDSAL, CTDTMP, CTDPRS):
+    '''Aragonite saturation state from alkalinity and DIC (PyCO2SYS).'''
+
+    from carbonate import co2sys_cached
+
+    df = pd.DataFrame({'ALKALI': ALKALI, 'TCARBN': TCARBN, 'CTDSAL': CTDSAL,
+                       'CTDTMP': CTDTMP, 'CTDPRS': CTDPRS})
+    return co2sys_cached(df)['saturation_aragonite']
+
+
+@register('is_northern', ['LATITUDE'])
+def is_northern(LATITUDE):
+    '''True north of 40.4 N (Cape Mendocino).'''
+    return LATITUDE > 40.4
+
+
+@register('region', ['LATITUDE'])
+def region(LATITUDE):
+    '''Region label: north of 46.2 N, south of 37.8 N or central.'''
+
+    labels = np.where(LATITUDE > 46.2, 'north',
+                      np.where(LATITUDE < 37.8, 'south', 'central'))
+    labels = np.where(np.isnan(LATITUDE), None, labels)
+    return pd.Categorical(labels, categories=['north', 'central', 'south'])
+
+
+class DerivedFrame:
+    '''
+    A DataFrame together with derived variables that are computed on demand
+
+    Inputs:
+        df - DataFrame with the measured columns
+        registry - dictionary of derived variables (default: DERIVED)
+    '''
+
+    def __init__(self, df, registry=None):
+        self.df = df
+        self.registry = DERIVED if registry is None else registry
+        # version number of each column, increased when it is replaced
+        self._versions = {}
+        # name -> (values, versions of the columns they were computed from)
+        self._cache = {}
+        self._computing = []
+
+    def __len__(self):
+        return len(self.df)
+
+    def __contains__(self, name):
+        return name in self.df.columns or name in self.registry
+
+    @property
+    def columns(self):
+        '''Measured columns followed by the derived variables not in df.'''
+        return list(self.df.columns) + [n for n in self.registry
+                                        if n not in self.df.columns]
+
+    def inputs(self, name):
+        '''Measured columns that a derived variable depends on (recursively).'''
+
+        if name in self.df.columns:
+            return {name}
+        if name not in self.registry:
+            raise KeyError(name)
+        columns = set()
+        for dep in self.registry[name][0]:
+            columns |= self.inputs(dep)
+        return columns
+
+    def _input_versions(self, name):
+        return {c: self._versions.get(c, 0) for c in self.inputs(name)}
+
+    def is_cached(self, name):
+        '''True if a derived variable is computed and up to date.'''
+
+        return (name in self._cache and
+                self._cache[name][1] == self._input_versions(name))
+
+    def __getitem__(self, name):
+        if isinstance(name, list):
+            return pd.DataFrame({n: self[n] for n in name}, index=self.df.index)
+
+        if name in self.df.columns:
+            return self.df[name]
+        if name not in self.registry:
+            raise KeyError(name)
+
+        if self.is_cached(name):
+            return self._cache[name][0]
+
+        if name in self._computing:
+            raise ValueError('circular dependency: ' +
+                             ' -> '.join(self._computing + [name]))
+        self._computing.append(name)
+        try:
+            depends, func = self.registry[name]
+            args = [self[dep] for dep in depends]
+            values = pd.Series(func(*args), index=self.df.index, name=name)
+        finally:
+            self._computing.pop()
+
+        self._cache[name] = (values, self._input_versions(name))
+        return values
+
+    def __setitem__(self, name, values):
+        self.df[name] = values
+        self._versions[name] = self._versions.get(name, 0) + 1
+
+    def invalidate(self, name=None):
+        '''
+        Mark a column as changed, so that variables depending on it are
+        recomputed. Use this after modifying self.df directly (changes made
+        through dfd[name] = values are tracked automatically). With no name,
+        every derived variable is recomputed.
+        '''
+
+        if name is None:
+            self._cache = {}
+        else:
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+    def to_frame(self, names=None):
+        '''
+        DataFrame with the measured columns and some derived variables
+
+        Input: list of derived variables to include (default: none)
+        Returns: Pandas dataframe
+        '''
+
+        df = self.df.copy()
+        for name in (names or []):
+            df[name] = self[name]
+        return df
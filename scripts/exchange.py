@@ -0,0 +1,625 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''A module for reading WHP-exchange bottle files, like the WCOA cruise data.'''
+
+import os
+import json
+import hashlib
+import fnmatch
+
+import numpy as np
+import pandas as pd
+
+# data directory of the repository (the parent of scripts/), so the caches
+# are in the same place whatever the working directory
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'data')
+CACHE_DIR = os.path.join(DATA_DIR, '.exchange_cache')
+CACHE_VERSION = 2
+
+# hashes of the files seen in this session, with the size and modification
+# time they had when they were hashed
+_file_hashes = {}
+
+# compact types for the columns of an exchange file, used by compact_dtypes
+# ('integer' means the smallest integer type that holds the values)
+EXCHANGE_SCHEMA = {'*_FLAG_W': 'int8',
+                   'EXPOCODE': 'category',
+                   'SECT_ID': 'category',
+                   'LINE': 'category',
+                   'LEG': 'integer',
+                   'STNNBR': 'integer',
+                   'CASTNO': 'integer',
+                   'SAMPNO': 'integer',
+                   'BTLNBR': 'integer'}
+
+
+def find_exchange_header(file_name):
+    '''
+    Locate the column names and units in a WHP-exchange file
+
+    The first line of an exchange file is a stamp (e.g. BOTTLE,20160715...),
+    followed by comment lines starting with #, a line of column names and a
+    line of units. Some files (like the 2013 WCOA cruise) put the units
+    before the column names; units lines are recognized by an empty first
+    field.
+
+    Input: path to the exchange (.csv) file
+    Returns: dictionary with the column 'names', their 'units' and the number
+             of lines to skip ('skiprows') to get to the first line of data
+    '''
+
+    names = None
+    units = None
+    with open(file_name, newline=None) as f:
+        for i, line in enumerate(f):
+            fields = [field.strip() for field in line.strip().split(',')]
+            if i == 0 and fields[0] in ('BOTTLE', 'CTD'):
+                continue
+            elif fields[0].startswith('#') or fields == ['']:
+                continue
+            elif fields[0] == '':
+                units = fields
+            elif names is None:
+                names = fields
+            else:
+                break
+
+    if names is None:
+        raise ValueError('no column names found in ' + file_name)
+
+    if units is None:
+        units = [''] * len(names)
+
+    return {'names': names, 'units': units[:len(names)], 'skiprows': i}
+
+
+def _parse_date(text):
+    '''
+    Day number (since 1970-01-01) of one date string in an exchange file:
+    M/D/YYYY, M/D/YY (years before 70 are 20YY), YYYY-MM-DD or YYYYMMDD.
+    Returns None if the date cannot be read.
+    '''
+
+    text = str(text).strip()
+    try:
+        if '/' in text:
+            month, day, year = [int(x) for x in text.split('/')]
+            if year < 100:
+                year = year + 2000 if year < 70 else year + 1900
+        elif '-' in text:
+            year, month, day = [int(x) for x in text.split('-')]
+        else:
+            value = int(float(text))
+            year, month, day = value // 10000, value // 100 % 100, value % 100
+        date = np.datetime64('{:04d}-{:02d}-{:02d}'.format(year, month, day), 'D')
+    except ValueError:
+        return None
+    return date.astype(np.int64)
+
+
+def _parse_time(text):
+    '''
+    Hours, minutes and seconds of one time string in an exchange file:
+    H:MM:SS, H:MM or HHMM. Returns None if the time cannot be read.
+    '''
+
+    text = str(text).strip()
+    try:
+        if ':' in text:
+            parts = [int(x) for x in text.split(':')] + [0]
+            return parts[0], parts[1], parts[2]
+        value = int(float(text))
+        if len(text.split('.')[0]) > 4:
+            return value // 10000, value // 100 % 100, value % 100
+        return value // 100, value % 100, 0
+    except ValueError:
+        return None
+
+
+def parse_exchange_datetime(dates, times=None):
+    '''
+    Combine the DATE and TIME columns of an exchange file into datetimes
+
+    Cruise files have few distinct dates and times compared to the number of
+    bottles, so each distinct string is parsed only once, and the dates and
+    times are combined with integer arithmetic on nanoseconds.
+
+    Inputs:
+        dates - array of dates (M/D/YYYY, M/D/YY, YYYY-MM-DD or YYYYMMDD)
+        times - array of times (H:MM:SS, H:MM or HHMM), or None for midnight
+    Returns: numpy datetime64[ns] array (NaT where the date or time is missing)
+    '''
+
+    date_codes, date_uniques = pd.factorize(np.asarray(dates), use_na_sentinel=True)
+    day = np.array([_parse_date(d) for d in date_uniques] + [None], dtype=object)
+    valid = np.array([d is not None for d in day])
+    day_ns = np.where(valid, day, 0).astype(np.int64) * 86400 * 10**9
+    ok = valid[date_codes]
+    ns = day_ns[date_codes]
+
+    if times is not None:
+        time_codes, time_uniques = pd.factorize(np.asarray(times),
+                                                use_na_sentinel=True)
+        hms = [_parse_time(t) for t in time_uniques]
+        valid = np.array([t is not None for t in hms] + [False])
+        hms = np.array([t if t is not None else (0, 0, 0) for t in hms] +
+                       [(0, 0, 0)], dtype=np.int64).reshape(-1, 3)
+        time_ns = ((hms[:, 0] * 60 + hms[:, 1]) * 60 + hms[:, 2]) * 10**9
+        ok = ok & valid[time_codes]
+        ns = ns + time_ns[time_codes]
+
+    # code -1 (missing) picks the last entry, which is marked not valid
+    result = ns.view('datetime64[ns]').copy()
+    result[~ok] = np.datetime64('NaT')
+    return result
+
+
+def _combine_date_time(df, date_cols):
+    '''Replace the date and time columns with one datetime column in front.'''
+
+    date_col, time_col = date_cols
+    date_time = parse_exchange_datetime(df[date_col], df[time_col])
+    df = df.drop(columns=[date_col, time_col])
+    df.insert(0, date_col + '_' + time_col, date_time)
+    return df
+
+
+def _drop_end_data(df):
+    '''Truncate a chunk at the END_DATA line. Returns the chunk and whether
+    END_DATA was found.'''
+
+    end = np.flatnonzero(df.iloc[:, 0].astype(str).str.strip() == 'END_DATA')
+    if len(end) > 0:
+        return df.iloc[:end[0]], True
+    return df, False
+
+
+def compact_dtypes(df, float32=False, schema=EXCHANGE_SCHEMA):
+    '''
+    Convert the columns of a bottle data table to compact types
+
+    Quality flags become int8, identifiers like EXPOCODE become categorical,
+    and station/cast/bottle numbers become the smallest integer type that
+    holds them. Columns with missing values are given a nullable integer
+    type (e.g. Int8) instead. Other text columns are also made categorical.
+
+    Inputs:
+        df - DataFrame with bottle data
+        float32 - also store the float64 measurement columns as float32
+        schema - dictionary of column names (or patterns like *_FLAG_W)
+                 and their types: 'int8', 'integer' or 'category'
+    Returns: new Pandas dataframe
+    '''
+
+    out = {}
+    for name in df.columns:
+        values = df[name]
+        kind = None
+        for pattern, pattern_kind in schema.items():
+            if fnmatch.fnmatchcase(name, pattern):
+                kind = pattern_kind
+                break
+
+        if kind == 'category' or (kind is None and
+                                  (values.dtype == object or
+                                   pd.api.types.is_string_dtype(values.dtype))):
+            values = values.astype('category')
+        elif kind in ('int8', 'integer') and pd.api.types.is_numeric_dtype(values):
+            whole = values.dropna()
+            if (whole == np.round(whole)).all():
+                if kind == 'int8':
+                    target = np.dtype(np.int8)
+                else:
+                    target = pd.to_numeric(whole.astype(np.int64),
+                                           downcast='integer').dtype
+                if values.isna().any():
+                    values = values.astype(pd.api.types.pandas_dtype(
+                        target.name.capitalize()))
+                else:
+                    values = values.astype(target)
+        elif float32 and values.dtype == np.float64:
+            values = values.astype(np.float32)
+        out[name] = values
+
+    return pd.DataFrame(out, index=df.index)
+
+
+def memory_report(before, after):
+    '''
+    Compare the memory used by each column of two versions of a table
+
+    Inputs: DataFrames before and after compact_dtypes
+    Returns: Pandas dataframe with the type and size (MB) of each column,
+             and a TOTAL row
+    '''
+
+    mb_before = before.memory_usage(deep=True, index=False) / 2**20
+    mb_after = after.memory_usage(deep=True, index=False) / 2**20
+    report = pd.DataFrame({'dtype_before': before.dtypes.astype(str),
+                           'dtype_after': after.dtypes.astype(str),
+                           'MB_before': mb_before, 'MB_after': mb_after})
+    report.loc['TOTAL'] = ['', '', mb_before.sum(), mb_after.sum()]
+    report['ratio'] = report['MB_after'] / report['MB_before']
+    return report
+
+
+def read_exchange(file_name, header=None, na_values=-999,
+                  date_cols=('DATE', 'TIME'), compact=False, float32=False):
+    '''
+    Read a WHP-exchange bottle file into a pandas DataFrame
+
+    Inputs:
+        file_name - path to the exchange (.csv) file
+        header - row number of the column names (e.g. 29 for the 2007 cruise,
+                 31 for the 2013 cruise), or None to find it automatically
+        na_values - missing value flag in the file
+        date_cols - names of the date and time columns, which are combined
+                    into a single DATE_TIME column (like parse_dates=[[6,7]])
+        compact - convert the columns to compact types (see compact_dtypes)
+        float32 - with compact=True, also store measurements as float32
+    Returns: Pandas dataframe with one row per bottle
+    '''
+
+    if header is None:
+        info = find_exchange_header(file_name)
+        df = pd.read_csv(file_name, skiprows=info['skiprows'], header=None,
+                         names=info['names'], na_values=na_values,
+                         skipinitialspace=True)
+    else:
+        df = pd.read_csv(file_name, header=header, na_values=na_values)
+    df, _ = _drop_end_data(df)
+
+    if date_cols is not None:
+        df = _combine_date_time(df, date_cols)
+
+    if compact:
+        df = compact_dtypes(df, float32=float32)
+
+    return df
+
+
+def iter_exchange(file_name, chunksize=100000, na_values=-999,
+                  date_cols=('DATE', 'TIME'), dtype=None):
+    '''
+    Read a WHP-exchange bottle file in chunks of a fixed number of rows
+
+    The header is found automatically with find_exchange_header and reading
+    stops at the END_DATA line. Every chunk has the same columns and types:
+    numeric columns are read as float64 (so that missing values, which are
+    converted to NaN, do not change the type from one chunk to the next) and
+    the other columns are read as strings.
+
+    Inputs:
+        file_name - path to the exchange (.csv) file
+        chunksize - number of rows in each chunk (the last one may be shorter)
+        na_values - missing value flag in the file
+        date_cols - date and time columns to combine into a DATE_TIME column,
+                    or None to leave them as strings
+        dtype - optional dictionary of column types, overriding the ones
+                inferred from the first rows of the file
+    Yields: Pandas dataframes with up to chunksize rows
+    '''
+
+    info = find_exchange_header(file_name)
+    read_args = dict(skiprows=info['skiprows'], header=None,
+                     names=info['names'], na_values=na_values,
+                     skipinitialspace=True)
+
+    # infer the column types from the start of the file
+    sample, _ = _drop_end_data(pd.read_csv(file_name, nrows=1000, **read_args))
+    types = {}
+    for name in info['names']:
+        if date_cols is not None and name in date_cols:
+            types[name] = str
+        elif pd.api.types.is_numeric_dtype(sample[name]):
+            types[name] = np.float64
+        else:
+            types[name] = str
+    if dtype is not None:
+        types.update(dtype)
+
+    with pd.read_csv(file_name, chunksize=chunksize, dtype=types,
+                     **read_args) as reader:
+        for chunk in reader:
+            chunk, at_end = _drop_end_data(chunk)
+            if len(chunk) > 0:
+                if date_cols is not None:
+                    chunk = _combine_date_time(chunk, date_cols)
+                yield chunk
+            if at_end:
+                break
+
+
+def file_hash(file_name, block_size=2**20):
+    '''
+    Compute the SHA-1 hash of a file's contents
+
+    The hash is remembered for the rest of the session, and the file is only
+    read again if its size or modification time changes.
+
+    Input: path to a file
+    Returns: hexadecimal digest string
+    '''
+
+    stat = os.stat(file_name)
+    path = os.path.abspath(file_name)
+    known = _file_hashes.get(path)
+    if known is not None and known[:2] == (stat.st_size, stat.st_mtime_ns):
+        return known[2]
+
+    h = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    _file_hashes[path] = (stat.st_size, stat.st_mtime_ns, h.hexdigest())
+    return h.hexdigest()
+
+
+def _cache_key(file_name, **options):
+    '''Cache key built from the file contents and the options used to parse it.'''
+
+    h = hashlib.sha1(file_hash(file_name).encode())
+    h.update(json.dumps(options, sort_keys=True, default=str).encode())
+    h.update(str(CACHE_VERSION).encode())
+    return h.hexdigest()
+
+
+def _save_column(path, values):
+    '''Save one column as a .npy file and return its schema entry.'''
+
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        np.save(path, values.cat.codes.to_numpy())
+        categories = values.cat.categories.to_numpy()
+        if categories.dtype == object:
+            categories = categories.astype(str)
+        np.save(path.replace('.npy', '_categories.npy'), categories)
+        return {'kind': 'category'}
+    elif values.dtype == object or pd.api.types.is_string_dtype(values.dtype):
+        isnull = values.isna().to_numpy()
+        np.save(path, values.fillna('').to_numpy().astype(str))
+        np.save(path.replace('.npy', '_isnull.npy'), isnull)
+        return {'kind': 'string'}
+    elif pd.api.types.is_extension_array_dtype(values.dtype):
+        # nullable integers (e.g. Int8): values and a mask of missing entries
+        np.save(path, values.to_numpy(dtype=values.dtype.numpy_dtype,
+                                      na_value=0))
+        np.save(path.replace('.npy', '_isnull.npy'), values.isna().to_numpy())
+        return {'kind': 'masked'}
+    else:
+        np.save(path, values.to_numpy())
+        return {'kind': 'array'}
+
+
+def _load_column(path, kind, mmap_mode=None):
+    '''Load one column saved with _save_column.'''
+
+    if kind == 'category':
+        codes = np.load(path, mmap_mode=mmap_mode)
+        categories = np.load(path.replace('.npy', '_categories.npy'))
+        return pd.Categorical.from_codes(codes, categories)
+    elif kind == 'string':
+        values = np.load(path).astype(object)
+        values[np.load(path.replace('.npy', '_isnull.npy'))] = np.nan
+        return values
+    elif kind == 'masked':
+        return pd.arrays.IntegerArray(np.load(path),
+                                      np.load(path.replace('.npy', '_isnull.npy')))
+    else:
+        return np.load(path, mmap_mode=mmap_mode)
+
+
+def _entry_size(entry_dir):
+    return sum(os.path.getsize(os.path.join(entry_dir, f))
+               for f in os.listdir(entry_dir))
+
+
+def evict_cache(cache_dir=CACHE_DIR, max_cache_mb=1024, keep=()):
+    '''
+    Remove least recently used entries until the cache fits within a size limit
+
+    Inputs:
+        cache_dir - directory containing the cached columnar files
+        max_cache_mb - maximum total size of the cache in megabytes
+        keep - cache keys that are never removed
+    Returns: list of removed cache keys
+    '''
+
+    if not os.path.isdir(cache_dir):
+        return []
+
+    entries = []
+    for key in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, key)
+        schema_file = os.path.join(entry_dir, 'schema.json')
+        if os.path.isfile(schema_file):
+            entries.append((os.path.getmtime(schema_file), key,
+                            _entry_size(entry_dir)))
+
+    # oldest entries first
+    entries.sort()
+    total = sum(size for _, _, size in entries)
+    removed = []
+    for _, key, size in entries:
+        if total <= max_cache_mb * 2**20:
+            break
+        if key in keep:
+            continue
+        entry_dir = os.path.join(cache_dir, key)
+        for f in os.listdir(entry_dir):
+            os.remove(os.path.join(entry_dir, f))
+        os.rmdir(entry_dir)
+        total = total - size
+        removed.append(key)
+
+    return removed
+
+
+def save_cached_frame(df, entry_dir):
+    '''
+    Write a DataFrame to a directory of .npy column files
+
+    Inputs:
+        df - DataFrame to save
+        entry_dir - output directory, created if it does not exist
+    '''
+
+    tmp_dir = entry_dir + '.tmp' + str(os.getpid())
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    columns = []
+    for i, name in enumerate(df.columns):
+        kind = _save_column(os.path.join(tmp_dir, str(i) + '.npy'), df[name])
+        columns.append({'name': name, 'kind': kind['kind']})
+
+    with open(os.path.join(tmp_dir, 'schema.json'), 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'columns': columns}, f)
+
+    # rename at the end so that a partially written entry is never read
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        for f in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, f))
+        os.rmdir(tmp_dir)
+
+
+def load_cached_frame(entry_dir, mmap_mode=None, columns=None, rows=None):
+    '''
+    Read a DataFrame written with save_cached_frame
+
+    Inputs:
+        entry_dir - directory of .npy column files
+        mmap_mode - memory-map mode passed to np.load: None reads the columns
+                    into memory, 'r' maps them read-only (the dataframe can't
+                    be modified) and 'c' maps them copy-on-write
+        columns - list of columns to read (default: all of them)
+        rows - optional row numbers to read; with memory mapping, only the
+               parts of the files containing these rows are read from disk
+    Returns: Pandas dataframe
+    '''
+
+    with open(os.path.join(entry_dir, 'schema.json')) as f:
+        schema = json.load(f)
+
+    data = {}
+    for i, col in enumerate(schema['columns']):
+        if columns is not None and col['name'] not in columns:
+            continue
+        path = os.path.join(entry_dir, str(i) + '.npy')
+        values = _load_column(path, col['kind'], mmap_mode)
+        data[col['name']] = values if rows is None else values[rows]
+
+    df = pd.DataFrame(data, copy=False)
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    return df
+
+
+def exchange_cache_entry(file_name, header=None, na_values=-999,
+                         date_cols=('DATE', 'TIME'), compact=False,
+                         float32=False, cache_dir=CACHE_DIR,
+                         max_cache_mb=1024):
+    '''
+    Make sure a WHP-exchange file has a binary columnar copy in the cache
+
+    The first time a file is seen, it is parsed with read_exchange and each
+    column is saved as a .npy file in a cache directory named after the hash
+    of the file contents. If the source file changes, its hash changes and
+    the file is parsed again.
+
+    Inputs:
+        file_name, header, na_values, date_cols, compact, float32 - same as
+            read_exchange
+        cache_dir - directory where the columnar copies are stored
+        max_cache_mb - total size of the cache in megabytes, above which
+                       the least recently used entries are removed
+    Returns: path of the cache entry, which can be read with load_cached_frame
+    '''
+
+    key = _cache_key(file_name, header=header, na_values=na_values,
+                     date_cols=date_cols, compact=compact, float32=float32)
+    entry_dir = os.path.join(cache_dir, key)
+    schema_file = os.path.join(entry_dir, 'schema.json')
+
+    if os.path.isfile(schema_file):
+        # mark the entry as recently used
+        os.utime(schema_file)
+        return entry_dir
+
+    df = read_exchange(file_name, header, na_values=na_values,
+                       date_cols=date_cols, compact=compact, float32=float32)
+    os.makedirs(cache_dir, exist_ok=True)
+    save_cached_frame(df, entry_dir)
+    evict_cache(cache_dir, max_cache_mb, keep=[key])
+
+    return entry_dir
+
+
+def read_exchange_cached(file_name, header=None, na_values=-999,
+                         date_cols=('DATE', 'TIME'), compact=False,
+                         float32=False, cache_dir=CACHE_DIR,
+                         max_cache_mb=1024, mmap_mode=None):
+    '''
+    Read a WHP-exchange bottle file, using a binary columnar copy when possible
+
+    The first read parses the file and saves a copy of each column in the
+    cache (see exchange_cache_entry). Later reads load those files instead
+    of parsing the CSV again.
+
+    Inputs:
+        file_name, header, na_values, date_cols, compact, float32 - same as
+            read_exchange
+        cache_dir - directory where the columnar copies are stored
+        max_cache_mb - total size of the cache in megabytes, above which
+                       the least recently used entries are removed
+        mmap_mode - None to read the columns into memory, or 'r'/'c' to
+                    memory-map them (see load_cached_frame)
+    Returns: Pandas dataframe with one row per bottle
+    '''
+
+    return load_cached_frame(exchange_cache_entry(
+        file_name, header, na_values=na_values, date_cols=date_cols,
+        compact=compact, float32=float32, cache_dir=cache_dir,
+        max_cache_mb=max_cache_mb), mmap_mode=mmap_mode)
+
+
+if __name__ == '__main__':
+    import time
+
+    filename07 = 'data/wcoa_cruise_2007/32WC20070511.exc.csv'
+
+    t0 = time.perf_counter()
+    df07 = read_exchange(filename07)
+    t1 = time.perf_counter()
+    read_exchange_cached(filename07)
+    t2 = time.perf_counter()
+    df07c = read_exchange_cached(filename07)
+    t3 = time.perf_counter()
+    read_exchange_cached(filename07, mmap_mode='r')
+    t4 = time.perf_counter()
+
+    print('parse CSV:    {:.1f} ms'.format(1e3*(t1-t0)))
+    print('first cached: {:.1f} ms'.format(1e3*(t2-t1)))
+    print('cache hit:    {:.1f} ms'.format(1e3*(t3-t2)))
+    print('memory-map:   {:.1f} ms'.format(1e3*(t4-t3)))
+    print('identical:', df07.equals(df07c))
+
+    # memory used by the compact column types
+    print(memory_report(df07, compact_dtypes(df07, float32=True)).loc['TOTAL'])
+
+    # DATE + TIME combination on a million rows
+    info = find_exchange_header(filename07)
+    raw = pd.read_csv(filename07, skiprows=info['skiprows'], header=None,
+                      names=info['names'], usecols=['DATE', 'TIME'])
+    raw = raw.iloc[np.arange(1_000_000) % len(raw)]
+    t0 = time.perf_counter()
+    fast = parse_exchange_datetime(raw['DATE'], raw['TIME'])
+    t1 = time.perf_counter()
+    slow = pd.to_datetime(raw['DATE'] + ' ' + raw['TIME'],
+                          format='%m/%d/%Y %H:%M:%S')
+    t2 = time.perf_counter()
+    print('parse_exchange_datetime: {:.1f} ms'.format(1e3*(t1-t0)))
+    print('pd.to_datetime:          {:.1f} ms'.format(1e3*(t2-t1)))
+    print('identical:', np.array_equal(fast, slow.to_numpy().astype('datetime64[ns]')))
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''A module for fast selections on WOCE quality flags (the *_FLAG_W columns).
+
+Selecting good data from a bottle file usually means combining many flag
+comparisons, like
+
+    ii = ((df07['NITRAT_FLAG_W'] == 2) & (df07['PHSPHT_FLAG_W'] == 2) &
+          (df07['CTDOXY_FLAG_W'] == 2))
+
+A FlagIndex stores one packed bitmap (one bit per row) for every variable and
+flag value, so the same selection is a bitwise AND of a few arrays of 64-bit
+words:
+
+    flags = FlagIndex(df07)
+    ii = flags.rows(['NITRAT', 'PHSPHT', 'CTDOXY'])
+'''
+
+import numpy as np
+
+FLAG_SUFFIX = '_FLAG_W'
+
+# number of set bits in each possible byte, used if np.bitwise_count is missing
+_BYTE_COUNTS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None],
+                             axis=1).sum(axis=1).astype(np.uint8)
+
+
+def _pack(mask):
+    '''Pack a boolean array into 64-bit words (row i is bit i % 64 of word i // 64).'''
+
+    packed = np.packbits(mask, bitorder='little')
+    padded = np.zeros(-(-len(packed) // 8) * 8, dtype=np.uint8)
+    padded[:len(packed)] = packed
+    return padded.view(np.uint64)
+
+
+def popcount(words):
+    '''
+    Count the set bits in an array of packed words
+
+    Input: numpy array of unsigned integers
+    Returns: total number of bits that are 1
+    '''
+
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(words).sum(dtype=np.int64))
+    return int(_BYTE_COUNTS[words.view(np.uint8)].sum(dtype=np.int64))
+
+
+def words_to_rows(words, nrows):
+    '''
+    Convert packed words to the row numbers of the bits that are set
+
+    Inputs:
+        words - packed bitmap from _pack or a FlagIndex query
+        nrows - number of rows in the table
+    Returns: sorted numpy array of row numbers
+    '''
+
+    nonzero = np.flatnonzero(words)
+    if len(nonzero) > len(words) // 8:
+        bits = np.unpackbits(words.view(np.uint8), count=nrows, bitorder='little')
+        return np.flatnonzero(bits.view(bool))
+
+    # sparse selection: only unpack the words that have at least one bit set
+    bits = np.unpackbits(words[nonzero].view(np.uint8), bitorder='little')
+    word_i, bit_i = np.nonzero(bits.reshape(-1, 64))
+    rows = nonzero[word_i] * 64 + bit_i
+    return rows[rows < nrows]
+
+
+class FlagIndex:
+    '''
+    Packed bitmaps of the WOCE quality flags in a bottle data table
+
+    Input: DataFrame (or dictionary of arrays) with *_FLAG_W columns
+    '''
+
+    def __init__(self, df, flag_columns=None):
+        if flag_columns is None:
+            flag_columns = [c for c in df.columns if c.endswith(FLAG_SUFFIX)]
+
+        self.nrows = len(df[flag_columns[0]]) if flag_columns else len(df)
+        self.bitmaps = {}
+        for col in flag_columns:
+            values = np.asarray(df[col])
+            variable = col[:-len(FLAG_SUFFIX)] if col.endswith(FLAG_SUFFIX) else col
+            self.bitmaps[variable] = {}
+            for flag in np.unique(values[~np.isnan(values)] if values.dtype.kind == 'f'
+                                  else values):
+                self.bitmaps[variable][int(flag)] = _pack(values == flag)
+
+    @property
+    def variables(self):
+        return list(self.bitmaps)
+
+    def _variable(self, name):
+        if name.endswith(FLAG_SUFFIX):
+            name = name[:-len(FLAG_SUFFIX)]
+        if name not in self.bitmaps:
+            raise KeyError('no flag column for ' + name)
+        return name
+
+    def bitmap(self, variable, flags=2):
+        '''
+        Packed bitmap of the rows where a variable has one of the given flags
+
+        Inputs:
+            variable - variable name, with or without the _FLAG_W suffix
+            flags - flag value or list of acceptable flag values
+        Returns: numpy array of 64-bit words
+        '''
+
+        bitmaps = self.bitmaps[self._variable(variable)]
+        words = np.zeros(-(-self.nrows // 64), dtype=np.uint64)
+        for flag in np.atleast_1d(flags):
+            if int(flag) in bitmaps:
+                words |= bitmaps[int(flag)]
+        return words
+
+    def query(self, variables, flags=2):
+        '''
+        Packed bitmap of the rows where all variables have acceptable flags
+
+        Inputs:
+            variables - list of variable names, or a dictionary mapping each
+                        variable name to its acceptable flag value(s)
+            flags - acceptable flag value(s), used when variables is a list
+        Returns: numpy array of 64-bit words
+        '''
+
+        if not isinstance(variables, dict):
+            variables = {v: flags for v in variables}
+
+        words = None
+        for variable, var_flags in variables.items():
+            if words is None:
+                words = self.bitmap(variable, var_flags)
+            else:
+                words &= self.bitmap(variable, var_flags)
+
+        if words is None:
+            words = _pack(np.ones(self.nrows, dtype=bool))
+        return words
+
+    def count(self, variables, flags=2):
+        '''Number of rows where all variables have acceptable flags.'''
+
+        return popcount(self.query(variables, flags))
+
+    def rows(self, variables, flags=2):
+        '''Row numbers where all variables have acceptable flags.'''
+
+        return words_to_rows(self.query(variables, flags), self.nrows)
+
+    def mask(self, variables, flags=2):
+        '''Boolean array, True where all variables have acceptable flags.'''
+
+        bits = np.unpackbits(self.query(variables, flags).view(np.uint8),
+                             count=self.nrows, bitorder='little')
+        return bits.view(bool)
+
+
+if __name__ == '__main__':
+    import time
+    import pandas as pd
+
+    # synthetic cruise table with flags that are mostly good (2)
+    nrows = 10_000_000
+    rng = np.random.default_rng(0)
+    variables = ['CTDSAL', 'CTDOXY', 'NITRAT', 'PHSPHT', 'TCARBN', 'ALKALI']
+    df = pd.DataFrame({v + FLAG_SUFFIX: rng.choice([2, 3, 4, 6, 9], nrows,
+                                                   p=[0.85, 0.03, 0.02, 0.05, 0.05])
+                       for v in variables})
+
+    t0 = time.perf_counter()
+    flags = FlagIndex(df)
+    t1 = time.perf_counter()
+    print('build index:           {:8.1f} ms'.format(1e3*(t1-t0)))
+
+    t0 = time.perf_counter()
+    ii = np.ones(nrows, dtype=bool)
+    for v in variables:
+        ii = ii & (df[v + FLAG_SUFFIX] == 2)
+    rows_pandas = np.flatnonzero(ii)
+    t1 = time.perf_counter()
+    rows_index = flags.rows(variables)
+    t2 = time.perf_counter()
+    n_index = flags.count(variables)
+    t3 = time.perf_counter()
+
+    print('pandas boolean chain:  {:8.1f} ms'.format(1e3*(t1-t0)))
+    print('FlagIndex.rows:        {:8.1f} ms'.format(1e3*(t2-t1)))
+    print('FlagIndex.count:       {:8.1f} ms'.format(1e3*(t3-t2)))
+    print('same rows:', np.array_equal(rows_pandas, rows_index),
+          len(rows_pandas) == n_index)
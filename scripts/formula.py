@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''A module for fitting the same formula to many subsets of a dataset.
+
+smf.ols('NITRAT ~ PHSPHT', df07).fit() parses the formula and builds the
+design matrix with patsy on every call, which takes most of the time when
+thousands of subset or bootstrap models are fit. Here a formula is compiled
+once for a dataframe, and the design matrix of the dataframe is built once;
+subsets and bootstrap resamples take rows of it:
+
+    design = compile_formula('NITRAT ~ PHSPHT', df07).bind(df07)
+    design.subset(df07['STNNBR'] == 1).ols()
+    for sample in design.bootstrap(1000, seed=0):
+        sample.lstsq().coef
+
+The categorical levels and the state of stateful transforms (e.g. center)
+come from the dataframe the formula is compiled with, so fits of subsets of
+a Design use the levels and the centering of all of its rows. Compile the
+formula again for a different dataframe. (A single fit gains nothing from
+compiling; use smf.ols for that.)
+'''
+
+import numpy as np
+import pandas as pd
+import patsy
+import statsmodels.api as sm
+
+from lstsq import lstsq
+
+
+class CompiledFormula:
+    '''
+    A patsy formula parsed once for a dataframe
+
+    The levels of categorical terms (e.g. the regions in CTDTMP ~ region)
+    are taken from the data the formula is compiled with.
+
+    Inputs:
+        formula - formula string, e.g. 'NITRAT ~ PHSPHT'
+        data - Pandas dataframe with the columns used by the formula
+        eval_env - patsy.EvalEnvironment for functions used in the formula
+                   (default: the namespace of the caller)
+    '''
+
+    def __init__(self, formula, data, eval_env=None):
+        if eval_env is None:
+            eval_env = patsy.EvalEnvironment.capture(1)
+        self.formula = formula
+        y, X = patsy.dmatrices(formula, data, eval_env=eval_env,
+                               return_type='dataframe')
+        self.design_infos = (y.design_info, X.design_info)
+        self.response = y.design_info.column_names[0]
+        self.names = list(X.design_info.column_names)
+        # the matrices of the compiled dataframe, used by the first call of
+        # matrices (or bind) with the same dataframe instead of building
+        # them again
+        self._built = (data, y.iloc[:, 0], X)
+
+    def __repr__(self):
+        return 'CompiledFormula({!r})'.format(self.formula)
+
+    def matrices(self, data):
+        '''
+        Response and design matrix of a dataframe, without parsing the formula
+
+        Input: Pandas dataframe
+        Returns: y and X as dataframes (rows with missing values dropped)
+        '''
+
+        if self._built is not None and self._built[0] is data:
+            y, X = self._built[1:]
+            self._built = None
+            return y, X
+        y, X = patsy.build_design_matrices(self.design_infos, data,
+                                           return_type='dataframe')
+        return y.iloc[:, 0], X
+
+    def bind(self, data):
+        '''
+        Build the design matrix of a dataframe once, for fitting subsets
+        and bootstrap samples of its rows
+
+        Input: Pandas dataframe
+        Returns: Design
+        '''
+
+        y, X = self.matrices(data)
+        positions = data.index.get_indexer(y.index)
+        return Design(self, y.to_numpy(), X.to_numpy(), y.index, positions,
+                      len(data))
+
+
+class Design:
+    '''
+    Response and design matrix of a compiled formula for a set of rows
+
+    Inputs (usually created with CompiledFormula.bind):
+        compiled - CompiledFormula
+        y, X - response and design matrix arrays
+        index - index labels of the rows
+        positions - positions of the rows in the original dataframe
+        nrows - number of rows of the original dataframe
+    '''
+
+    def __init__(self, compiled, y, X, index, positions, nrows):
+        self.compiled = compiled
+        self.y = y
+        self.X = X
+        self.index = index
+        self.positions = positions
+        self.nrows = nrows
+
+    def __len__(self):
+        return len(self.y)
+
+    @property
+    def names(self):
+        return self.compiled.names
+
+    def take(self, rows):
+        '''Design of some of the rows (positions in this design).'''
+
+        rows = np.asarray(rows)
+        return Design(self.compiled, self.y[rows], self.X[rows],
+                      self.index[rows], self.positions[rows], self.nrows)
+
+    def subset(self, mask):
+        '''
+        Design of the rows selected by a boolean mask
+
+        Input: boolean Series (aligned by index) or array with one value per
+               row of the original dataframe
+        Returns: Design
+        '''
+
+        if isinstance(mask, pd.Series):
+            keep = mask.reindex(self.index, fill_value=False).to_numpy(dtype=bool)
+        else:
+            keep = np.asarray(mask, dtype=bool)[self.positions]
+        return self.take(np.flatnonzero(keep))
+
+    def bootstrap(self, n, seed=None):
+        '''
+        Random resamples (with replacement) of the rows
+
+        Inputs:
+            n - number of resamples
+            seed - seed or np.random.Generator
+        Yields: Design of each resample
+        '''
+
+        rng = np.random.default_rng(seed)
+        for i in range(n):
+            yield self.take(rng.integers(0, len(self), len(self)))
+
+    def frames(self):
+        '''y and X as a Pandas series and dataframe, with named columns.'''
+
+        y = pd.Series(self.y, index=self.index, name=self.compiled.response)
+        X = pd.DataFrame(self.X, index=self.index, columns=self.names)
+        return y, X
+
+    def lstsq(self, method='auto'):
+        '''Least squares fit (see lstsq.lstsq), the fastest way to get the
+        coefficients.'''
+        return lstsq(self.X, self.y, method=method)
+
+    def ols(self):
+        '''Ordinary least squares fit, same as smf.ols(...).fit().'''
+
+        y, X = self.frames()
+        return sm.OLS(y, X).fit()
+
+    def glm(self, family=None, **kwargs):
+        '''
+        Generalized linear model fit, same as smf.glm(..., family).fit()
+
+        Inputs:
+            family - statsmodels family (default Gaussian)
+            kwargs - passed to the statsmodels GLM fit method
+        Returns: statsmodels GLM results
+        '''
+
+        y, X = self.frames()
+        return sm.GLM(y, X, family=family).fit(**kwargs)
+
+
+def compile_formula(formula, data, eval_env=None):
+    '''
+    Compile a formula for a dataframe
+
+    Inputs:
+        formula - formula string
+        data - Pandas dataframe
+        eval_env - patsy.EvalEnvironment (default: the namespace of the caller)
+    Returns: CompiledFormula
+    '''
+
+    if eval_env is None:
+        eval_env = patsy.EvalEnvironment.capture(1)
+    return CompiledFormula(formula, data, eval_env)
+
+
+if __name__ == '__main__':
+    import sys
+    import os
+    import time
+    import statsmodels.formula.api as smf
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from exchange import read_exchange
+
+    filename07 = 'data/wcoa_cruise_2007/32WC20070511.exc.csv'
+    df07 = read_exchange(filename07)
+    # stations with enough nutrient samples for a fit
+    counts = df07.dropna(subset=['NITRAT', 'PHSPHT']).groupby('STNNBR').size()
+    stations = counts.index[counts > 2]
+
+    t0 = time.perf_counter()
+    fits = [smf.ols('NITRAT ~ PHSPHT', df07[df07['STNNBR'] == s]).fit().params
+            for s in stations]
+    t1 = time.perf_counter()
+    design = compile_formula('NITRAT ~ PHSPHT', df07).bind(df07)
+    fits_design = [design.subset(df07['STNNBR'] == s).lstsq().coef
+                   for s in stations]
+    t2 = time.perf_counter()
+    boot = np.array([sample.lstsq().coef for sample in design.bootstrap(1000, seed=0)])
+    t3 = time.perf_counter()
+
+    print('smf.ols per station:    {:7.1f} ms'.format(1e3*(t1-t0)))
+    print('Design.subset + lstsq:  {:7.1f} ms'.format(1e3*(t2-t1)))
+    print('1000 bootstrap fits:    {:7.1f} ms'.format(1e3*(t3-t2)))
+    print('same coefficients:',
+          np.allclose(np.array(fits), np.array(fits_design), equal_nan=True))
+    print('bootstrap std. errors', boot.std(axis=0), 'OLS', design.ols().bse.values)
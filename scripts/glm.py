@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''A module for fitting many Poisson or negative binomial regressions at once.
+
+The Poisson regression notes fit one model of the number of named storms:
+
+    smf.glm(formula='NamedStorms ~ Year + NAO + SOI + TNA', data=df,
+            family=sm.families.Poisson()).fit()
+
+To compare every subset of the predictors, and every window of months that
+the climate indices are averaged over, thousands of small models with the
+same response are needed. irls fits them together: the iteratively
+reweighted least squares updates of all the models are computed with
+batched linear algebra.
+
+    table = subset_search(df, 'NamedStorms', ['Year', 'NAO', 'SOI', 'TNA'])
+    table = window_search(dftrop, 'NamedStorms', ds, ['nao', 'soi', 'tna'],
+                          windows=[(5, 6), (6, 8), (8, 10)])
+
+The tables have the coefficients, standard errors, deviance and AIC of each
+model, sorted by AIC.
+'''
+
+import os
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import special
+
+FAMILIES = ('poisson', 'negativebinomial')
+
+
+def _variance_weights(mu, family, alpha):
+    '''IRLS weights for a log link: (d mu / d eta)**2 / var(mu).'''
+
+    if family == 'poisson':
+        return mu
+    return mu / (1 + alpha * mu)
+
+
+def _deviance(y, mu, family, alpha):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ylogy = np.where(y > 0, y * np.log(y / mu), 0.0)
+    if family == 'poisson':
+        return 2 * np.sum(ylogy - (y - mu), axis=-1)
+    ya = y + 1 / alpha
+    return 2 * np.sum(ylogy - ya * np.log(ya / (mu + 1 / alpha)), axis=-1)
+
+
+def _loglike(y, mu, family, alpha):
+    if family == 'poisson':
+        return np.sum(y * np.log(mu) - mu - special.gammaln(y + 1), axis=-1)
+    return np.sum(y * np.log(alpha * mu) - (y + 1/alpha) * np.log(1 + alpha * mu)
+                  + special.gammaln(y + 1/alpha) - special.gammaln(1/alpha)
+                  - special.gammaln(y + 1), axis=-1)
+
+
+def irls(y, X, masks=None, family='poisson', alpha=1.0, maxiter=100, tol=1e-8):
+    '''
+    Fit many log-link GLMs with the same response by batched IRLS
+
+    Every model m uses the columns of its design matrix where masks[m] is
+    True. The unused columns are zeroed and get a unit diagonal in the
+    normal equations, so all the models are solved as one batch of p x p
+    systems, and their coefficients stay at zero.
+
+    Inputs:
+        y - response counts, array of N values
+        X - design matrix (N, p) shared by all models, or one design matrix
+            per model (M, N, p); include a column of ones for the intercept
+        masks - (M, p) boolean array of the columns used by each model
+                (default: all columns)
+        family - 'poisson' or 'negativebinomial' (NB2, variance
+                 mu + alpha*mu**2, with alpha fixed as in
+                 sm.families.NegativeBinomial)
+        alpha - dispersion parameter of the negative binomial family
+        maxiter - largest number of iterations
+        tol - convergence tolerance on the relative change of the deviance
+    Returns: dictionary of arrays with one row per model: 'params' and
+             'bse' (M, p) with NaN for unused columns, and 'deviance',
+             'llf', 'aic', 'df_model', 'converged' and 'iterations' (M,)
+    '''
+
+    if family not in FAMILIES:
+        raise ValueError('family must be poisson or negativebinomial')
+    y = np.asarray(y, dtype=np.float64)
+    X = np.asarray(X, dtype=np.float64)
+    if masks is None:
+        M = 1 if X.ndim == 2 else X.shape[0]
+        masks = np.ones((M, X.shape[-1]), dtype=bool)
+    masks = np.asarray(masks, dtype=bool)
+    M, p = masks.shape
+    if X.ndim == 2:
+        X = np.broadcast_to(X, (M,) + X.shape)
+    Xm = X * masks[:, None, :]
+    ridge = np.eye(p) * ~masks[:, :, None]
+
+    # starting values as in statsmodels
+    mu = np.broadcast_to((y + y.mean()) / 2, (M, len(y))).copy()
+    eta = np.log(mu)
+    beta = np.zeros((M, p))
+    deviance = _deviance(y, mu, family, alpha)
+    converged = np.zeros(M, dtype=bool)
+    iterations = np.zeros(M, dtype=np.int64)
+    active = np.arange(M)
+
+    for it in range(maxiter):
+        if len(active) == 0:
+            break
+        Xa = Xm[active]
+        w = _variance_weights(mu[active], family, alpha)
+        z = eta[active] + (y - mu[active]) / mu[active]
+        A = np.einsum('mn,mnp,mnq->mpq', w, Xa, Xa) + ridge[active]
+        b = np.einsum('mn,mnp,mn->mp', w, Xa, z)
+        beta[active] = np.linalg.solve(A, b[..., None])[..., 0]
+        eta[active] = np.einsum('mnp,mp->mn', Xa, beta[active])
+        mu[active] = np.exp(eta[active])
+        new_deviance = _deviance(y, mu[active], family, alpha)
+        iterations[active] += 1
+        done = np.abs(new_deviance - deviance[active]) <= tol * (np.abs(new_deviance) + tol)
+        deviance[active] = new_deviance
+        converged[active[done]] = True
+        active = active[~done]
+
+    w = _variance_weights(mu, family, alpha)
+    A = np.einsum('mn,mnp,mnq->mpq', w, Xm, Xm) + ridge
+    cov = np.linalg.inv(A)
+    bse = np.sqrt(np.diagonal(cov, axis1=1, axis2=2))
+    llf = _loglike(y, mu, family, alpha)
+    k = masks.sum(axis=1)
+    return {'params': np.where(masks, beta, np.nan),
+            'bse': np.where(masks, bse, np.nan),
+            'deviance': deviance, 'llf': llf, 'aic': -2 * llf + 2 * k,
+            'df_model': k - 1, 'converged': converged, 'iterations': iterations}
+
+
+def fit_models(y, X, masks=None, family='poisson', alpha=1.0, processes=1,
+               chunksize=1000, **kwargs):
+    '''
+    irls over many models, in chunks of models split across processes
+
+    Inputs:
+        y, X, masks, family, alpha - see irls
+        processes - number of processes (None for one per CPU)
+        chunksize - number of models fit together
+        kwargs - passed to irls
+    Returns: dictionary of arrays, see irls
+    '''
+
+    X = np.asarray(X, dtype=np.float64)
+    if masks is None:
+        M = 1 if X.ndim == 2 else X.shape[0]
+        masks = np.ones((M, X.shape[-1]), dtype=bool)
+    masks = np.asarray(masks, dtype=bool)
+    starts = range(0, len(masks), chunksize)
+
+    def chunk_args(start):
+        stop = start + chunksize
+        Xc = X if X.ndim == 2 else X[start:stop]
+        return (y, Xc, masks[start:stop], family, alpha)
+
+    if processes is None:
+        processes = os.cpu_count()
+    if processes == 1 or len(starts) == 1:
+        results = [irls(*chunk_args(start), **kwargs) for start in starts]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(irls, *chunk_args(start), **kwargs)
+                       for start in starts]
+            results = [f.result() for f in futures]
+    return {k: np.concatenate([r[k] for r in results]) for k in results[0]}
+
+
+def all_subsets(predictors, min_size=0, max_size=None):
+    '''
+    Every subset of the predictors, as a boolean array
+
+    Inputs:
+        predictors - list of predictor names
+        min_size, max_size - smallest and largest number of predictors
+    Returns: (M, len(predictors)) boolean array, one row per subset
+    '''
+
+    k = len(predictors)
+    max_size = k if max_size is None else max_size
+    subsets = [np.isin(np.arange(k), combo)
+               for size in range(min_size, max_size + 1)
+               for combo in itertools.combinations(range(k), size)]
+    return np.array(subsets, dtype=bool).reshape(len(subsets), k)
+
+
+def _result_table(result, names, extra=None):
+    '''Table of irls results, one row per model, sorted by AIC.'''
+
+    table = pd.DataFrame(extra or {})
+    used = ~np.isnan(result['params'][:, 1:])
+    table['predictors'] = [' + '.join(n for n, u in zip(names[1:], row) if u) or '1'
+                           for row in used]
+    for key in ('deviance', 'aic', 'llf', 'df_model', 'converged'):
+        table[key] = result[key]
+    for j, name in enumerate(names):
+        table[name] = result['params'][:, j]
+    for j, name in enumerate(names):
+        table[name + '_se'] = result['bse'][:, j]
+    return table.sort_values('aic', kind='stable').reset_index(drop=True)
+
+
+def subset_search(df, response, predictors, family='poisson', alpha=1.0,
+                  processes=1, min_size=0, max_size=None):
+    '''
+    Fit a GLM with an intercept for every subset of a list of predictors
+
+    Inputs:
+        df - Pandas dataframe (rows with missing values are dropped)
+        response - name of the count column (e.g. 'NamedStorms')
+        predictors - list of predictor columns (e.g. ['Year', 'NAO', 'SOI', 'TNA'])
+        family, alpha - see irls
+        processes - number of processes
+        min_size, max_size - smallest and largest number of predictors
+    Returns: Pandas dataframe with one row per model, sorted by AIC
+    '''
+
+    from formula import compile_formula
+
+    data = df[[response] + list(predictors)].dropna()
+    formula = response + ' ~ ' + (' + '.join(predictors) or '1')
+    y, X = compile_formula(formula, data).matrices(data)
+    subsets = all_subsets(predictors, min_size, max_size)
+    masks = np.column_stack([np.ones(len(subsets), dtype=bool), subsets])
+    result = fit_models(y.to_numpy(), X.to_numpy(), masks, family, alpha,
+                        processes)
+    return _result_table(result, list(X.columns))
+
+
+def window_predictors(ds, indices, window):
+    '''
+    Climate indices averaged over a window of months
+
+    Inputs:
+        ds - xarray Dataset from climate_index.load_psl_directory
+        indices - names of the index variables
+        window - (first, last) month, inclusive; if first > last the window
+                 wraps into the next year
+    Returns: Pandas dataframe with one column per index and the year as index
+    '''
+
+    first, last = window
+    if first <= last:
+        values = ds[list(indices)].sel(month=slice(first, last)).mean('month')
+        return values.to_dataframe()[list(indices)]
+    # e.g. (11, 2): November and December of the year, and January and
+    # February of the next year
+    late = ds[list(indices)].sel(month=slice(first, 12))
+    early = ds[list(indices)].sel(month=slice(1, last)).shift(year=-1)
+    total = late.sum('month', skipna=False) + early.sum('month', skipna=False)
+    return (total / (12 - first + 1 + last)).to_dataframe()[list(indices)]
+
+
+def window_search(df, response, ds, indices, windows, other=(),
+                  family='poisson', alpha=1.0, processes=1):
+    '''
+    Fit a GLM for every window of months and every subset of predictors
+
+    The models are fit on the years where the response, the other
+    predictors and the indices for all of the windows are available, so that
+    their deviances and AICs can be compared.
+
+    Inputs:
+        df - Pandas dataframe indexed by year (e.g. dftrop)
+        response - name of the count column
+        ds - xarray Dataset of climate indices (load_psl_directory)
+        indices - names of the index variables to average over each window
+        windows - list of (first, last) month windows
+        other - other predictor columns of df (e.g. ['Year'])
+        family, alpha, processes - see fit_models
+    Returns: Pandas dataframe with one row per model, sorted by AIC, with the
+             window in the 'window' column
+    '''
+
+    other = list(other)
+    tables = [window_predictors(ds, indices, w) for w in windows]
+    base = df[[response] + other]
+    years = base.dropna().index
+    for t in tables:
+        years = years.intersection(t.dropna().index)
+    y = base.loc[years, response].to_numpy(dtype=np.float64)
+
+    predictors = other + list(indices)
+    X = np.stack([np.column_stack([np.ones(len(years)),
+                                   base.loc[years, other].to_numpy(dtype=np.float64),
+                                   t.loc[years].to_numpy(dtype=np.float64)])
+                  for t in tables])
+    subsets = all_subsets(predictors)
+    masks = np.column_stack([np.ones(len(subsets), dtype=bool), subsets])
+    # every subset for every window
+    Xall = np.repeat(X, len(masks), axis=0)
+    masks_all = np.tile(masks, (len(windows), 1))
+    result = fit_models(y, Xall, masks_all, family, alpha, processes)
+    window = ['{}-{}'.format(*w) for w in windows for m in range(len(masks))]
+    return _result_table(result, ['Intercept'] + predictors, {'window': window})
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    import statsmodels.api as sm
+    import statsmodels.formula.api as smf
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from climate_index import load_psl_directory, read_psl_file
+
+    dfsoi = read_psl_file('data/tropical-storms/soi.data')
+    dftna = read_psl_file('data/tropical-storms/tna.data')
+    dfnao = read_psl_file('data/tropical-storms/nao.data')
+    dftrop = pd.read_csv('data/tropical-storms/tropical.txt', sep='\t')
+    dftrop = dftrop.set_index('Year', drop=False)
+    dftrop['SOI'] = dfsoi.loc[:, 5:6].mean(axis=1)
+    dftrop['TNA'] = dftna.loc[:, 5:6].mean(axis=1)
+    dftrop['NAO'] = dfnao.loc[:, 5:6].mean(axis=1)
+    df = dftrop.dropna()
+
+    result = smf.glm(formula='NamedStorms ~ Year + NAO + SOI + TNA', data=df,
+                     family=sm.families.Poisson()).fit()
+    table = subset_search(df, 'NamedStorms', ['Year', 'NAO', 'SOI', 'TNA'])
+    full = table[table['predictors'] == 'Year + NAO + SOI + TNA'].iloc[0]
+    print('largest coefficient difference from smf.glm: {:.2e}, AIC {:.4f} ({:.4f})'.format(
+        np.max(np.abs(full[result.params.index].to_numpy(dtype=float) - result.params.values)),
+        full['aic'], result.aic))
+    print(table[['predictors', 'deviance', 'aic']].head())
+
+    # every window of 1 to 4 months, every subset of the three indices and
+    # the year, for the Poisson and negative binomial families
+    ds = load_psl_directory('data/tropical-storms')
+    windows = [(m, m + n) for n in range(4) for m in range(1, 13 - n)]
+    for family in FAMILIES:
+        t0 = time.perf_counter()
+        table = window_search(dftrop, 'NamedStorms', ds, ['nao', 'soi', 'tna'],
+                              windows, other=['Year'], family=family)
+        t1 = time.perf_counter()
+        print('\n{}: {} models in {:.2f} s'.format(family, len(table), t1-t0))
+        print(table[['window', 'predictors', 'deviance', 'aic']].head())
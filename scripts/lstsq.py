@@ -0,0 +1,681 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''A module for solving linear least squares problems.
+
+The multivariate regression notes solve for the coefficients of the OmegaA
+model in two ways:
+
+    c = np.linalg.lstsq(X, y)[0]
+    c2 = np.linalg.inv(X.T@X)@X.T@y
+
+The first is accurate but slower, and the second is fast but loses accuracy
+when the predictors are nearly collinear (the condition number of X.T@X is
+the square of that of X). lstsq here picks the fastest method that is
+accurate for the problem at hand:
+
+    fit = lstsq(X, y)
+    fit.coef, fit.bse, fit.method, fit.cond
+
+The methods are the Cholesky factorization of the normal equations, a QR
+decomposition of X, and the singular value decomposition of X, which also
+handles rank-deficient problems.
+
+RecursiveLstsq updates a regression as batches of data (e.g. the bottles of
+a new cruise) are added or removed, without refitting all of the data:
+
+    fit = RecursiveLstsq()
+    fit.add(X07, y07, key='2007')
+    fit.add(X13, y13, key='2013')
+    fit.remove('2007')
+    fit.coef, fit.cov
+
+chunked_lstsq solves a problem too large to hold X in memory, from chunks of
+rows (e.g. from exchange.iter_exchange), optionally in several processes:
+
+    chunks = design_chunks(iter_exchange(file_name), 'OmegaA', predictors)
+    fit = chunked_lstsq(chunks, processes=4)
+'''
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import linalg
+
+METHODS = ('cholesky', 'qr', 'svd')
+
+# largest condition number of the (column-scaled) X for each method; the
+# normal equations lose about twice as many digits as QR
+COND_LIMITS = {'cholesky': 1e5, 'qr': 1e10}
+
+
+def column_scale(X):
+    '''
+    Norms of the columns of X, used to scale them to unit length (columns
+    of zeros get a scale of 1)
+    '''
+
+    scale = np.sqrt(np.einsum('ij,ij->j', X, X))
+    scale[scale == 0] = 1.0
+    return scale
+
+
+def condition_number(X, scale=True):
+    '''
+    Condition number of a design matrix
+
+    Inputs:
+        X - (N, k) design matrix
+        scale - scale the columns to unit length first, which removes the
+                part of the condition number caused only by the units of
+                the predictors
+    Returns: ratio of the largest to the smallest singular value
+    '''
+
+    X = np.asarray(X, dtype=np.float64)
+    if scale:
+        X = X / column_scale(X)
+    s = np.linalg.svd(X, compute_uv=False)
+    return s[0] / s[-1] if s[-1] > 0 else np.inf
+
+
+def vif(X):
+    '''
+    Variance inflation factors of the columns of a design matrix
+
+    Input: (N, k) design matrix without the column of ones
+    Returns: array of k variance inflation factors (the diagonal of the
+             inverse correlation matrix of the predictors)
+    '''
+
+    R = np.corrcoef(np.asarray(X, dtype=np.float64), rowvar=False)
+    return np.diag(np.linalg.inv(np.atleast_2d(R)))
+
+
+class LstsqResult:
+    '''
+    Result of a least squares fit
+
+    Attributes:
+        coef - coefficients
+        method - method used ('cholesky', 'qr' or 'svd')
+        cond - condition number of the column-scaled X (estimated from
+               the factorization)
+        rank - rank of X
+        ssr - sum of squared residuals
+        df_resid - degrees of freedom of the residuals
+        cov - covariance matrix of the coefficients
+    '''
+
+    def __init__(self, coef, method, cond, rank, ssr, df_resid, cov_unscaled):
+        self.coef = coef
+        self.method = method
+        self.cond = cond
+        self.rank = rank
+        self.ssr = ssr
+        self.df_resid = df_resid
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.scale = ssr / df_resid if df_resid > 0 else np.nan
+        self.cov = cov_unscaled * self.scale
+
+    @property
+    def bse(self):
+        '''Standard errors of the coefficients.'''
+        return np.sqrt(np.diag(self.cov))
+
+    def __repr__(self):
+        return 'LstsqResult(method={!r}, cond={:.3g}, rank={}, coef={})'.format(
+            self.method, self.cond, self.rank, self.coef)
+
+
+def _cond_from_triangular(R):
+    '''Condition number of a triangular factor (cheap lower bound from the
+    diagonal, refined with the exact value when k is small).'''
+
+    d = np.abs(np.diag(R))
+    if np.min(d) == 0:
+        return np.inf
+    if R.shape[0] <= 200:
+        return np.linalg.cond(R)
+    return np.max(d) / np.min(d)
+
+
+def _solve_cholesky(G, b):
+    '''Solve the normal equations G @ coef = b (G = Xs.T @ Xs, b = Xs.T @ y).'''
+
+    L = linalg.cholesky(G, lower=True)
+    cond = _cond_from_triangular(L)
+    z = linalg.solve_triangular(L, b, lower=True)
+    coef = linalg.solve_triangular(L.T, z, lower=False)
+    Linv = linalg.solve_triangular(L, np.eye(len(L)), lower=True)
+    return coef, cond, len(L), Linv.T @ Linv
+
+
+def _solve_qr(Xs, y):
+    Q, R = linalg.qr(Xs, mode='economic')
+    cond = _cond_from_triangular(R)
+    if not np.isfinite(cond):
+        raise linalg.LinAlgError('singular R')
+    coef = linalg.solve_triangular(R, Q.T @ y, lower=False)
+    Rinv = linalg.solve_triangular(R, np.eye(len(R)), lower=False)
+    return coef, cond, len(R), Rinv @ Rinv.T
+
+
+def _solve_svd(Xs, y, rcond):
+    U, s, Vt = np.linalg.svd(Xs, full_matrices=False)
+    if rcond is None:
+        rcond = np.finfo(np.float64).eps * max(Xs.shape)
+    keep = s > rcond * s[0]
+    cond = s[0] / s[-1] if s[-1] > 0 else np.inf
+    sinv = np.where(keep, 1 / np.where(keep, s, 1), 0)
+    coef = Vt.T @ (sinv * (U.T @ y))
+    return coef, cond, int(np.count_nonzero(keep)), (Vt.T * sinv**2) @ Vt
+
+
+def lstsq(X, y, method='auto', rcond=None):
+    '''
+    Least squares solution of X @ coef = y
+
+    The columns of X are scaled to unit length before solving, which makes
+    the condition number independent of the units of the predictors.
+
+    With method='auto', the Cholesky factorization of the normal equations
+    is tried first. If its condition number is above COND_LIMITS['cholesky']
+    (or the factorization fails), QR is used, and if that is also too
+    ill-conditioned, the SVD. For a rank-deficient X, the SVD solution is
+    the one with the smallest norm of the scaled coefficients.
+
+    Inputs:
+        X - (N, k) design matrix (including the column of ones, if any)
+        y - array of N observations
+        method - 'auto', 'cholesky', 'qr' or 'svd'
+        rcond - relative cutoff for small singular values (SVD only)
+    Returns: LstsqResult
+    '''
+
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if method not in METHODS + ('auto',):
+        raise ValueError('method must be auto, cholesky, qr or svd')
+
+    tries = METHODS if method == 'auto' else (method,)
+    # every method uses the same scaling, so 'auto' gives the same answer
+    # as the method it picks
+    scale = column_scale(X)
+    if 'cholesky' in tries:
+        # the normal equations only need X.T @ X, so X is not copied
+        G = (X.T @ X) / np.outer(scale, scale)
+        b = (X.T @ y) / scale
+    Xs = None
+    for m in tries:
+        if m != 'cholesky' and Xs is None:
+            Xs = X / scale
+        try:
+            if m == 'cholesky':
+                coef, cond, rank, cov = _solve_cholesky(G, b)
+            elif m == 'qr':
+                coef, cond, rank, cov = _solve_qr(Xs, y)
+            else:
+                coef, cond, rank, cov = _solve_svd(Xs, y, rcond)
+        except linalg.LinAlgError:
+            if method != 'auto':
+                raise
+            continue
+        if method != 'auto' or m == 'svd' or cond <= COND_LIMITS[m]:
+            break
+
+    coef = coef / scale
+    cov = cov / np.outer(scale, scale)
+    resid = y - X @ coef
+    ssr = float(resid @ resid)
+    return LstsqResult(coef, m, cond, rank, ssr, len(y) - rank, cov)
+
+
+def _batch_sums(X, y):
+    '''Count, means and sums of squares and products about the means.'''
+
+    n = len(y)
+    xbar = X.mean(axis=0)
+    ybar = y.mean()
+    dX = X - xbar
+    dy = y - ybar
+    return {'n': n, 'xbar': xbar, 'ybar': ybar, 'Sxx': dX.T @ dX,
+            'Sxy': dX.T @ dy, 'Syy': float(dy @ dy)}
+
+
+def _merge_sums(a, b, sign=1):
+    '''
+    Sums of the union of two sets of data (sign=1), or of a without b
+    (sign=-1, where b must be a subset of a)
+    '''
+
+    n = a['n'] + sign * b['n']
+    if n == 0:
+        k = len(a['xbar'])
+        return {'n': 0, 'xbar': np.zeros(k), 'ybar': 0.0, 'Sxx': np.zeros((k, k)),
+                'Sxy': np.zeros(k), 'Syy': 0.0}
+    if sign > 0:
+        xbar = a['xbar'] + (b['xbar'] - a['xbar']) * b['n'] / n
+        ybar = a['ybar'] + (b['ybar'] - a['ybar']) * b['n'] / n
+        # the two parts are a and b
+        dx = b['xbar'] - a['xbar']
+        dy = b['ybar'] - a['ybar']
+        f = a['n'] * b['n'] / n
+        return {'n': n, 'xbar': xbar, 'ybar': ybar,
+                'Sxx': a['Sxx'] + b['Sxx'] + f * np.outer(dx, dx),
+                'Sxy': a['Sxy'] + b['Sxy'] + f * dx * dy,
+                'Syy': a['Syy'] + b['Syy'] + f * dy**2}
+    xbar = (a['n'] * a['xbar'] - b['n'] * b['xbar']) / n
+    ybar = (a['n'] * a['ybar'] - b['n'] * b['ybar']) / n
+    # the two parts are the remainder and b
+    dx = b['xbar'] - xbar
+    dy = b['ybar'] - ybar
+    f = n * b['n'] / a['n']
+    return {'n': n, 'xbar': xbar, 'ybar': ybar,
+            'Sxx': a['Sxx'] - b['Sxx'] - f * np.outer(dx, dx),
+            'Sxy': a['Sxy'] - b['Sxy'] - f * dx * dy,
+            'Syy': a['Syy'] - b['Syy'] - f * dy**2}
+
+
+class RecursiveLstsq:
+    '''
+    Linear regression updated one batch of data at a time
+
+    Only the count, the means and the sums of squares and products about
+    the means are kept, so adding or removing a batch of m rows costs
+    O(m k^2) to summarize the batch and O(k^2) to update the sums, and the
+    coefficients are solved from a k x k system. Batches can be removed
+    later by key, without the data.
+
+    Input: intercept - include an intercept in the model (the predictors
+           passed to add should then not include a column of ones)
+    '''
+
+    def __init__(self, intercept=True):
+        self.intercept = intercept
+        self.sums = None
+        self.batches = {}
+        self._fit = None
+
+    @property
+    def nobs(self):
+        return 0 if self.sums is None else self.sums['n']
+
+    def add(self, X, y, key=None):
+        '''
+        Add a batch of data (rows with NaN values are ignored)
+
+        Inputs:
+            X - (m, k) array of predictors
+            y - array of m observations
+            key - name of the batch, used to remove it (default: a number)
+        Returns: the key of the batch
+        '''
+
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if X.ndim == 1:
+            X = X[:, None]
+        good = ~np.isnan(y) & ~np.isnan(X).any(axis=1)
+        X, y = X[good], y[good]
+        if key is None:
+            key = len(self.batches)
+            while key in self.batches:
+                key += 1
+        if key in self.batches:
+            raise KeyError('batch {!r} was already added'.format(key))
+
+        if self.intercept:
+            batch = _batch_sums(X, y)
+        else:
+            # sums about zero instead of about the means
+            k = X.shape[1]
+            batch = {'n': len(y), 'xbar': np.zeros(k), 'ybar': 0.0,
+                     'Sxx': X.T @ X, 'Sxy': X.T @ y, 'Syy': float(y @ y)}
+        if batch['n'] == 0:
+            return key
+        self.batches[key] = batch
+        if self.sums is None:
+            self.sums = batch
+        elif self.intercept:
+            self.sums = _merge_sums(self.sums, batch)
+        else:
+            self.sums = {k: self.sums[k] + batch[k] for k in batch}
+        self._fit = None
+        return key
+
+    def remove(self, key):
+        '''Remove a batch that was added before.'''
+
+        batch = self.batches.pop(key)
+        if self.intercept:
+            self.sums = _merge_sums(self.sums, batch, sign=-1)
+        else:
+            self.sums = {k: self.sums[k] - batch[k] for k in batch}
+        self._fit = None
+
+    def _solve(self):
+        if self._fit is None:
+            if self.nobs == 0:
+                raise ValueError('no data')
+            s = self.sums
+            # solve with unit-diagonal scaling, as in lstsq
+            d = np.sqrt(np.diag(s['Sxx']))
+            d[d == 0] = 1.0
+            G = s['Sxx'] / np.outer(d, d)
+            try:
+                slopes, cond, rank, inv = _solve_cholesky(G, s['Sxy'] / d)
+            except linalg.LinAlgError:
+                inv = np.linalg.pinv(G, hermitian=True)
+                slopes = inv @ (s['Sxy'] / d)
+                rank = np.linalg.matrix_rank(G, hermitian=True)
+            slopes = slopes / d
+            inv = inv / np.outer(d, d)
+            ssr = max(s['Syy'] - slopes @ s['Sxy'], 0.0)
+            df_resid = s['n'] - rank - self.intercept
+            scale = ssr / df_resid if df_resid > 0 else np.nan
+            if self.intercept:
+                b0 = s['ybar'] - s['xbar'] @ slopes
+                h = inv @ s['xbar']
+                cov = np.empty((len(slopes) + 1,) * 2)
+                cov[0, 0] = 1 / s['n'] + s['xbar'] @ h
+                cov[0, 1:] = cov[1:, 0] = -h
+                cov[1:, 1:] = inv
+                coef = np.concatenate([[b0], slopes])
+            else:
+                coef, cov = slopes, inv
+            self._fit = {'coef': coef, 'cov': cov * scale, 'ssr': ssr,
+                         'df_resid': df_resid}
+        return self._fit
+
+    @property
+    def coef(self):
+        '''Coefficients (intercept first, if there is one).'''
+        return self._solve()['coef']
+
+    @property
+    def cov(self):
+        '''Covariance matrix of the coefficients.'''
+        return self._solve()['cov']
+
+    @property
+    def bse(self):
+        '''Standard errors of the coefficients.'''
+        return np.sqrt(np.diag(self.cov))
+
+    @property
+    def ssr(self):
+        '''Sum of squared residuals.'''
+        return self._solve()['ssr']
+
+    @property
+    def rsquared(self):
+        '''R-squared (uncentered if there is no intercept).'''
+        return 1 - self.ssr / self.sums['Syy']
+
+
+def _chunk_qr(X, y):
+    '''
+    R factor of the QR decomposition of [X y] for one chunk of rows. Its
+    first k columns are R of X, and its last column is Q.T @ y (and the
+    residual norm). R is always (k+1) x (k+1): for chunks with fewer rows
+    it is padded with rows of zeros.
+    '''
+
+    A = np.column_stack([X, y])
+    ncols = A.shape[1]
+    if len(A) > 0:
+        R = linalg.qr(A, mode='r', overwrite_a=True)[0][:ncols]
+    else:
+        R = np.zeros((0, ncols))
+    if len(R) < ncols:
+        R = np.vstack([R, np.zeros((ncols - len(R), ncols))])
+    return R
+
+
+def _chunk_gram(X, y):
+    '''Sums of squares and products of [X y] for one chunk of rows.'''
+
+    A = np.column_stack([X, y])
+    return A.T @ A, len(y)
+
+
+def design_chunks(frames, y, x, intercept=True):
+    '''
+    Convert chunks of a dataframe to chunks of a regression problem
+
+    Inputs:
+        frames - iterable of Pandas dataframes (e.g. from iter_exchange)
+        y - name of the response column
+        x - list of predictor column names
+        intercept - add a column of ones to X
+    Yields: X and y arrays of each chunk, without rows with missing values
+    '''
+
+    for df in frames:
+        X = df[list(x)].to_numpy(dtype=np.float64)
+        yc = df[y].to_numpy(dtype=np.float64)
+        good = ~np.isnan(yc) & ~np.isnan(X).any(axis=1)
+        X, yc = X[good], yc[good]
+        if intercept:
+            X = np.column_stack([np.ones(len(yc)), X])
+        yield X, yc
+
+
+def chunked_lstsq(chunks, method='tsqr', processes=1):
+    '''
+    Least squares fit from chunks of rows, without forming the full X
+
+    With method='tsqr' (tall-skinny QR), each chunk is reduced to the
+    (k+1) x (k+1) R factor of [X y], and the stacked factors are reduced
+    again, so the result has the accuracy of a QR solution of the whole
+    problem (the same as np.linalg.lstsq for full-rank X). With
+    method='normal', X.T @ X and X.T @ y are accumulated instead, which is
+    faster but loses accuracy for ill-conditioned X.
+
+    The chunks are read in this process and reduced in a pool of worker
+    processes, with at most two chunks per worker waiting at a time, so the
+    memory used stays bounded.
+
+    Inputs:
+        chunks - iterable of (X, y) arrays, e.g. from design_chunks
+        method - 'tsqr' or 'normal'
+        processes - number of worker processes (1 to work in this process)
+    Returns: LstsqResult
+    '''
+
+    if method not in ('tsqr', 'normal'):
+        raise ValueError('method must be tsqr or normal')
+    if processes is None:
+        processes = os.cpu_count()
+    reduce_chunk = _chunk_qr if method == 'tsqr' else _chunk_gram
+
+    parts = []
+    n = 0
+
+    def collect(part):
+        nonlocal parts
+        parts.append(part)
+        # keep the number of stored factors small
+        if method == 'tsqr' and len(parts) > 32:
+            stacked = np.vstack(parts)
+            parts = [_chunk_qr(stacked[:, :-1], stacked[:, -1])]
+
+    if processes == 1:
+        for X, y in chunks:
+            n += len(y)
+            collect(reduce_chunk(X, y))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            pending = deque()
+            for X, y in chunks:
+                n += len(y)
+                pending.append(pool.submit(reduce_chunk, X, y))
+                while len(pending) >= 2 * processes:
+                    collect(pending.popleft().result())
+            while pending:
+                collect(pending.popleft().result())
+    if n == 0:
+        raise ValueError('no data')
+    k = (parts[0][0] if method == 'normal' else parts[0]).shape[1] - 1
+    if n < k:
+        raise ValueError('{} rows are not enough to fit {} coefficients'.format(n, k))
+
+    if method == 'normal':
+        A = sum(p[0] for p in parts)
+        G, b, yty = A[:k, :k], A[:k, k], A[k, k]
+        scale = np.sqrt(np.diag(G))
+        scale[scale == 0] = 1.0
+        coef, cond, rank, cov = _solve_cholesky(G / np.outer(scale, scale),
+                                                b / scale)
+        coef = coef / scale
+        cov = cov / np.outer(scale, scale)
+        ssr = max(float(yty - 2 * coef @ b + coef @ G @ coef), 0.0)
+    else:
+        stacked = np.vstack(parts)
+        R = _chunk_qr(stacked[:, :-1], stacked[:, -1])
+        Rx, z = R[:k, :k], R[:k, k]
+        ssr = float(R[k, k]**2)
+        scale = column_scale(Rx)
+        cond = _cond_from_triangular(Rx / scale)
+        if not np.isfinite(cond):
+            raise linalg.LinAlgError('X is rank deficient')
+        coef = linalg.solve_triangular(Rx, z, lower=False)
+        Rinv = linalg.solve_triangular(Rx, np.eye(k), lower=False)
+        cov = Rinv @ Rinv.T
+        rank = k
+    return LstsqResult(coef, method, cond, rank, ssr, n - rank, cov)
+
+
+def benchmark(X, y, methods=('inv', 'np.linalg.lstsq', 'statsmodels',
+                             'cholesky', 'qr', 'svd', 'auto'), repeat=3):
+    '''
+    Compare the speed and accuracy of least squares solvers
+
+    The reference solution is computed with the SVD in extended precision
+    (np.longdouble, where available) by refining the float64 SVD solution
+    with one step of iterative refinement.
+
+    Inputs:
+        X - (N, k) design matrix
+        y - array of N observations
+        methods - solvers to compare
+        repeat - number of timings (the fastest is reported)
+    Returns: Pandas dataframe with the time (ms) and the largest relative
+             error of the coefficients for each method
+    '''
+
+    import time
+    import pandas as pd
+    import statsmodels.api as sm
+
+    solvers = {
+        'inv': lambda: np.linalg.inv(X.T@X)@X.T@y,
+        'np.linalg.lstsq': lambda: np.linalg.lstsq(X, y, rcond=None)[0],
+        'statsmodels': lambda: sm.OLS(y, X).fit().params,
+    }
+    for m in METHODS + ('auto',):
+        solvers[m] = lambda m=m: lstsq(X, y, method=m).coef
+
+    ref = lstsq(X, y, method='svd').coef
+    Xl = np.asarray(X, dtype=np.longdouble)
+    resid = np.asarray(y, dtype=np.longdouble) - Xl @ ref
+    ref = ref + lstsq(X, np.asarray(resid, dtype=np.float64), method='svd').coef
+
+    rows = []
+    for name in methods:
+        times = []
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            coef = np.asarray(solvers[name]())
+            times.append(time.perf_counter() - t0)
+        err = np.max(np.abs(coef - ref) / np.maximum(np.abs(ref), 1e-300))
+        rows.append({'method': name, 'time_ms': 1e3*min(times), 'rel_error': err})
+    return pd.DataFrame(rows).set_index('method')
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    import pandas as pd
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from exchange import read_exchange
+    from derived import DerivedFrame
+
+    filename07 = 'data/wcoa_cruise_2007/32WC20070511.exc.csv'
+    df07 = read_exchange(filename07)
+    df07['OmegaA'] = DerivedFrame(df07)['OmegaA']
+    ii = ((df07['CTDPRS'] >= 30) & (df07['CTDPRS'] <= 300) &
+          (df07['NITRAT_FLAG_W'] == 2) & (df07['PHSPHT_FLAG_W'] == 2) &
+          (df07['CTDOXY_FLAG_W'] == 2) & (df07['CTDSAL_FLAG_W'] == 2) &
+          (df07['TCARBN_FLAG_W'] == 2) & (df07['ALKALI_FLAG_W'] == 2) &
+          (df07['LATITUDE'] > 41) & (df07['LATITUDE'] < 48))
+    df07sub = df07[ii]
+    predictors = ['CTDTMP', 'CTDSAL', 'CTDPRS', 'CTDOXY', 'NITRAT']
+    X = np.column_stack([np.ones(len(df07sub)), df07sub[predictors]])
+    y = df07sub['OmegaA'].to_numpy()
+
+    fit = lstsq(X, y)
+    print(fit)
+    print('condition number of X: {:.3g}, with scaled columns: {:.3g}'.format(
+        np.linalg.cond(X), condition_number(X)))
+    print('VIF:', ', '.join('{} {:.1f}'.format(p, v)
+                            for p, v in zip(predictors, vif(X[:, 1:]))))
+
+    # the same fit, adding one station at a time and then removing the
+    # stations south of 45N
+    recursive = RecursiveLstsq()
+    for station, rows in df07sub.groupby('STNNBR').groups.items():
+        recursive.add(df07sub.loc[rows, predictors], df07sub.loc[rows, 'OmegaA'],
+                      key=station)
+    print('recursive fit, all stations, largest difference {:.2e}'.format(
+        np.max(np.abs(recursive.coef - fit.coef))))
+    south = df07sub.groupby('STNNBR')['LATITUDE'].mean() < 45
+    for station in south.index[south]:
+        recursive.remove(station)
+    north = ~df07sub['STNNBR'].isin(south.index[south])
+    print('recursive fit, north of 45N, largest difference {:.2e}'.format(
+        np.max(np.abs(recursive.coef - lstsq(X[north], y[north]).coef))))
+
+    # larger problems: resample the bottles (with noise) and add predictors
+    # that are nearly collinear with the measured ones
+    rng = np.random.default_rng(0)
+    pd.set_option('display.width', 120)
+    for N in [len(y), 10_000, 1_000_000]:
+        for k_extra in [0, 20]:
+            rows = rng.integers(0, len(y), N)
+            XN = X[rows] * (1 + 1e-3 * rng.standard_normal((N, X.shape[1])))
+            XN[:, 0] = 1
+            if k_extra:
+                mix = rng.standard_normal((X.shape[1] - 1, k_extra))
+                extra = XN[:, 1:] @ mix + 1e-4 * rng.standard_normal((N, k_extra))
+                XN = np.column_stack([XN, extra])
+            yN = y[rows] + 0.01 * rng.standard_normal(N)
+            print('\nN = {}, k = {}, scaled condition number {:.3g}'.format(
+                N, XN.shape[1] - 1, condition_number(XN)))
+            print(benchmark(XN, yN, repeat=1 if N > 100_000 else 3))
+
+    # a problem that is fit in chunks, without forming X
+    nchunks = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    def synthetic_chunks(nchunks, seed=0, chunksize=1_000_000):
+        gen = np.random.default_rng(seed)
+        for i in range(nchunks):
+            Xc = np.column_stack([np.ones(chunksize),
+                                  gen.normal(size=(chunksize, 5)) * [5, 1, 100, 50, 10]
+                                  + [10, 33, 150, 200, 20]])
+            yield Xc, Xc @ fit.coef + 0.1 * gen.standard_normal(chunksize)
+
+    for method in ['tsqr', 'normal']:
+        t0 = time.perf_counter()
+        big = chunked_lstsq(synthetic_chunks(nchunks), method=method)
+        t1 = time.perf_counter()
+        print('chunked_lstsq ({}), {} x 10^6 rows: {:6.2f} s'.format(
+            method, nchunks, t1-t0))
+    Xall, yall = (np.concatenate(a) for a in zip(*synthetic_chunks(min(nchunks, 3))))
+    ref = np.linalg.lstsq(Xall, yall, rcond=None)[0]
+    small = chunked_lstsq(synthetic_chunks(min(nchunks, 3)))
+    print('largest relative difference from np.linalg.lstsq: {:.2e}'.format(
+        np.max(np.abs(small.coef - ref) / np.abs(ref))))
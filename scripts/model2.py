@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''A module for model II regression.
+
+model2_regression fits model II lines (reduced major axis, major axis or
+Deming regression), which treat x and y symmetrically, to many pairs of
+variables at once, with bootstrap confidence intervals:
+
+    table = model2_pairs(df07, ['NITRAT', 'PHSPHT', 'CTDOXY'], method='rma',
+                         nboot=1000)
+'''
+
+import os
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+MODEL2_METHODS = ('ols', 'rma', 'ma', 'deming')
+
+# largest number of values in one block of bootstrap weights
+MAX_BLOCK = 2**24
+
+
+def _model2_from_sums(sums, method, delta):
+    '''
+    Slopes and intercepts from the sums of model2 data
+
+    Input: sums - array (..., 6, P) of n, sum(x), sum(y), sum(x**2),
+           sum(y**2), sum(x*y) for P pairs
+    Returns: slope, intercept and correlation arrays (..., P)
+    '''
+
+    n, sx, sy, sxx, syy, sxy = np.moveaxis(sums, -2, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        xbar = sx / n
+        ybar = sy / n
+        Sxx = sxx - sx * xbar
+        Syy = syy - sy * ybar
+        Sxy = sxy - sx * ybar
+        if method == 'ols':
+            slope = Sxy / Sxx
+        elif method == 'rma':
+            slope = np.sign(Sxy) * np.sqrt(Syy / Sxx)
+        elif method in ('ma', 'deming'):
+            d = 1.0 if method == 'ma' else delta
+            diff = Syy - d * Sxx
+            slope = (diff + np.sqrt(diff**2 + 4 * d * Sxy**2)) / (2 * Sxy)
+        else:
+            raise ValueError('method must be one of ' + ', '.join(MODEL2_METHODS))
+        r = Sxy / np.sqrt(Sxx * Syy)
+    return slope, ybar - slope * xbar, r
+
+
+def _model2_columns(x, y):
+    '''
+    Per-row terms of the sums used by _model2_from_sums, (N, 6, P), with
+    rows where x or y is missing set to zero. x and y are centered on their
+    means first, to avoid loss of precision in the sums.
+    '''
+
+    good = ~(np.isnan(x) | np.isnan(y))
+    x0 = np.nanmean(np.where(good, x, np.nan), axis=0)
+    y0 = np.nanmean(np.where(good, y, np.nan), axis=0)
+    dx = np.where(good, x - x0, 0.0)
+    dy = np.where(good, y - y0, 0.0)
+    return np.stack([good.astype(np.float64), dx, dy, dx*dx, dy*dy, dx*dy],
+                    axis=1), x0, y0
+
+
+def _model2_bootstrap(Z, nboot, seed, method, delta, max_block):
+    '''Slopes and intercepts of nboot bootstrap resamples of the rows of Z.'''
+
+    rng = np.random.default_rng(seed)
+    N = Z.shape[0]
+    Zflat = Z.reshape(N, -1)
+    rows = max(1, max_block // max(N, 1))
+    slopes = []
+    intercepts = []
+    for start in range(0, nboot, rows):
+        b = min(rows, nboot - start)
+        # number of times each row is drawn, for each resample
+        idx = rng.integers(0, N, (b, N)) + N * np.arange(b)[:, None]
+        w = np.bincount(idx.ravel(), minlength=b*N).reshape(b, N).astype(np.float64)
+        sums = (w @ Zflat).reshape(b, *Z.shape[1:])
+        slope, intercept, r = _model2_from_sums(sums, method, delta)
+        slopes.append(slope)
+        intercepts.append(intercept)
+    return np.concatenate(slopes), np.concatenate(intercepts)
+
+
+def model2_regression(x, y, method='rma', delta=1.0, nboot=0, confidence=0.95,
+                      seed=None, processes=1, max_block=MAX_BLOCK):
+    '''
+    Model II regression of y on x, for one or many pairs of variables
+
+    Methods:
+        'ols' - ordinary least squares (y on x), for comparison
+        'rma' - reduced major axis (geometric mean regression)
+        'ma' - major axis (orthogonal regression)
+        'deming' - Deming regression, with delta the ratio of the error
+                   variance of y to that of x (delta=1 is the major axis)
+
+    Bootstrap resamples are drawn as blocks of row weights, so the sums of
+    all the resamples of all the pairs are one matrix product per block.
+
+    Inputs:
+        x, y - arrays (N,) for one pair, or (N, P) for P pairs; rows where
+               x or y is NaN are ignored for that pair
+        method - 'ols', 'rma', 'ma' or 'deming'
+        delta - error variance ratio for Deming regression
+        nboot - number of bootstrap resamples (0 for none)
+        confidence - confidence level of the bootstrap percentile intervals
+        seed - seed for the random number generator
+        processes - number of processes to split the resamples across
+        max_block - largest number of weights computed at once
+    Returns: dictionary with the 'slope', 'intercept', correlation 'r' and
+             number of points 'n' of each pair, and if nboot > 0, the
+             'slope_ci' and 'intercept_ci' (lower and upper limits) and the
+             bootstrap standard errors 'slope_se' and 'intercept_se'
+    '''
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    single = x.ndim == 1
+    if single:
+        x = x[:, None]
+        y = y[:, None]
+    x, y = np.broadcast_arrays(x, y)
+
+    Z, x0, y0 = _model2_columns(x, y)
+    slope, intercept, r = _model2_from_sums(Z.sum(axis=0), method, delta)
+    result = {'slope': slope, 'intercept': intercept + y0 - slope * x0, 'r': r,
+              'n': Z[:, 0].sum(axis=0).astype(np.int64)}
+
+    if nboot > 0:
+        if processes is None:
+            processes = os.cpu_count()
+        if processes == 1:
+            slopes, intercepts = _model2_bootstrap(Z, nboot, seed, method,
+                                                   delta, max_block)
+        else:
+            seeds = np.random.SeedSequence(seed).spawn(processes)
+            shares = np.diff(np.linspace(0, nboot, processes + 1).astype(int))
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                futures = [pool.submit(_model2_bootstrap, Z, int(share),
+                                       np.random.default_rng(sq), method,
+                                       delta, max_block)
+                           for share, sq in zip(shares, seeds)]
+                results = [f.result() for f in futures]
+            slopes = np.concatenate([r[0] for r in results])
+            intercepts = np.concatenate([r[1] for r in results])
+        intercepts = intercepts + y0 - slopes * x0
+        q = [(1 - confidence) / 2, (1 + confidence) / 2]
+        result['slope_ci'] = np.nanquantile(slopes, q, axis=0)
+        result['intercept_ci'] = np.nanquantile(intercepts, q, axis=0)
+        result['slope_se'] = np.nanstd(slopes, axis=0, ddof=1)
+        result['intercept_se'] = np.nanstd(intercepts, axis=0, ddof=1)
+
+    if single:
+        result = {k: v[..., 0] for k, v in result.items()}
+    return result
+
+
+def model2_pairs(df, columns=None, pairs=None, method='rma', delta=1.0,
+                 nboot=0, confidence=0.95, seed=None, processes=1):
+    '''
+    Model II regression for pairs of columns of a dataframe
+
+    Inputs:
+        df - Pandas dataframe
+        columns - columns to regress against each other (every pair, with
+                  the first column of the pair as x); default all numeric
+                  columns
+        pairs - list of (x, y) column names, instead of columns
+        other inputs - see model2_regression
+    Returns: Pandas dataframe with one row per pair
+    '''
+
+    if pairs is None:
+        if columns is None:
+            columns = df.select_dtypes('number').columns
+        pairs = list(itertools.combinations(columns, 2))
+    xcols = [p[0] for p in pairs]
+    ycols = [p[1] for p in pairs]
+    result = model2_regression(df[xcols].to_numpy(dtype=np.float64),
+                               df[ycols].to_numpy(dtype=np.float64),
+                               method, delta, nboot, confidence, seed, processes)
+
+    table = pd.DataFrame({'x': xcols, 'y': ycols, 'n': result['n'],
+                          'slope': result['slope'],
+                          'intercept': result['intercept'], 'r': result['r']})
+    if nboot > 0:
+        table['slope_se'] = result['slope_se']
+        table['slope_lower'], table['slope_upper'] = result['slope_ci']
+        table['intercept_se'] = result['intercept_se']
+        table['intercept_lower'], table['intercept_upper'] = result['intercept_ci']
+    return table
+
+
+if __name__ == '__main__':
+    import time
+
+    rng = np.random.default_rng(0)
+
+    # model II regressions of every pair of 20 variables, with bootstrap
+    data = rng.normal(size=(2000, 20)) @ rng.normal(size=(20, 20))
+    t0 = time.perf_counter()
+    table = model2_pairs(pd.DataFrame(data), method='rma', nboot=1000, seed=0)
+    t1 = time.perf_counter()
+    print('RMA of {} pairs, 1000 bootstrap resamples: {:6.1f} ms'.format(
+        len(table), 1e3*(t1-t0)))
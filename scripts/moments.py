@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''A module for summary statistics of data that do not fit in memory.
+
+np.mean(weight) and np.std(weight) need the whole array. The accumulators
+here keep only the count, mean, sums of powers of deviations from the mean,
+minimum and maximum. They are updated one chunk at a time, and two
+accumulators (e.g. from different files or processes) can be merged exactly,
+using the pairwise formulas of Chan et al. (1979):
+
+    m = Moments()
+    for chunk in chunks:
+        m.update(chunk['weight'])
+    m.mean, m.std(), m.skew
+
+GroupedMoments does the same for many groups at once, e.g. for every species
+or every species and cruise. specimen_moments summarizes a trawl specimen
+file this way, reading it in chunks (optionally split across processes):
+
+    table = specimen_moments(TRAWL_FILE, 'weight', by='scientific_name')
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+FIELDS = ('n', 'mean', 'M2', 'M3', 'min', 'max')
+
+
+def _combine(a, b):
+    '''
+    Merge the statistics of two sets of data (dictionaries of arrays with
+    the FIELDS keys). Works element-wise for arrays of groups.
+    '''
+
+    na, nb = a['n'], b['n']
+    n = na + nb
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = b['mean'] - a['mean']
+        frac_b = np.where(n > 0, nb / np.where(n > 0, n, 1), 0.0)
+        mean = a['mean'] + delta * frac_b
+        M2 = a['M2'] + b['M2'] + delta**2 * na * frac_b
+        M3 = (a['M3'] + b['M3'] + delta**3 * na * frac_b * (na - nb) / np.where(n > 0, n, 1)
+              + 3 * delta * (na * b['M2'] - nb * a['M2']) / np.where(n > 0, n, 1))
+    # groups where one side is empty take the other side as it is
+    empty_a = na == 0
+    empty_b = nb == 0
+    mean = np.where(empty_a, b['mean'], np.where(empty_b, a['mean'], mean))
+    M2 = np.where(empty_a, b['M2'], np.where(empty_b, a['M2'], M2))
+    M3 = np.where(empty_a, b['M3'], np.where(empty_b, a['M3'], M3))
+    return {'n': n, 'mean': mean, 'M2': M2, 'M3': M3,
+            'min': np.fmin(a['min'], b['min']), 'max': np.fmax(a['max'], b['max'])}
+
+
+def _group_stats(values, codes, ngroups):
+    '''Statistics of one chunk for each group (codes are 0 .. ngroups-1).'''
+
+    n = np.bincount(codes, minlength=ngroups).astype(np.int64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(codes, weights=values, minlength=ngroups) / n
+    mean = np.where(n > 0, mean, 0.0)
+    dev = values - mean[codes]
+    M2 = np.bincount(codes, weights=dev**2, minlength=ngroups)
+    M3 = np.bincount(codes, weights=dev**3, minlength=ngroups)
+    vmin = np.full(ngroups, np.nan)
+    vmax = np.full(ngroups, np.nan)
+    has = n > 0
+    vmin[has] = np.inf
+    vmax[has] = -np.inf
+    np.minimum.at(vmin, codes, values)
+    np.maximum.at(vmax, codes, values)
+    return {'n': n, 'mean': mean, 'M2': M2, 'M3': M3, 'min': vmin, 'max': vmax}
+
+
+class Moments:
+    '''
+    Running count, mean, variance, skewness, minimum and maximum
+
+    Input: optional first chunk of data
+    '''
+
+    def __init__(self, values=None):
+        self.stats = {'n': np.int64(0), 'mean': 0.0, 'M2': 0.0, 'M3': 0.0,
+                      'min': np.nan, 'max': np.nan}
+        if values is not None:
+            self.update(values)
+
+    def update(self, values):
+        '''Add a chunk of data (NaN values are ignored). Returns self.'''
+
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        chunk = _group_stats(values, np.zeros(len(values), dtype=np.int64), 1)
+        chunk = {k: v[0] for k, v in chunk.items()}
+        self.stats = _combine(self.stats, chunk)
+        return self
+
+    def merge(self, other):
+        '''Add the data summarized by another Moments object. Returns self.'''
+
+        self.stats = _combine(self.stats, other.stats)
+        return self
+
+    def __add__(self, other):
+        result = Moments()
+        result.stats = _combine(self.stats, other.stats)
+        return result
+
+    @property
+    def n(self):
+        return int(self.stats['n'])
+
+    @property
+    def mean(self):
+        return float(self.stats['mean']) if self.n > 0 else np.nan
+
+    def var(self, ddof=0):
+        '''Variance (ddof=0 like np.var, ddof=1 for the sample variance).'''
+        return float(self.stats['M2'] / (self.n - ddof)) if self.n > ddof else np.nan
+
+    def std(self, ddof=0):
+        '''Standard deviation (ddof=0 like np.std).'''
+        return np.sqrt(self.var(ddof))
+
+    @property
+    def skew(self):
+        '''Skewness (biased, like scipy.stats.skew).'''
+        if self.n == 0 or self.stats['M2'] == 0:
+            return np.nan
+        return float(np.sqrt(self.n) * self.stats['M3'] / self.stats['M2']**1.5)
+
+    @property
+    def min(self):
+        return float(self.stats['min'])
+
+    @property
+    def max(self):
+        return float(self.stats['max'])
+
+    def to_dict(self):
+        '''Plain dictionary of the accumulated statistics (e.g. to send to
+        another process or save to a file).'''
+        return {k: float(v) for k, v in self.stats.items()}
+
+    @classmethod
+    def from_dict(cls, d):
+        m = cls()
+        m.stats = {k: np.float64(d[k]) for k in FIELDS}
+        m.stats['n'] = np.int64(d['n'])
+        return m
+
+
+class GroupedMoments:
+    '''
+    Moments of a variable for every group (e.g. species, or species and
+    cruise), updated one chunk at a time
+    '''
+
+    def __init__(self):
+        self.keys = {}
+        self.stats = {k: np.zeros(0) for k in FIELDS}
+        self.stats['n'] = np.zeros(0, dtype=np.int64)
+
+    def _codes(self, groups):
+        '''Group numbers of a chunk, adding new groups as they appear.'''
+
+        if isinstance(groups, (list, tuple)) and len(groups) == 1:
+            groups = groups[0]
+        if isinstance(groups, (list, tuple)) and len(groups) > 0 and np.ndim(groups[0]) > 0:
+            labels = list(zip(*[np.asarray(g).tolist() for g in groups]))
+        else:
+            labels = np.asarray(groups).tolist()
+        chunk_codes, uniques = pd.factorize(pd.Series(labels, dtype=object))
+        new = [u for u in uniques if u not in self.keys]
+        for u in new:
+            self.keys[u] = len(self.keys)
+        if new:
+            self._grow(len(self.keys))
+        lookup = np.array([self.keys[u] for u in uniques], dtype=np.int64)
+        return lookup[chunk_codes]
+
+    def _grow(self, ngroups):
+        extra = ngroups - len(self.stats['n'])
+        empty = {'n': np.zeros(extra, dtype=np.int64), 'mean': np.zeros(extra),
+                 'M2': np.zeros(extra), 'M3': np.zeros(extra),
+                 'min': np.full(extra, np.nan), 'max': np.full(extra, np.nan)}
+        self.stats = {k: np.concatenate([self.stats[k], empty[k]]) for k in FIELDS}
+
+    def update(self, values, groups):
+        '''
+        Add a chunk of data
+
+        Inputs:
+            values - array of values (NaN values are ignored)
+            groups - array of group labels, or a list of arrays (e.g.
+                     [species, cruise]) whose combinations are the groups
+        Returns: self
+        '''
+
+        values = np.asarray(values, dtype=np.float64)
+        codes = self._codes(groups)
+        good = ~np.isnan(values)
+        chunk = _group_stats(values[good], codes[good], len(self.keys))
+        self.stats = _combine(self.stats, chunk)
+        return self
+
+    def update_frame(self, df, value_col, group_cols):
+        '''Add a chunk from a DataFrame (e.g. from a chunked reader).'''
+
+        if isinstance(group_cols, str):
+            return self.update(df[value_col], df[group_cols])
+        return self.update(df[value_col], [df[c] for c in group_cols])
+
+    def merge(self, other):
+        '''Add the data summarized by another GroupedMoments. Returns self.'''
+
+        for key in other.keys:
+            if key not in self.keys:
+                self.keys[key] = len(self.keys)
+        self._grow(len(self.keys))
+        aligned = {k: np.zeros(len(self.keys)) for k in FIELDS}
+        aligned['n'] = np.zeros(len(self.keys), dtype=np.int64)
+        aligned['min'][:] = np.nan
+        aligned['max'][:] = np.nan
+        idx = np.array([self.keys[k] for k in other.keys], dtype=np.int64)
+        for k in FIELDS:
+            aligned[k][idx] = other.stats[k]
+        self.stats = _combine(self.stats, aligned)
+        return self
+
+    def to_frame(self, ddof=0):
+        '''
+        Table of statistics with one row per group
+
+        Input: delta degrees of freedom of the variance and standard deviation
+        Returns: Pandas dataframe with n, mean, std, var, skew, min and max
+        '''
+
+        n = self.stats['n']
+        M2 = self.stats['M2']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            var = np.where(n > ddof, M2 / (n - ddof), np.nan)
+            skew = np.where((n > 0) & (M2 > 0),
+                            np.sqrt(n) * self.stats['M3'] / M2**1.5, np.nan)
+        return pd.DataFrame({'n': n, 'mean': np.where(n > 0, self.stats['mean'], np.nan),
+                             'std': np.sqrt(var), 'var': var, 'skew': skew,
+                             'min': self.stats['min'], 'max': self.stats['max']},
+                            index=list(self.keys))
+
+
+def _file_moments(file_name, variable, by, chunksize, start, stop):
+    '''GroupedMoments of one range of rows of a netCDF file.'''
+
+    from trawl import iter_netcdf_chunks
+
+    result = GroupedMoments()
+    for chunk in iter_netcdf_chunks(file_name, [variable] + by, chunksize,
+                                    start, stop):
+        result.update(chunk[variable], [chunk[c] for c in by])
+    return result
+
+
+def specimen_moments(file_name, variable='weight', by='scientific_name',
+                     chunksize=100000, processes=1, ddof=0):
+    '''
+    Summary statistics of a variable of a netCDF file, by group, without
+    reading the whole file into memory
+
+    Inputs:
+        file_name - path to the netCDF file (e.g. the trawl specimen file)
+        variable - name of the variable to summarize
+        by - variable name, or list of names, to group by (e.g.
+             ['scientific_name', 'cruise'])
+        chunksize - number of rows read at once
+        processes - number of processes to split the rows across
+        ddof - delta degrees of freedom of the variance and standard deviation
+    Returns: Pandas dataframe with one row per group (see
+             GroupedMoments.to_frame)
+    '''
+
+    import netCDF4 as nc4
+
+    by = [by] if isinstance(by, str) else list(by)
+    with nc4.Dataset(file_name) as ds:
+        nrows = ds.variables[variable].shape[0]
+    if processes is None:
+        processes = os.cpu_count()
+
+    if processes == 1:
+        result = _file_moments(file_name, variable, by, chunksize, 0, nrows)
+    else:
+        bounds = np.linspace(0, nrows, processes + 1).astype(int)
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(_file_moments, file_name, variable, by,
+                                   chunksize, int(start), int(stop))
+                       for start, stop in zip(bounds[:-1], bounds[1:])]
+            result = GroupedMoments()
+            for f in futures:
+                result.merge(f.result())
+
+    table = result.to_frame(ddof)
+    if len(by) > 1:
+        table.index = pd.MultiIndex.from_tuples(table.index, names=by)
+    else:
+        table.index.name = by[0]
+    return table.sort_index()
+
+
+if __name__ == '__main__':
+    import sys
+    from scipy import stats
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from exchange import iter_exchange, read_exchange
+
+    # nitrate statistics by station, from 500-row chunks of the 2007 cruise
+    filename07 = 'data/wcoa_cruise_2007/32WC20070511.exc.csv'
+    by_station = GroupedMoments()
+    total = Moments()
+    for chunk in iter_exchange(filename07, chunksize=500):
+        by_station.update_frame(chunk, 'NITRAT', 'STNNBR')
+        total.update(chunk['NITRAT'])
+
+    df07 = read_exchange(filename07)
+    nitrate = df07['NITRAT'].dropna()
+    print('mean {:.4f} ({:.4f}), std {:.4f} ({:.4f}), skew {:.4f} ({:.4f})'
+          .format(total.mean, np.mean(nitrate), total.std(), np.std(nitrate),
+                  total.skew, stats.skew(nitrate)))
+    expected = df07.groupby('STNNBR')['NITRAT'].agg(['count', 'mean', 'std'])
+    result = by_station.to_frame(ddof=1).loc[expected.index]
+    print('stations match:', np.allclose(result[['n', 'mean', 'std']].to_numpy(),
+                                         expected.to_numpy(), equal_nan=True))
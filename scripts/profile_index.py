@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''A module for indexing bottle data by profile (station and cast).
+
+Bottles are grouped by EXPOCODE/STNNBR/CASTNO and sorted by pressure within
+each cast. The sorted row numbers are stored in one array, with an array of
+offsets marking where each cast starts (compressed sparse row, or CSR,
+layout). Pressure range selections like
+
+    ii = (df07['CTDPRS'] >= 30) & (df07['CTDPRS'] <= 300)
+
+become binary searches within each cast, and per-cast statistics are
+computed over contiguous segments of the sorted arrays:
+
+    profiles = ProfileIndex(df07)
+    ii = profiles.rows(30, 300)
+    surface_temp = profiles.reduce(df07['CTDTMP'], 'mean', pmax=10)
+
+Building the index costs about as much as two mask + groupby summaries, so
+it pays off when a table is queried repeatedly. Bottles without a pressure
+are kept in the index but are never in a pressure range.
+'''
+
+import numpy as np
+
+CAST_KEYS = ('EXPOCODE', 'STNNBR', 'CASTNO')
+
+
+class ProfileIndex:
+    '''
+    Rows of a bottle data table grouped by cast and sorted by pressure
+
+    Inputs:
+        df - DataFrame with the cast key columns and a pressure column
+        keys - columns that identify a cast
+        pressure - name of the pressure column
+    '''
+
+    def __init__(self, df, keys=CAST_KEYS, pressure='CTDPRS'):
+        keys = [k for k in keys if k in df.columns]
+        cast = df.groupby(keys, sort=True, dropna=False).ngroup().to_numpy()
+        p = np.asarray(df[pressure], dtype=np.float64)
+
+        # sort by cast, then by pressure (NaN pressures go last in each cast)
+        self.order = np.lexsort((p, cast))
+        self.cast = cast[self.order]
+        self.pressure = p[self.order]
+        self.ncasts = int(cast.max()) + 1 if len(cast) > 0 else 0
+        self.offsets = np.zeros(self.ncasts + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cast, minlength=self.ncasts), out=self.offsets[1:])
+
+        # one table row for each cast, in the same order as the offsets
+        first = self.order[self.offsets[:-1]]
+        self.casts = df[keys].iloc[first].reset_index(drop=True)
+
+        # pressures shifted by a multiple of the cast number, so that the
+        # whole array is sorted and one np.searchsorted call covers every cast
+        valid = ~np.isnan(self.pressure)
+        # end of the bottles with a pressure in each cast (the NaNs follow)
+        self.ends = self.offsets[:-1] + np.bincount(self.cast[valid],
+                                                    minlength=self.ncasts)
+        if valid.any():
+            self._pmin = self.pressure[valid].min()
+            self._pmax = self.pressure[valid].max()
+        else:
+            self._pmin = self._pmax = 0.0
+        self._span = self._pmax - self._pmin + 2.0
+        filled = np.where(valid, self.pressure, self._pmax + 1.0)
+        self._key = (filled - self._pmin) + self.cast * self._span
+
+    def __len__(self):
+        return self.ncasts
+
+    def profile(self, i, pmin=None, pmax=None):
+        '''
+        Row numbers of one cast, sorted by pressure
+
+        Inputs:
+            i - cast number (row of self.casts)
+            pmin, pmax - optional pressure limits (inclusive)
+        Returns: row numbers of the bottles in the cast and pressure range
+                 (bottles without a pressure are left out)
+        '''
+
+        start, stop = self.offsets[i], self.ends[i]
+        p = self.pressure[start:stop]
+        lo = 0 if pmin is None else np.searchsorted(p, pmin, side='left')
+        hi = len(p) if pmax is None else np.searchsorted(p, pmax, side='right')
+        return self.order[start+lo:start+max(hi, lo)]
+
+    def segments(self, pmin=None, pmax=None):
+        '''
+        Start and stop positions (in the sorted arrays) of a pressure range
+
+        Inputs:
+            pmin, pmax - pressure limits (inclusive), None for no limit
+        Returns: two arrays with one start and one stop for every cast
+                 (bottles without a pressure are never in the range)
+        '''
+
+        casts = np.arange(self.ncasts) * self._span
+        if pmin is None:
+            starts = self.offsets[:-1].copy()
+        else:
+            lo = np.clip(pmin, self._pmin, self._pmax + 0.5) - self._pmin
+            starts = np.searchsorted(self._key, casts + lo, side='left')
+        if pmax is None:
+            stops = self.ends.copy()
+        else:
+            hi = np.clip(pmax, self._pmin - 0.5, self._pmax) - self._pmin
+            stops = np.searchsorted(self._key, casts + hi, side='right')
+        return starts, np.maximum(stops, starts)
+
+    def _positions(self, starts, stops):
+        '''Positions in the sorted arrays covered by a set of segments.'''
+
+        lengths = stops - starts
+        total = lengths.sum()
+        # ramp within each segment, added to the segment start
+        seg_start = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return seg_start + np.arange(total)
+
+    def rows(self, pmin=None, pmax=None):
+        '''
+        Row numbers of the bottles in a pressure range
+
+        Inputs:
+            pmin, pmax - pressure limits (inclusive), None for no limit
+        Returns: row numbers, grouped by cast and sorted by pressure
+        '''
+
+        starts, stops = self.segments(pmin, pmax)
+        return self.order[self._positions(starts, stops)]
+
+    def counts(self, pmin=None, pmax=None):
+        '''Number of bottles in a pressure range for every cast.'''
+
+        starts, stops = self.segments(pmin, pmax)
+        return stops - starts
+
+    def reduce(self, values, func='mean', pmin=None, pmax=None):
+        '''
+        Summarize a variable over each cast
+
+        Inputs:
+            values - column or array with one value per row of the table
+            func - 'sum', 'count', 'mean', 'min', 'max', 'first' (shallowest)
+                   or 'last' (deepest); NaN values are ignored
+            pmin, pmax - optional pressure range (inclusive)
+        Returns: array with one value per cast (NaN for casts with no data)
+        '''
+
+        starts, stops = self.segments(pmin, pmax)
+        lengths = stops - starts
+
+        # gather only the selected rows; each cast is a contiguous segment
+        rows = self.order[self._positions(starts, stops)]
+        x = np.asarray(values, dtype=np.float64)[rows]
+        segment = np.repeat(np.arange(self.ncasts), lengths)
+        good = ~np.isnan(x)
+        x = x[good]
+        segment = segment[good]
+        count = np.bincount(segment, minlength=self.ncasts)
+
+        if func == 'count':
+            return count
+        elif func in ('sum', 'mean'):
+            total = np.bincount(segment, weights=x, minlength=self.ncasts)
+            if func == 'sum':
+                return total
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return total / count
+        elif func in ('min', 'max', 'first', 'last'):
+            has_data = count > 0
+            bounds = (np.cumsum(count) - count)[has_data]
+            out = np.full(self.ncasts, np.nan)
+            if func == 'min':
+                out[has_data] = np.minimum.reduceat(x, bounds)
+            elif func == 'max':
+                out[has_data] = np.maximum.reduceat(x, bounds)
+            elif func == 'first':
+                out[has_data] = x[bounds]
+            else:
+                out[has_data] = x[bounds + count[has_data] - 1]
+            return out
+        else:
+            raise ValueError('unknown reduction: ' + str(func))
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    import time
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from exchange import read_exchange
+
+    df07 = read_exchange('data/wcoa_cruise_2007/32WC20070511.exc.csv')
+    n = 200
+
+    t0 = time.perf_counter()
+    profiles = ProfileIndex(df07)
+    t1 = time.perf_counter()
+    for i in range(n):
+        rows = profiles.rows(30, 300)
+    t2 = time.perf_counter()
+    for i in range(n):
+        ii = np.flatnonzero((df07['CTDPRS'] >= 30) & (df07['CTDPRS'] <= 300))
+    t3 = time.perf_counter()
+    for i in range(n):
+        mean_index = profiles.reduce(df07['CTDTMP'], 'mean', pmax=10)
+    t4 = time.perf_counter()
+    for i in range(n):
+        surf = df07[df07['CTDPRS'] <= 10]
+        mean_groupby = surf.groupby(list(CAST_KEYS))['CTDTMP'].mean()
+    t5 = time.perf_counter()
+
+    print(len(df07), 'bottles in', len(profiles), 'casts')
+    print('build index:        {:8.1f} us'.format(1e6*(t1-t0)))
+    print('rows(30, 300):      {:8.1f} us'.format(1e6*(t2-t1)/n))
+    print('boolean mask:       {:8.1f} us'.format(1e6*(t3-t2)/n))
+    print('surface mean:       {:8.1f} us'.format(1e6*(t4-t3)/n))
+    print('mask + groupby:     {:8.1f} us'.format(1e6*(t5-t4)/n))
+    print('same rows:', np.array_equal(np.sort(rows), ii))
+    print('same means:', np.allclose(mean_index[~np.isnan(mean_index)],
+                                     mean_groupby.to_numpy()))
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''A module for fitting many regression models at once.
+
+PolynomialSweep fits polynomials of every degree from 0 to K to the same
+data (like the length-weight fits in the modeling and sampling notes) from a
+single QR decomposition, instead of calling np.polyfit for each degree:
+
+    sweep = polyfit_sweep(length, weight, max_degree=10)
+    z = sweep.coefficients(7)     # same as np.polyfit(length, weight, 7)
+    sweep.rmse[7]                 # RMSE of the degree 7 fit
+    sweep.cv_rmse(nfolds=5)       # cross-validated RMSE of every degree
+
+LossLandscape evaluates the RMSE of constant (weight = c) and linear
+(weight = a + b*length) models over grids of parameter values. It keeps only
+the sums of the data (count, means, sums of squares and products), so each
+grid point costs the same no matter how many data there are:
+
+    loss = LossLandscape(weight)
+    xsae = loss.rmse_constant(np.arange(0, 31, 0.1))
+'''
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+from numpy.polynomial import legendre
+from scipy import linalg
+
+
+class PolynomialSweep:
+    '''
+    Least squares polynomial fits of every degree from 0 to max_degree
+
+    The fits use Legendre polynomials of x scaled to [-1, 1], which are
+    much better conditioned than powers of x. Because the basis functions of
+    a degree d fit are the first d+1 columns of the design matrix, one QR
+    decomposition gives the fits of all degrees.
+
+    Degrees of at least the number of distinct x values (rank and above)
+    have no unique fit. Their coefficients are those of np.polyfit (the
+    minimum norm least squares solution), and their RMSE is that of the
+    degree rank - 1 fit.
+
+    Inputs:
+        x, y - data arrays
+        max_degree - highest polynomial degree
+    '''
+
+    def __init__(self, x, y, max_degree=10):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.max_degree = max_degree
+
+        xmin, xmax = np.min(self.x), np.max(self.x)
+        if xmax == xmin:
+            xmin, xmax = xmin - 1, xmax + 1
+        self.domain = np.array([xmin, xmax])
+
+        # degrees beyond the number of distinct x values - 1 have no unique
+        # fit, so the decomposition stops at the last well-determined column
+        V = self._vander(self.x)
+        rank = min(self.max_degree + 1, len(np.unique(self.x)))
+        Q, R = np.linalg.qr(V[:, :rank])
+        pivots = np.abs(np.diag(R))
+        small = pivots <= pivots.max() * max(V.shape) * np.finfo(np.float64).eps
+        if small.any():
+            rank = int(np.argmax(small))
+            Q, R = Q[:, :rank], R[:rank, :rank]
+        self.rank = rank
+        self._R = R
+        self._qty = Q.T @ self.y
+
+        # fitted values of degree d are the sum of the first d+1 columns;
+        # higher degrees than the rank fit the data no better
+        fitted = np.cumsum(Q * self._qty, axis=1)
+        self.fitted = np.concatenate(
+            [fitted, np.repeat(fitted[:, -1:], self.max_degree + 1 - rank, axis=1)],
+            axis=1)
+        residuals = self.y[:, None] - self.fitted
+        self.sse = np.sum(residuals**2, axis=0)
+        self.rmse = np.sqrt(self.sse / len(self.y))
+        self._cv = {}
+
+    @property
+    def degrees(self):
+        return np.arange(self.max_degree + 1)
+
+    def _vander(self, x):
+        t = (2*np.asarray(x, dtype=np.float64) - self.domain.sum()) / np.diff(self.domain)
+        return legendre.legvander(t, self.max_degree)
+
+    def legendre_coefficients(self, degree):
+        '''Coefficients of a fit in the scaled Legendre basis.'''
+
+        n = degree + 1
+        if n <= self.rank:
+            return linalg.solve_triangular(self._R[:n, :n], self._qty[:n])
+        series = np.polynomial.Polynomial(self.coefficients(degree)[::-1]).convert(
+            kind=legendre.Legendre, domain=self.domain)
+        return np.pad(series.coef, (0, n - len(series.coef)))
+
+    def coefficients(self, degree):
+        '''
+        Polynomial coefficients of the fit of one degree
+
+        Input: degree of the polynomial
+        Returns: coefficients, highest power first (like np.polyfit)
+        '''
+
+        if degree + 1 > self.rank:
+            # no unique fit: the minimum norm solution of np.polyfit
+            return np.polyfit(self.x, self.y, degree)
+        series = legendre.Legendre(self.legendre_coefficients(degree),
+                                   domain=self.domain)
+        coef = series.convert(kind=np.polynomial.Polynomial).coef
+        coef = np.pad(coef, (0, degree + 1 - len(coef)))
+        return coef[::-1]
+
+    def poly1d(self, degree):
+        '''np.poly1d of the fit of one degree.'''
+        return np.poly1d(self.coefficients(degree))
+
+    def predict(self, x, degree):
+        '''
+        Evaluate the fit of one degree
+
+        Inputs:
+            x - values to evaluate the polynomial at
+            degree - degree of the polynomial
+        Returns: array of predictions
+        '''
+
+        V = self._vander(x)[..., :degree + 1]
+        return V @ self.legendre_coefficients(degree)
+
+    def cv_rmse(self, nfolds=5, seed=0):
+        '''
+        k-fold cross-validated RMSE of every degree
+
+        For each fold, the Gram matrix of the training rows is the Gram
+        matrix of all rows minus that of the held-out rows. Its Cholesky
+        factor is computed once per fold. The leading (d+1) x (d+1) block of
+        that factor is the Cholesky factor for degree d, so one factorization
+        per fold covers every degree.
+
+        Inputs:
+            nfolds - number of folds
+            seed - seed for the random assignment of rows to folds
+        Returns: array of RMSE values of the held-out predictions, one per
+                 degree
+        '''
+
+        key = (nfolds, seed)
+        if key in self._cv:
+            return self._cv[key]
+
+        V = self._vander(self.x)
+        G = V.T @ V
+        b = V.T @ self.y
+        fold = np.random.default_rng(seed).permutation(len(self.y)) % nfolds
+
+        sse = np.zeros(self.max_degree + 1)
+        for k in range(nfolds):
+            test = fold == k
+            Vt = V[test]
+            yt = self.y[test]
+            G_train = G - Vt.T @ Vt
+            b_train = b - Vt.T @ yt
+            # degrees past a vanishing pivot (too few distinct x values in
+            # the training rows) are solved with lstsq instead
+            try:
+                L = linalg.cholesky(G_train, lower=True)
+                good = np.diag(L)**2 > 1e-10 * np.diag(G_train)
+                nchol = len(good) if good.all() else int(np.argmin(good))
+            except linalg.LinAlgError:
+                nchol = 0
+            for d in range(self.max_degree + 1):
+                n = d + 1
+                if n <= nchol:
+                    z = linalg.solve_triangular(L[:n, :n], b_train[:n], lower=True)
+                    c = linalg.solve_triangular(L[:n, :n].T, z, lower=False)
+                else:
+                    c = np.linalg.lstsq(G_train[:n, :n], b_train[:n], rcond=None)[0]
+                sse[d] += np.sum((yt - Vt[:, :n] @ c)**2)
+
+        self._cv[key] = np.sqrt(sse / len(self.y))
+        return self._cv[key]
+
+
+class LossLandscape:
+    '''
+    Loss of constant and linear models from the sums of the data
+
+    For the constant model y = c and the linear model y = a + b*x,
+
+        SSE(c) = Syy + n*(ybar - c)**2
+        SSE(a, b) = Syy - 2*b*Sxy + b**2*Sxx + n*(ybar - a - b*xbar)**2
+
+    where Sxx, Sxy and Syy are sums of squares and products of deviations
+    from the means. The data can be added in chunks with update.
+
+    Inputs:
+        y - data (e.g. weight)
+        x - optional predictor for the linear model (e.g. standard_length)
+    '''
+
+    def __init__(self, y=None, x=None):
+        self.n = 0
+        self.xbar = 0.0
+        self.ybar = 0.0
+        self.Sxx = 0.0
+        self.Sxy = 0.0
+        self.Syy = 0.0
+        if y is not None:
+            self.update(y, x)
+
+    def update(self, y, x=None):
+        '''
+        Add a chunk of data (rows with NaN values are ignored)
+
+        Inputs: y and optional x arrays, as for the constructor
+        Returns: self
+        '''
+
+        y = np.asarray(y, dtype=np.float64).ravel()
+        x = np.zeros_like(y) if x is None else np.asarray(x, dtype=np.float64).ravel()
+        good = ~(np.isnan(y) | np.isnan(x))
+        y = y[good]
+        x = x[good]
+        nb = len(y)
+        if nb == 0:
+            return self
+
+        xbar_b = x.mean()
+        ybar_b = y.mean()
+        dx = x - xbar_b
+        dy = y - ybar_b
+        # combine the sums of the two sets of data about their own means
+        na = self.n
+        n = na + nb
+        delta_x = xbar_b - self.xbar
+        delta_y = ybar_b - self.ybar
+        f = na * nb / n
+        self.Sxx += np.dot(dx, dx) + delta_x**2 * f
+        self.Sxy += np.dot(dx, dy) + delta_x * delta_y * f
+        self.Syy += np.dot(dy, dy) + delta_y**2 * f
+        self.xbar += delta_x * nb / n
+        self.ybar += delta_y * nb / n
+        self.n = n
+        return self
+
+    def sse_constant(self, c):
+        '''Sum of squared errors of the model y = c (c can be an array).'''
+        return self.Syy + self.n * (self.ybar - np.asarray(c, dtype=np.float64))**2
+
+    def rmse_constant(self, c):
+        '''RMSE of the model y = c (c can be an array).'''
+        return np.sqrt(self.sse_constant(c) / self.n)
+
+    def sse_linear(self, a, b):
+        '''
+        Sum of squared errors of the model y = a + b*x
+
+        Inputs: intercepts a and slopes b (arrays are broadcast against each
+                other, e.g. from np.meshgrid)
+        Returns: array of SSE values
+        '''
+
+        a = np.asarray(a, dtype=np.float64)
+        b = np.asarray(b, dtype=np.float64)
+        return (self.Syy - 2*b*self.Sxy + b**2 * self.Sxx
+                + self.n * (self.ybar - a - b*self.xbar)**2)
+
+    def rmse_linear(self, a, b):
+        '''RMSE of the model y = a + b*x (see sse_linear).'''
+        return np.sqrt(self.sse_linear(a, b) / self.n)
+
+    def best_constant(self):
+        '''Constant with the smallest RMSE (the mean of y).'''
+        return self.ybar
+
+    def best_linear(self):
+        '''Intercept and slope of the least squares line.'''
+
+        b = self.Sxy / self.Sxx
+        return self.ybar - b * self.xbar, b
+
+    def plot_constant(self, c, ax=None, xlabel='$\\hat{weight}$ [g]',
+                      ylabel='RMSE [g]'):
+        '''
+        Plot the RMSE of the constant model against c, with the mean of y
+        as a dashed red line
+
+        Inputs:
+            c - array of constants
+            ax - matplotlib axes (default: a new figure)
+            xlabel, ylabel - axis labels
+        Returns: the matplotlib axes
+        '''
+
+        import matplotlib.pyplot as plt
+
+        if ax is None:
+            plt.figure()
+            ax = plt.gca()
+        ax.plot(c, self.rmse_constant(c))
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        xl = ax.get_xlim()
+        yl = ax.get_ylim()
+        ax.plot([self.ybar, self.ybar], [yl[0], yl[1]], 'r--', lw=2)
+        ax.set_xlim(xl)
+        ax.set_ylim(yl)
+        return ax
+
+
+# the most recently used fits, keyed by a hash of the data
+_sweeps = OrderedDict()
+MAX_SWEEPS = 8
+
+
+def polyfit_sweep(x, y, max_degree=10):
+    '''
+    PolynomialSweep of the data, reused if the same data were fit recently
+    (the last MAX_SWEEPS fits are kept)
+
+    Inputs:
+        x, y - data arrays
+        max_degree - highest polynomial degree
+    Returns: PolynomialSweep
+    '''
+
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    y = np.ascontiguousarray(y, dtype=np.float64)
+    h = hashlib.sha1(x.tobytes())
+    h.update(y.tobytes())
+    key = (h.hexdigest(), max_degree)
+    if key in _sweeps:
+        _sweeps.move_to_end(key)
+    else:
+        _sweeps[key] = PolynomialSweep(x, y, max_degree)
+        while len(_sweeps) > MAX_SWEEPS:
+            _sweeps.popitem(last=False)
+    return _sweeps[key]
+
+
+if __name__ == '__main__':
+    import time
+
+    # stand-in for the anchovy length-weight data
+    rng = np.random.default_rng(0)
+    length = rng.uniform(20, 180, 10623)
+    weight = 1e-5 * length**3 * rng.lognormal(0, 0.15, len(length))
+
+    t0 = time.perf_counter()
+    for N in range(11):
+        z = np.polyfit(length, weight, N)
+    t1 = time.perf_counter()
+    sweep = polyfit_sweep(length, weight, 10)
+    t2 = time.perf_counter()
+    sweep = polyfit_sweep(length, weight, 10)
+    cv = sweep.cv_rmse()
+    t3 = time.perf_counter()
+
+    print('np.polyfit, degrees 0-10:  {:6.1f} ms'.format(1e3*(t1-t0)))
+    print('PolynomialSweep:           {:6.1f} ms'.format(1e3*(t2-t1)))
+    print('cached + 5-fold CV:        {:6.1f} ms'.format(1e3*(t3-t2)))
+    for N in range(11):
+        p = np.poly1d(np.polyfit(length, weight, N))
+        rmse = np.sqrt(np.mean((weight - p(length))**2))
+        print('degree {:2d}: RMSE {:.4f} (np.polyfit {:.4f}), CV RMSE {:.4f}'
+              .format(N, sweep.rmse[N], rmse, cv[N]))
+
+    # RMSE of constant models, as in the xmod/xsae loop of the notebook
+    xmod = np.arange(0, 31, 0.001)
+    t0 = time.perf_counter()
+    xsae = np.nan*np.zeros(len(xmod))
+    for i, xmodi in enumerate(xmod[:1000]):
+        xsae[i] = np.sqrt(np.mean((weight-xmodi)**2))
+    t1 = time.perf_counter()
+    loss = LossLandscape(weight, length)
+    rmse_c = loss.rmse_constant(xmod)
+    t2 = time.perf_counter()
+    print('loop over {} constants:  {:6.1f} ms (estimated from 1000)'.format(
+        len(xmod), 1e3*(t1-t0)*len(xmod)/1000))
+    print('LossLandscape:           {:6.1f} ms, max difference {:.2e}'.format(
+        1e3*(t2-t1), np.max(np.abs(rmse_c[:1000] - xsae[:1000]))))
+    a, b = np.meshgrid(np.linspace(-40, 10, 1000), np.linspace(0, 0.6, 1000))
+    rmse_ab = loss.rmse_linear(a, b)
+    print('best line: a = {:.3f}, b = {:.4f}; grid minimum RMSE {:.4f}'.format(
+        *loss.best_linear(), rmse_ab.min()))
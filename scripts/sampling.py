@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''A module for the sampling demonstrations in the modeling and sampling notes.
+
+The notebook draws random subsamples of the anchovy weights one at a time:
+
+    sample_means = []
+    for n in range(n_subsamples):
+        subsampled_weights = subsample_weights(weight, N)
+        sample_means.append(np.mean(subsampled_weights))
+
+resample_statistics draws a whole block of subsamples with one call to a
+local random number generator (np.random.Generator), so that a million
+subsamples can be drawn quickly:
+
+    result = resample_statistics(weight, N, n_subsamples)
+    sample_means = result['mean']
+
+ci_coverage does the same for the confidence interval demonstration,
+counting how often the 95% confidence interval of a subsample contains the
+population mean, and plot_confidence_intervals draws the intervals.
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import stats
+
+# largest number of values drawn at once (sets the memory used by a block)
+MAX_BLOCK = 2**24
+
+
+def subsample_weights(weights, N, seed=None):
+    '''
+    Random subsample (with replacement) of an array
+
+    Same as the notebook function, but with a local random number generator
+    instead of resetting the global numpy seed.
+
+    Inputs:
+        weights - array to sample from
+        N - size of the subsample
+        seed - seed or np.random.Generator (None for a random seed)
+    Returns: array of N values
+    '''
+
+    rng = np.random.default_rng(seed)
+    return weights[rng.integers(0, np.size(weights), N)]
+
+
+def resample_blocks(x, N, n_subsamples, seed=None, max_block=MAX_BLOCK):
+    '''
+    Generate random subsamples (with replacement) in blocks
+
+    Inputs:
+        x - array to sample from
+        N - size of each subsample
+        n_subsamples - total number of subsamples
+        seed - seed or np.random.Generator (None for a random seed)
+        max_block - largest number of values in one block
+    Yields: (rows, N) arrays, one subsample per row
+    '''
+
+    rng = np.random.default_rng(seed)
+    x = np.asarray(x)
+    rows = max(1, max_block // max(N, 1))
+    for start in range(0, n_subsamples, rows):
+        nrows = min(rows, n_subsamples - start)
+        yield np.take(x, rng.integers(0, len(x), (nrows, N)))
+
+
+def resample_statistics(x, N, n_subsamples, seed=None, quantiles=None,
+                        ddof=0, max_block=MAX_BLOCK):
+    '''
+    Mean and standard deviation of many random subsamples of an array
+
+    Inputs:
+        x - array to sample from (e.g. the anchovy weights)
+        N - size of each subsample
+        n_subsamples - number of subsamples
+        seed - seed or np.random.Generator (None for a random seed)
+        quantiles - optional list of quantiles (0 to 1) of the sample means
+        ddof - delta degrees of freedom of the standard deviation
+        max_block - largest number of values drawn at once, which limits
+                    the memory used
+    Returns: dictionary with the 'mean' and 'std' of every subsample, and
+             the 'quantiles' of the means if requested
+    '''
+
+    means = np.zeros(n_subsamples)
+    stds = np.zeros(n_subsamples)
+    start = 0
+    for block in resample_blocks(x, N, n_subsamples, seed, max_block):
+        stop = start + len(block)
+        means[start:stop] = block.mean(axis=1)
+        stds[start:stop] = block.std(axis=1, ddof=ddof)
+        start = stop
+
+    result = {'mean': means, 'std': stds}
+    if quantiles is not None:
+        result['quantiles'] = np.quantile(means, quantiles)
+    return result
+
+
+def _ci_coverage_count(x, N, ntrial, confidence, seed, max_block, keep):
+    '''
+    Count how many of ntrial confidence intervals contain the mean of x.
+    Returns the count and the first keep lower and upper limits.
+    '''
+
+    xmean = np.mean(x)
+    # the t quantile is the same for every trial
+    tcrit = stats.t.ppf((1 + confidence) / 2, N - 1)
+    count = 0
+    lower_kept = []
+    upper_kept = []
+    nkept = 0
+    for block in resample_blocks(x, N, ntrial, seed, max_block):
+        m = block.mean(axis=1)
+        half_width = tcrit * block.std(axis=1, ddof=1) / np.sqrt(N)
+        lower = m - half_width
+        upper = m + half_width
+        count += int(np.count_nonzero((xmean >= lower) & (xmean < upper)))
+        if nkept < keep:
+            lower_kept.append(lower[:keep - nkept])
+            upper_kept.append(upper[:keep - nkept])
+            nkept += len(lower_kept[-1])
+    if nkept == 0:
+        return count, np.zeros(0), np.zeros(0)
+    return count, np.concatenate(lower_kept), np.concatenate(upper_kept)
+
+
+def ci_coverage(x, N, ntrial, confidence=0.95, seed=None, keep=200,
+                processes=1, max_block=MAX_BLOCK):
+    '''
+    Monte Carlo estimate of the coverage of t-based confidence intervals
+
+    Random subsamples of size N are drawn from x in blocks. For each one, the
+    confidence interval of the mean is computed, and the number of intervals
+    that contain the mean of x is counted as the blocks are generated, so
+    the number of trials is not limited by memory.
+
+    Inputs:
+        x - population to sample from (e.g. the anchovy weights)
+        N - size of each subsample
+        ntrial - number of subsamples (trials)
+        confidence - confidence level of the intervals
+        seed - seed for the random number generator (None for a random seed)
+        keep - number of intervals to return (e.g. for plotting)
+        processes - number of processes to split the trials across
+        max_block - largest number of values drawn at once
+    Returns: dictionary with the 'coverage' (fraction of intervals that
+             contain the mean), the 'count', the population 'mean', and the
+             'lower' and 'upper' limits of the first keep intervals
+    '''
+
+    x = np.asarray(x, dtype=np.float64)
+    if processes is None:
+        processes = os.cpu_count()
+
+    if processes == 1:
+        count, lower, upper = _ci_coverage_count(x, N, ntrial, confidence,
+                                                 seed, max_block, keep)
+    else:
+        # independent random streams for the processes
+        seeds = np.random.SeedSequence(seed).spawn(processes)
+        shares = np.diff(np.linspace(0, ntrial, processes + 1).astype(int))
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(_ci_coverage_count, x, N, int(share),
+                                   confidence, np.random.default_rng(sq),
+                                   max_block, keep)
+                       for share, sq in zip(shares, seeds)]
+            results = [f.result() for f in futures]
+        count = sum(r[0] for r in results)
+        lower = np.concatenate([r[1] for r in results])[:keep]
+        upper = np.concatenate([r[2] for r in results])[:keep]
+
+    return {'coverage': count / ntrial, 'count': count, 'ntrial': ntrial,
+            'confidence': confidence, 'mean': np.mean(x), 'lower': lower,
+            'upper': upper}
+
+
+def plot_confidence_intervals(result, N, ax=None):
+    '''
+    Plot confidence intervals from ci_coverage, one line per trial
+
+    Intervals containing the population mean are black and the others red.
+    All of the intervals are drawn as one LineCollection.
+
+    Inputs:
+        result - dictionary returned by ci_coverage
+        N - size of the subsamples (for the title)
+        ax - matplotlib axes (default: a new figure)
+    Returns: the matplotlib axes
+    '''
+
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+
+    if ax is None:
+        plt.figure(figsize=(5, 5))
+        ax = plt.gca()
+
+    lower = result['lower']
+    upper = result['upper']
+    xmean = result['mean']
+    trial = np.arange(len(lower))
+    segments = np.stack([np.column_stack([lower, trial]),
+                         np.column_stack([upper, trial])], axis=1)
+    covered = (xmean >= lower) & (xmean < upper)
+    colors = np.where(covered[:, None], [[0, 0, 0, 1]], [[1, 0, 0, 1]])
+    ax.add_collection(LineCollection(segments, colors=colors))
+
+    ax.set_ylim(-1, max(len(lower), 1))
+    ax.plot([xmean, xmean], ax.get_ylim(), 'b--')
+    ax.set_title('{:.0f}% confidence intervals'.format(100*result['confidence'])
+                 + '\nrandom subsets with N = ' + str(N) + ', coverage = {:.3f}'.format(result['coverage']))
+    ax.set_xlabel('weight [g]')
+    ax.set_ylabel('trial #')
+    ax.set_xlim([-10, 50])
+    return ax
+
+
+if __name__ == '__main__':
+    import time
+
+    # stand-in for the 10,623 anchovy weights, with a similar distribution
+    rng = np.random.default_rng(0)
+    weight = rng.gamma(4.0, 3.7, 10623)
+    N = 100
+    n_subsamples = 1_000_000
+
+    t0 = time.perf_counter()
+    sample_means = []
+    for n in range(10_000):
+        sample_means.append(np.mean(subsample_weights(weight, N)))
+    t1 = time.perf_counter()
+    result = resample_statistics(weight, N, n_subsamples, seed=0,
+                                 quantiles=[0.025, 0.5, 0.975])
+    t2 = time.perf_counter()
+
+    print('loop, per 10^6 subsamples: {:6.1f} s (estimated from 10^4)'.format(
+        100*(t1-t0)))
+    print('resample_statistics:       {:6.1f} s'.format(t2-t1))
+    print('std of means {:.4f}, sigma/sqrt(N) {:.4f}'.format(
+        np.std(result['mean']), np.std(weight)/np.sqrt(N)))
+    print('quantiles of means:', result['quantiles'])
+
+    t0 = time.perf_counter()
+    coverage = ci_coverage(weight, 10, 10_000_000, seed=0)
+    t1 = time.perf_counter()
+    print('coverage of 10^7 intervals with N = 10: {:.4f} ({:.1f} s)'.format(
+        coverage['coverage'], t1-t0))
@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+import pytest
+
+pyco2 = pytest.importorskip('PyCO2SYS')
+
+from carbonate import (co2sys_cached, co2sys_parallel, co2sys_inputs,
+                       run_co2sys, split_kwargs)
+
+
+@pytest.fixture(scope='module')
+def carb(df07):
+    '''Rows of the 2007 cruise with alkalinity and DIC.'''
+    return df07.dropna(subset=['ALKALI', 'TCARBN']).reset_index(drop=True)
+
+
+def reference(df, **kwargs):
+    return pyco2.sys(df['ALKALI'], df['TCARBN'], 1, 2, salinity=df['CTDSAL'],
+                     temperature=df['CTDTMP'], pressure=df['CTDPRS'],
+                     **kwargs)['saturation_aragonite']
+
+
+def test_cached_matches_pyco2sys(carb, tmp_path):
+    first = co2sys_cached(carb, cache_dir=str(tmp_path))
+    again = co2sys_cached(carb, cache_dir=str(tmp_path))
+    np.testing.assert_allclose(first['saturation_aragonite'], reference(carb))
+    np.testing.assert_array_equal(again['saturation_aragonite'],
+                                  first['saturation_aragonite'])
+
+
+def test_changed_rows_are_recomputed(carb, tmp_path):
+    co2sys_cached(carb, cache_dir=str(tmp_path))
+    changed = carb.copy()
+    changed.loc[10, 'ALKALI'] += 50
+    result = co2sys_cached(changed, cache_dir=str(tmp_path))
+    np.testing.assert_allclose(result['saturation_aragonite'], reference(changed))
+    assert result['saturation_aragonite'][10] != reference(carb)[10]
+
+
+def test_missing_inputs(df07, tmp_path):
+    result = co2sys_cached(df07.iloc[:200], cache_dir=str(tmp_path))
+    np.testing.assert_allclose(result['saturation_aragonite'],
+                               reference(df07.iloc[:200]), equal_nan=True)
+
+
+
+def test_empty_frame(carb, tmp_path):
+    result = co2sys_cached(carb.iloc[:0], outputs=['saturation_aragonite', 'pH'],
+                           cache_dir=str(tmp_path))
+    assert set(result) == {'saturation_aragonite', 'pH'}
+    assert all(len(v) == 0 and v.dtype == np.float64 for v in result.values())
+
+def test_options_are_cached_separately(carb, tmp_path):
+    co2sys_cached(carb, cache_dir=str(tmp_path))
+    result = co2sys_cached(carb, cache_dir=str(tmp_path), opt_k_carbonic=4)
+    np.testing.assert_allclose(result['saturation_aragonite'],
+                               reference(carb, opt_k_carbonic=4))
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_per_row_options(carb, tmp_path):
+    silicate = carb['SILCAT'].fillna(0).to_numpy()
+    result = co2sys_cached(carb, cache_dir=str(tmp_path), total_silicate=silicate)
+    np.testing.assert_allclose(result['saturation_aragonite'],
+                               reference(carb, total_silicate=silicate))
+
+    # changing one value of an array option recomputes that row
+    silicate = silicate.copy()
+    silicate[5] += 100
+    result = co2sys_cached(carb, cache_dir=str(tmp_path), total_silicate=silicate)
+    np.testing.assert_allclose(result['saturation_aragonite'],
+                               reference(carb, total_silicate=silicate))
+
+    # ... and so does changing an input while an array option is passed
+    changed = carb.copy()
+    changed.loc[7, 'TCARBN'] -= 30
+    result = co2sys_cached(changed, cache_dir=str(tmp_path), total_silicate=silicate)
+    np.testing.assert_allclose(result['saturation_aragonite'],
+                               reference(changed, total_silicate=silicate))
+
+
+def test_option_with_wrong_length(carb, tmp_path):
+    with pytest.raises(ValueError):
+        co2sys_cached(carb, cache_dir=str(tmp_path), total_silicate=np.ones(3))
+    with pytest.raises(ValueError):
+        split_kwargs({'total_silicate': np.ones((len(carb), 2))}, len(carb))
+
+
+def test_parallel_matches_single_process(carb):
+    inputs = co2sys_inputs(carb)
+    silicate = carb['SILCAT'].fillna(0).to_numpy()
+    single = run_co2sys(inputs, outputs=['saturation_aragonite', 'pH'],
+                        total_silicate=silicate)
+    parallel = co2sys_parallel(inputs, outputs=['saturation_aragonite', 'pH'],
+                               processes=2, chunksize=150, total_silicate=silicate)
+    for name in ('saturation_aragonite', 'pH'):
+        np.testing.assert_allclose(parallel[name], single[name])
+    np.testing.assert_allclose(parallel['saturation_aragonite'],
+                               reference(carb, total_silicate=silicate))
@@ -0,0 +1,127 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from catalog import CruiseCatalog, EARTH_RADIUS_KM
+from exchange import read_exchange
+
+
+@pytest.fixture
+def catalog(file07, file13, tmp_path):
+    catalog = CruiseCatalog(str(tmp_path / 'catalog'), str(tmp_path / 'cache'))
+    catalog.add(file07)
+    catalog.add(file13)
+    return catalog
+
+
+@pytest.fixture(scope='module')
+def cruises(file07, file13):
+    return {file07: read_exchange(file07), file13: read_exchange(file13)}
+
+
+def reference(cruises, select, columns):
+    frames = []
+    for file_name, df in cruises.items():
+        rows = df[select(df)][columns].copy()
+        rows['file_name'] = file_name
+        frames.append(rows)
+    return pd.concat(frames, ignore_index=True)
+
+
+def haversine(lat0, lon0, lat, lon):
+    lat0, lon0, lat, lon = (np.radians(v) for v in (lat0, lon0, lat, lon))
+    a = (np.sin((lat - lat0) / 2)**2 +
+         np.cos(lat0) * np.cos(lat) * np.sin((lon - lon0) / 2)**2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def test_box_and_pressure_query(catalog, cruises):
+    columns = ['LATITUDE', 'LONGITUDE', 'CTDPRS', 'CTDTMP']
+    result = catalog.query(columns, lat_range=(36, 42), lon_range=(-125, -122),
+                           pressure_range=(0, 100))
+    ref = reference(cruises, lambda df: (df['LATITUDE'].between(36, 42) &
+                                         df['LONGITUDE'].between(-125, -122) &
+                                         df['CTDPRS'].between(0, 100)), columns)
+    assert len(ref) > 0
+    pd.testing.assert_frame_equal(result, ref)
+
+
+def test_radius_and_time_query(catalog, cruises):
+    columns = ['LATITUDE', 'LONGITUDE', 'DATE_TIME']
+    result = catalog.query(columns, lat=40, lon=-125, radius_km=150,
+                           time_range=('2007-01-01', '2007-12-31'))
+    ref = reference(cruises, lambda df: (
+        (haversine(40, -125, df['LATITUDE'], df['LONGITUDE']) <= 150) &
+        (df['DATE_TIME'] <= '2007-12-31') & (df['DATE_TIME'] >= '2007-01-01')), columns)
+    assert len(ref) > 0
+    pd.testing.assert_frame_equal(result, ref)
+
+
+def test_catalog_is_saved(catalog, file07):
+    copy = CruiseCatalog(catalog.catalog_dir, catalog.cache_dir)
+    assert len(copy) == len(catalog)
+    assert copy.add(file07) == 0
+    np.testing.assert_array_equal(copy.find(lat_range=(30, 35)),
+                                  catalog.find(lat_range=(30, 35)))
+
+
+def test_no_match(catalog):
+    result = catalog.query(['CTDTMP'], lat_range=(-10, -5))
+    assert len(result) == 0
+    assert list(result.columns) == ['CTDTMP', 'file_name']
+
+
+def _drop_lines(file_name, copy, start, stop):
+    with open(file_name) as f:
+        lines = f.readlines()
+    with open(copy, 'w') as f:
+        f.writelines(lines[:start] + lines[stop:])
+    # a new modification time, so the file is hashed again
+    stat = os.stat(copy)
+    os.utime(copy, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_changed_file_after_eviction(file07, tmp_path):
+    copy = str(tmp_path / 'cruise.csv')
+    shutil.copy(file07, copy)
+    catalog = CruiseCatalog(str(tmp_path / 'catalog'), str(tmp_path / 'cache'))
+    catalog.add(copy)
+
+    # the columnar copy is evicted and the file changes
+    shutil.rmtree(catalog.cache_dir)
+    _drop_lines(file07, copy, 1000, 1500)
+
+    columns = ['LATITUDE', 'CTDPRS']
+    result = catalog.query(columns, lat_range=(40, 42))
+    ref = reference({copy: read_exchange(copy)},
+                    lambda df: df['LATITUDE'].between(40, 42), columns)
+    assert len(ref) > 0
+    pd.testing.assert_frame_equal(result, ref)
+    assert len(catalog) == len(read_exchange(copy))
+
+    # the catalog on disk has the new rows too
+    saved = CruiseCatalog(catalog.catalog_dir, catalog.cache_dir)
+    pd.testing.assert_frame_equal(saved.query(columns, lat_range=(40, 42)), ref)
+
+
+def test_changed_file_replaces_cruise(file07, file13, tmp_path):
+    copy = str(tmp_path / 'cruise.csv')
+    shutil.copy(file07, copy)
+    catalog = CruiseCatalog(str(tmp_path / 'catalog'), str(tmp_path / 'cache'))
+    catalog.add(copy)
+    catalog.add(file13)
+
+    _drop_lines(file07, copy, 1000, 1500)
+    assert catalog.add(copy) == 0
+    assert len(catalog.cruises) == 2
+
+    cruises = {copy: read_exchange(copy), file13: read_exchange(file13)}
+    assert len(catalog) == sum(len(df) for df in cruises.values())
+    columns = ['LATITUDE', 'LONGITUDE', 'CTDPRS']
+    result = catalog.query(columns, lat_range=(36, 42), pressure_range=(0, 100))
+    ref = reference(cruises, lambda df: (df['LATITUDE'].between(36, 42) &
+                                         df['CTDPRS'].between(0, 100)), columns)
+    pd.testing.assert_frame_equal(result, ref)
@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import climate_index
+from climate_index import parse_psl, read_psl, read_psl_file, load_psl_directory
+
+
+def notebook_read_psl_file(psl_file):
+    # read_psl_file of the Poisson regression notes
+    f = open(psl_file, "r")
+    all_lines = f.readlines()
+    f.close()
+    start_year = all_lines[0].split()[0]
+    end_year = all_lines[0].split()[1]
+
+    for i in range(1, len(all_lines)):
+        stri = all_lines[i].find(end_year)
+        if stri >= 0:
+            end_index = i
+
+    missing_val = float(all_lines[end_index+1])
+    nrows = int(end_year)-int(start_year)+1
+    df = pd.read_csv(psl_file, skiprows=1, nrows=nrows, sep=r'\s+', header=None,
+                     na_values=missing_val)
+    df = df.rename(columns={0: 'year'})
+    df = df.set_index('year', drop=True)
+    return df
+
+
+@pytest.fixture(autouse=True)
+def no_parsed_files(monkeypatch):
+    monkeypatch.setattr(climate_index, '_parsed', {})
+
+
+@pytest.mark.parametrize('name', ['soi', 'tna', 'nao'])
+def test_read_psl_file_matches_notebook(storms_dir, name):
+    psl_file = os.path.join(storms_dir, name + '.data')
+    ref = notebook_read_psl_file(psl_file)
+    df = read_psl_file(psl_file)
+    np.testing.assert_array_equal(df.index, ref.index)
+    np.testing.assert_array_equal(df.columns, ref.columns)
+    np.testing.assert_array_equal(df.to_numpy(), ref.to_numpy(dtype=np.float64))
+    # the frame is a copy, not the cached array
+    df.iloc[0, 0] = 1e6
+    assert read_psl_file(psl_file).iloc[0, 0] != 1e6
+
+
+def test_parse_psl_missing_values():
+    text = '2000 2001\n' \
+           '2000 1 2 3 4 5 6 7 8 9 10 11 12\n' \
+           '2001 1 2 -99.9 4 5 6 7 8 9 10 -99.9 -99.9\n' \
+           '  -99.9\n' \
+           ' test index\n' \
+           ' from somewhere\n'
+    result = parse_psl(text)
+    np.testing.assert_array_equal(result['years'], [2000, 2001])
+    assert result['missing'].sum() == 3
+    assert np.isnan(result['values'][1, [2, 10, 11]]).all()
+    assert result['missing_value'] == -99.9
+    assert result['description'] == 'test index\nfrom somewhere'
+
+
+def test_disk_cache(storms_dir, tmp_path, monkeypatch):
+    psl_file = os.path.join(storms_dir, 'soi.data')
+    cache_dir = str(tmp_path / 'psl')
+    first = read_psl(psl_file, cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+
+    # a new session loads the parsed file from disk
+    monkeypatch.setattr(climate_index, '_parsed', {})
+    monkeypatch.setattr(climate_index, 'parse_psl', None)
+    again = read_psl(psl_file, cache_dir)
+    for key in ('years', 'values', 'missing'):
+        np.testing.assert_array_equal(again[key], first[key])
+    assert again['missing_value'] == first['missing_value']
+    assert again['description'] == first['description']
+
+
+def test_changed_file_is_parsed_again(storms_dir, tmp_path):
+    copy = tmp_path / 'soi.data'
+    text = open(os.path.join(storms_dir, 'soi.data')).read()
+    copy.write_text(text)
+    before = read_psl(str(copy), None)['values'].copy()
+    lines = text.splitlines()
+    values = lines[1].split()
+    lines[1] = ' '.join([values[0], '1.5'] + values[2:])
+    copy.write_text('\n'.join(lines) + '\n')
+    after = read_psl(str(copy), None)['values']
+    assert after[0, 0] == 1.5
+    np.testing.assert_array_equal(after[1:], before[1:])
+
+
+def test_load_psl_directory(storms_dir, tmp_path):
+    ds = load_psl_directory(storms_dir, cache_dir=str(tmp_path))
+    assert sorted(ds.data_vars) == ['nao', 'soi', 'tna']
+    for name in ds.data_vars:
+        ref = notebook_read_psl_file(os.path.join(storms_dir, name + '.data'))
+        values = ds[name].sel(year=ref.index).to_numpy()
+        np.testing.assert_array_equal(values, ref.to_numpy(dtype=np.float64))
+        # years outside the file are missing
+        other = ds[name].sel(year=~ds['year'].isin(ref.index))
+        assert np.isnan(other).all()
+    # May-June averages as in the notes
+    ref = notebook_read_psl_file(os.path.join(storms_dir, 'soi.data'))
+    np.testing.assert_allclose(
+        ds['soi'].sel(month=[5, 6]).mean('month').sel(year=ref.index),
+        ref.loc[:, 5:6].mean(axis=1))
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from derived import DerivedFrame, register, DERIVED
+
+
+def test_builtin_variables(df07):
+    dfd = DerivedFrame(df07.copy())
+    np.testing.assert_allclose(dfd['CTDTMP_F'], 9/5*df07['CTDTMP'] + 32)
+    np.testing.assert_array_equal(dfd['is_northern'], df07['LATITUDE'] > 40.4)
+    region = dfd['region']
+    assert (region[df07['LATITUDE'] > 46.2] == 'north').all()
+    assert (region[df07['LATITUDE'] < 37.8] == 'south').all()
+    assert 'OmegaA' in dfd and 'OmegaA' in dfd.columns
+    assert dfd.inputs('OmegaA') == {'ALKALI', 'TCARBN', 'CTDSAL', 'CTDTMP', 'CTDPRS'}
+
+
+def test_values_are_cached_until_inputs_change():
+    calls = []
+    registry = {}
+
+    @register('double', ['x'], registry)
+    def double(x):
+        calls.append('double')
+        return 2 * x
+
+    @register('quadruple', ['double'], registry)
+    def quadruple(double):
+        calls.append('quadruple')
+        return 2 * double
+
+    @register('y_plus_1', ['y'], registry)
+    def y_plus_1(y):
+        calls.append('y_plus_1')
+        return y + 1
+
+    dfd = DerivedFrame(pd.DataFrame({'x': [1.0, 2.0], 'y': [0.0, 1.0]}), registry)
+    assert dfd['quadruple'].tolist() == [4.0, 8.0]
+    dfd['quadruple']
+    dfd['y_plus_1']
+    assert calls == ['double', 'quadruple', 'y_plus_1']
+
+    dfd['x'] = [3.0, 4.0]
+    assert not dfd.is_cached('quadruple') and dfd.is_cached('y_plus_1')
+    assert dfd['quadruple'].tolist() == [12.0, 16.0]
+    dfd['y_plus_1']
+    assert calls == ['double', 'quadruple', 'y_plus_1', 'double', 'quadruple']
+
+    dfd.df.loc[0, 'y'] = 10.0
+    dfd.invalidate('y')
+    assert dfd['y_plus_1'].tolist() == [11.0, 2.0]
+    assert dfd.to_frame(['double']).columns.tolist() == ['x', 'y', 'double']
+
+
+def test_circular_dependency():
+    registry = {}
+    register('a', ['b'], registry)(lambda b: b)
+    register('b', ['a'], registry)(lambda a: a)
+    dfd = DerivedFrame(pd.DataFrame({'x': [1.0]}), registry)
+    with pytest.raises(ValueError):
+        dfd['a']
+    with pytest.raises(KeyError):
+        dfd['c']
+    assert 'CTDTMP_F' in DERIVED
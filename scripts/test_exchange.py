@@ -0,0 +1,180 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import exchange
+from exchange import (read_exchange, iter_exchange, read_exchange_cached,
+                      exchange_cache_entry, load_cached_frame, evict_cache,
+                      file_hash, parse_exchange_datetime, compact_dtypes,
+                      memory_report, find_exchange_header, save_cached_frame)
+
+
+def test_find_header(file07, file13):
+    info07 = find_exchange_header(file07)
+    info13 = find_exchange_header(file13)
+    assert info07['names'][:2] == ['EXPOCODE', 'SECT_ID']
+    # the 2013 file has the units before the column names
+    assert 'CTDPRS' in info13['names']
+    assert read_exchange(file07).equals(read_exchange(file07, header=29))
+    assert read_exchange(file13).equals(read_exchange(file13, header=31))
+
+
+def test_cached_read_matches_read_exchange(file07, tmp_path):
+    ref = read_exchange(file07)
+    first = read_exchange_cached(file07, cache_dir=str(tmp_path))
+    again = read_exchange_cached(file07, cache_dir=str(tmp_path))
+    mapped = read_exchange_cached(file07, cache_dir=str(tmp_path), mmap_mode='r')
+    pd.testing.assert_frame_equal(first, ref)
+    pd.testing.assert_frame_equal(again, ref)
+    pd.testing.assert_frame_equal(mapped.copy(), ref)
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_cached_compact_read(file07, tmp_path):
+    ref = read_exchange(file07, compact=True)
+    read_exchange_cached(file07, compact=True, cache_dir=str(tmp_path))
+    df = read_exchange_cached(file07, compact=True, cache_dir=str(tmp_path))
+    pd.testing.assert_frame_equal(df, ref)
+
+
+def test_cached_frame_is_writable(file07, tmp_path):
+    read_exchange_cached(file07, cache_dir=str(tmp_path))
+    df = read_exchange_cached(file07, cache_dir=str(tmp_path))
+    df.loc[0, 'CTDTMP'] = 99.0
+    assert df.loc[0, 'CTDTMP'] == 99.0
+    # copy-on-write maps can be modified too, without changing the cache
+    df = read_exchange_cached(file07, cache_dir=str(tmp_path), mmap_mode='c')
+    df.loc[0, 'CTDTMP'] = 98.0
+    assert read_exchange_cached(file07, cache_dir=str(tmp_path)).loc[0, 'CTDTMP'] != 98.0
+
+
+def test_load_columns_and_rows(file07, tmp_path):
+    ref = read_exchange(file07)
+    entry = exchange_cache_entry(file07, cache_dir=str(tmp_path))
+    rows = np.array([5, 1, 700])
+    df = load_cached_frame(entry, mmap_mode='r', columns=['CTDTMP', 'EXPOCODE'],
+                           rows=rows)
+    pd.testing.assert_frame_equal(
+        df, ref[['CTDTMP', 'EXPOCODE']].iloc[rows].reset_index(drop=True))
+
+
+def test_changed_file_is_parsed_again(file07, tmp_path):
+    copy = str(tmp_path / 'cruise.csv')
+    shutil.copy(file07, copy)
+    cache_dir = str(tmp_path / 'cache')
+    before = read_exchange_cached(copy, cache_dir=cache_dir)
+
+    with open(copy) as f:
+        text = f.read()
+    # same size, different contents
+    with open(copy, 'w') as f:
+        f.write(text.replace('32WC20070511', '32WC20070599'))
+    os.utime(copy, ns=(0, os.stat(file07).st_mtime_ns + 10**9))
+
+    after = read_exchange_cached(copy, cache_dir=cache_dir)
+    assert (before['EXPOCODE'] == '32WC20070511').all()
+    assert (after['EXPOCODE'] == '32WC20070599').all()
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_file_hash_reused_until_file_changes(tmp_path, monkeypatch):
+    path = tmp_path / 'a.txt'
+    path.write_text('abc')
+    digest = file_hash(str(path))
+
+    # an unchanged file is not read again
+    def fail(*args, **kwargs):
+        raise AssertionError('file was hashed again')
+    monkeypatch.setattr(exchange.hashlib, 'sha1', fail)
+    assert file_hash(str(path)) == digest
+    monkeypatch.undo()
+
+    path.write_text('abd')
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert file_hash(str(path)) != digest
+
+
+def test_evict_cache(file07, file13, tmp_path):
+    cache_dir = str(tmp_path)
+    entry07 = exchange_cache_entry(file07, cache_dir=cache_dir)
+    entry13 = exchange_cache_entry(file13, cache_dir=cache_dir)
+    os.utime(os.path.join(entry07, 'schema.json'), (0, 0))
+    removed = evict_cache(cache_dir, max_cache_mb=0,
+                          keep=[os.path.basename(entry13)])
+    assert removed == [os.path.basename(entry07)]
+    assert os.listdir(cache_dir) == [os.path.basename(entry13)]
+
+
+@pytest.mark.parametrize('chunksize', [100, 1000, 100000])
+def test_iter_exchange_matches_read_exchange(file07, file13, chunksize):
+    for file_name in (file07, file13):
+        ref = read_exchange(file_name)
+        chunks = list(iter_exchange(file_name, chunksize=chunksize))
+        assert all(len(c) <= chunksize for c in chunks)
+        df = pd.concat(chunks, ignore_index=True)
+        pd.testing.assert_frame_equal(df, ref, check_dtype=False)
+        assert all(c.dtypes.equals(chunks[0].dtypes) for c in chunks)
+
+
+def test_parse_exchange_datetime():
+    dates = pd.Series(['5/14/2007', '5/14/2007', '12/31/2013', None, '1/2/2010'])
+    times = pd.Series(['8:14:04', '23:59:59', '0:00:00', '1:00:00', None])
+    result = parse_exchange_datetime(dates, times)
+    ref = pd.to_datetime(dates + ' ' + times, format='%m/%d/%Y %H:%M:%S')
+    np.testing.assert_array_equal(result, ref.to_numpy().astype('datetime64[ns]'))
+
+
+def test_parse_exchange_datetime_formats():
+    result = parse_exchange_datetime(['2013-08-05', '20130805', '8/5/13'],
+                                     ['0212', '2:12', '02:12:00'])
+    assert (result == np.datetime64('2013-08-05T02:12:00')).all()
+
+
+def test_parse_exchange_datetime_matches_file(file07):
+    info = find_exchange_header(file07)
+    raw = pd.read_csv(file07, skiprows=info['skiprows'], header=None,
+                      names=info['names'], usecols=['DATE', 'TIME'])[:-1]
+    ref = pd.to_datetime(raw['DATE'] + ' ' + raw['TIME'], format='%m/%d/%Y %H:%M:%S')
+    np.testing.assert_array_equal(parse_exchange_datetime(raw['DATE'], raw['TIME']),
+                                  ref.to_numpy().astype('datetime64[ns]'))
+
+
+def test_compact_dtypes(df07):
+    compact = compact_dtypes(df07)
+    assert compact['CTDSAL_FLAG_W'].dtype == np.int8
+    assert isinstance(compact['EXPOCODE'].dtype, pd.CategoricalDtype)
+    for name in df07.columns:
+        pd.testing.assert_series_equal(compact[name].astype(df07[name].dtype),
+                                       df07[name])
+
+    small = compact_dtypes(df07, float32=True)
+    assert small['CTDTMP'].dtype == np.float32
+    np.testing.assert_allclose(small['CTDTMP'], df07['CTDTMP'], rtol=1e-6)
+
+    report = memory_report(df07, small)
+    assert report.loc['TOTAL', 'MB_after'] < report.loc['TOTAL', 'MB_before']
+
+
+def test_compact_dtypes_missing_integers():
+    df = pd.DataFrame({'STNNBR': [1.0, np.nan, 300.0]})
+    compact = compact_dtypes(df)
+    assert str(compact['STNNBR'].dtype) == 'Int16'
+    assert compact['STNNBR'].isna().tolist() == [False, True, False]
+
+
+def test_compact_dtypes_missing_flags(df07, tmp_path):
+    df = df07.copy()
+    df.loc[3, 'NITRAT_FLAG_W'] = np.nan
+    compact = compact_dtypes(df)
+    assert str(compact['NITRAT_FLAG_W'].dtype) == 'Int8'
+    pd.testing.assert_series_equal(compact['NITRAT_FLAG_W'].astype(np.float64),
+                                   df['NITRAT_FLAG_W'])
+
+    # the cached compact frame keeps the nullable flags
+    entry = str(tmp_path / 'entry')
+    save_cached_frame(compact, entry)
+    pd.testing.assert_frame_equal(load_cached_frame(entry), compact)
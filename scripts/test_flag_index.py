@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from flag_index import FlagIndex, popcount, words_to_rows, _pack
+
+
+@pytest.fixture(scope='module')
+def flags():
+    rng = np.random.default_rng(0)
+    n = 10_007
+    return pd.DataFrame({v + '_FLAG_W': rng.choice([2, 3, 4, 9], n,
+                                                   p=[0.9, 0.04, 0.01, 0.05])
+                         for v in ['CTDSAL', 'NITRAT', 'PHSPHT', 'TCARBN']})
+
+
+def test_rows_match_boolean_selection(df07):
+    index = FlagIndex(df07)
+    ref = ((df07['NITRAT_FLAG_W'] == 2) & (df07['PHSPHT_FLAG_W'] == 2) &
+           (df07['CTDOXY_FLAG_W'] == 2)).to_numpy()
+    variables = ['NITRAT', 'PHSPHT', 'CTDOXY']
+    np.testing.assert_array_equal(index.rows(variables), np.flatnonzero(ref))
+    np.testing.assert_array_equal(index.mask(variables), ref)
+    assert index.count(variables) == ref.sum()
+
+
+def test_several_flag_values(flags):
+    index = FlagIndex(flags)
+    ref = (flags['CTDSAL_FLAG_W'].isin([2, 3]) & (flags['NITRAT_FLAG_W'] == 2) &
+           flags['TCARBN_FLAG_W'].isin([3, 4])).to_numpy()
+    query = {'CTDSAL': [2, 3], 'NITRAT_FLAG_W': 2, 'TCARBN': (3, 4)}
+    np.testing.assert_array_equal(index.mask(query), ref)
+    np.testing.assert_array_equal(index.rows(query), np.flatnonzero(ref))
+    assert index.count(query) == ref.sum()
+
+
+def test_missing_flag_value_and_variable(flags):
+    index = FlagIndex(flags)
+    assert index.count(['CTDSAL'], flags=6) == 0
+    with pytest.raises(KeyError):
+        index.rows(['OXYGEN'])
+    assert index.count([]) == len(flags)
+
+
+@pytest.mark.parametrize('fraction', [0.0, 0.001, 0.1, 0.9, 1.0])
+def test_words_to_rows(fraction):
+    rng = np.random.default_rng(1)
+    mask = rng.random(1000) < fraction
+    words = _pack(mask)
+    np.testing.assert_array_equal(words_to_rows(words, len(mask)), np.flatnonzero(mask))
+    assert popcount(words) == mask.sum()
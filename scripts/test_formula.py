@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import patsy
+import pytest
+import statsmodels.api as sm
+import statsmodels.formula.api as smf
+
+from formula import compile_formula
+
+
+@pytest.fixture(scope='module')
+def stations(df07):
+    counts = df07.dropna(subset=['NITRAT', 'PHSPHT']).groupby('STNNBR').size()
+    return counts.index[counts > 2][:15]
+
+
+def test_design_fits_match_smf(df07):
+    design = compile_formula('NITRAT ~ PHSPHT + CTDTMP', df07).bind(df07)
+    ref = smf.ols('NITRAT ~ PHSPHT + CTDTMP', df07).fit()
+    np.testing.assert_allclose(design.ols().params, ref.params)
+    np.testing.assert_allclose(design.lstsq().coef, ref.params)
+    np.testing.assert_allclose(design.glm().params,
+                               smf.glm('NITRAT ~ PHSPHT + CTDTMP', df07).fit().params)
+
+
+def test_bind_reuses_the_compiled_matrices(df07, monkeypatch):
+    compiled = compile_formula('NITRAT ~ PHSPHT', df07)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('design matrices were built again')
+    monkeypatch.setattr(patsy, 'build_design_matrices', fail)
+    design = compiled.bind(df07)
+    monkeypatch.undo()
+
+    again = compiled.bind(df07)
+    np.testing.assert_array_equal(design.X, again.X)
+    np.testing.assert_array_equal(design.y, again.y)
+    np.testing.assert_array_equal(design.positions, again.positions)
+
+
+def test_design_subsets_match_smf(df07, stations):
+    design = compile_formula('NITRAT ~ PHSPHT', df07).bind(df07)
+    for s in stations:
+        ref = smf.ols('NITRAT ~ PHSPHT', df07[df07['STNNBR'] == s]).fit()
+        sub = design.subset(df07['STNNBR'] == s)
+        np.testing.assert_allclose(sub.lstsq().coef, ref.params)
+        np.testing.assert_allclose(sub.ols().params, ref.params)
+        np.testing.assert_allclose(design.subset((df07['STNNBR'] == s).to_numpy()).ols().bse,
+                                   ref.bse)
+
+
+def test_bootstrap_samples(df07):
+    design = compile_formula('NITRAT ~ PHSPHT', df07).bind(df07)
+    samples = list(design.bootstrap(5, seed=0))
+    again = list(design.bootstrap(5, seed=0))
+    y, X = design.frames()
+    for sample, same in zip(samples, again):
+        np.testing.assert_array_equal(sample.positions, same.positions)
+        rows = df07.iloc[sample.positions]
+        ref = smf.ols('NITRAT ~ PHSPHT', rows.reset_index(drop=True)).fit()
+        np.testing.assert_allclose(sample.lstsq().coef, ref.params)
+    assert list(X.columns) == ['Intercept', 'PHSPHT']
+
+
+def test_glm_design(df07):
+    data = df07.dropna(subset=['NITRAT', 'PHSPHT']).copy()
+    data['count'] = np.round(data['NITRAT']).clip(0)
+    design = compile_formula('count ~ PHSPHT', data).bind(data)
+    fit = design.glm(sm.families.Poisson())
+    ref = smf.glm('count ~ PHSPHT', data, family=sm.families.Poisson()).fit()
+    np.testing.assert_allclose(fit.params, ref.params)
+
+
+def test_levels_and_stateful_transforms_follow_the_data():
+    rng = np.random.default_rng(0)
+    a = pd.DataFrame({'x': rng.normal(size=60),
+                      'region': rng.choice(['north', 'central', 'south'], 60)})
+    a['y'] = 2 * a['x'] + 1 + rng.normal(size=60)
+    b = a[a['region'] != 'south'].copy()
+    b['x'] += 3
+
+    for formula in ('y ~ region', 'y ~ center(x)', 'y ~ center(x) + region'):
+        compile_formula(formula, a).bind(a)
+        fit = compile_formula(formula, b).bind(b).ols()
+        ref = smf.ols(formula, b).fit()
+        assert list(fit.params.index) == list(ref.params.index)
+        np.testing.assert_allclose(fit.params, ref.params)
@@ -0,0 +1,113 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import statsmodels.api as sm
+import statsmodels.formula.api as smf
+
+from climate_index import read_psl_file, load_psl_directory
+from glm import irls, fit_models, all_subsets, subset_search, window_predictors
+
+
+@pytest.fixture(scope='module')
+def dftrop(storms_dir):
+    # the data of the Poisson regression notes
+    dfsoi = read_psl_file(os.path.join(storms_dir, 'soi.data'))
+    dftna = read_psl_file(os.path.join(storms_dir, 'tna.data'))
+    dfnao = read_psl_file(os.path.join(storms_dir, 'nao.data'))
+    dftrop = pd.read_csv(os.path.join(storms_dir, 'tropical.txt'), sep='\t')
+    dftrop = dftrop.set_index('Year', drop=False)
+    dftrop['SOI'] = dfsoi.loc[:, 5:6].mean(axis=1)
+    dftrop['TNA'] = dftna.loc[:, 5:6].mean(axis=1)
+    dftrop['NAO'] = dfnao.loc[:, 5:6].mean(axis=1)
+    return dftrop
+
+
+@pytest.fixture(scope='module')
+def ds(storms_dir, tmp_path_factory):
+    return load_psl_directory(storms_dir, cache_dir=str(tmp_path_factory.mktemp('psl')))
+
+
+PREDICTORS = ['Year', 'NAO', 'SOI', 'TNA']
+
+
+@pytest.mark.parametrize('family,alpha', [('poisson', 1.0),
+                                          ('negativebinomial', 1.0),
+                                          ('negativebinomial', 0.05)])
+def test_irls_matches_statsmodels(dftrop, family, alpha):
+    df = dftrop.dropna()
+    y = df['NamedStorms'].to_numpy(dtype=np.float64)
+    X = sm.add_constant(df[PREDICTORS].to_numpy(dtype=np.float64))
+    if family == 'poisson':
+        sm_family = sm.families.Poisson()
+    else:
+        sm_family = sm.families.NegativeBinomial(alpha=alpha)
+    ref = sm.GLM(y, X, family=sm_family).fit(tol=1e-14, maxiter=500)
+    result = irls(y, X, family=family, alpha=alpha, tol=1e-14)
+    np.testing.assert_allclose(result['params'][0], ref.params, rtol=1e-6)
+    # with the default tolerances both stop within the tolerance of the deviance
+    loose = irls(y, X, family=family, alpha=alpha)
+    np.testing.assert_allclose(loose['params'][0], ref.params, rtol=1e-4)
+    np.testing.assert_allclose(loose['deviance'][0], ref.deviance, rtol=1e-8)
+    np.testing.assert_allclose(result['bse'][0], ref.bse, rtol=1e-5)
+    np.testing.assert_allclose(result['deviance'][0], ref.deviance, rtol=1e-8)
+    np.testing.assert_allclose(result['llf'][0], ref.llf, rtol=1e-8)
+    np.testing.assert_allclose(result['aic'][0], ref.aic, rtol=1e-8)
+    assert result['converged'][0]
+
+
+def test_masks_and_stacked_designs(dftrop):
+    df = dftrop.dropna()
+    y = df['NamedStorms'].to_numpy(dtype=np.float64)
+    X = sm.add_constant(df[PREDICTORS].to_numpy(dtype=np.float64))
+    masks = np.column_stack([np.ones(16, dtype=bool), all_subsets(PREDICTORS)])
+    result = fit_models(y, X, masks, chunksize=5)
+    stacked = fit_models(y, np.repeat(X[None], len(masks), axis=0), masks)
+    parallel = fit_models(y, X, masks, chunksize=5, processes=2)
+    for m, mask in enumerate(masks):
+        ref = sm.GLM(y, X[:, mask], family=sm.families.Poisson()).fit()
+        np.testing.assert_allclose(result['params'][m, mask], ref.params, rtol=1e-6)
+        assert np.isnan(result['params'][m, ~mask]).all()
+        np.testing.assert_allclose(result['aic'][m], ref.aic, rtol=1e-8)
+    for key in ('params', 'bse', 'aic'):
+        np.testing.assert_allclose(stacked[key], result[key], rtol=1e-10)
+        np.testing.assert_array_equal(parallel[key], result[key])
+
+
+def test_all_subsets():
+    subsets = all_subsets(['a', 'b', 'c'])
+    assert subsets.shape == (8, 3)
+    assert len({tuple(s) for s in subsets}) == 8
+    assert subsets.sum(axis=1).tolist() == [0, 1, 1, 1, 2, 2, 2, 3]
+    assert all_subsets(['a', 'b', 'c'], min_size=2, max_size=2).shape == (3, 3)
+    assert all_subsets([]).shape == (1, 0)
+
+
+def test_subset_search_matches_smf(dftrop):
+    df = dftrop.dropna()
+    table = subset_search(df, 'NamedStorms', PREDICTORS)
+    assert len(table) == 16
+    assert table['aic'].is_monotonic_increasing
+    for row in table.itertuples():
+        terms = row.predictors if row.predictors != '1' else '1'
+        ref = smf.glm('NamedStorms ~ ' + terms, df, family=sm.families.Poisson()).fit()
+        np.testing.assert_allclose(row.aic, ref.aic, rtol=1e-8)
+        params = table.loc[row.Index, ref.params.index].to_numpy(dtype=np.float64)
+        np.testing.assert_allclose(params, ref.params, rtol=1e-6)
+
+
+def test_window_predictors(ds, dftrop):
+    may_june = window_predictors(ds, ['soi', 'tna', 'nao'], (5, 6))
+    years = dftrop.dropna().index
+    np.testing.assert_allclose(may_june.loc[years, 'soi'], dftrop.loc[years, 'SOI'])
+    np.testing.assert_allclose(may_june.loc[years, 'tna'], dftrop.loc[years, 'TNA'])
+
+    # November to February, across the end of the year
+    winter = window_predictors(ds, ['soi'], (11, 2))
+    soi = ds['soi'].to_pandas()
+    year = 2000
+    ref = np.mean([soi.loc[year, 11], soi.loc[year, 12],
+                   soi.loc[year + 1, 1], soi.loc[year + 1, 2]])
+    np.testing.assert_allclose(winter.loc[year, 'soi'], ref)
+    assert np.isnan(winter['soi'].iloc[-1])
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import statsmodels.api as sm
+import statsmodels.formula.api as smf
+
+from grouped_ols import GroupedOLS, ols_by_group
+
+
+def test_matches_statsmodels_per_station(df07):
+    table = ols_by_group(df07, 'NITRAT', 'PHSPHT', by='STNNBR')
+    fitted = table.dropna(subset=['PHSPHT'])
+    assert len(fitted) > 10
+    for station in fitted.index[:20]:
+        fit = smf.ols('NITRAT ~ PHSPHT', df07[df07['STNNBR'] == station]).fit()
+        row = fitted.loc[station]
+        np.testing.assert_allclose(row[['Intercept', 'PHSPHT']], fit.params)
+        np.testing.assert_allclose(row[['Intercept_se', 'PHSPHT_se']], fit.bse)
+        assert np.isclose(row['rsquared'], fit.rsquared)
+        assert row['nobs'] == fit.nobs
+
+
+def test_several_predictors_and_keys():
+    rng = np.random.default_rng(0)
+    n = 600
+    df = pd.DataFrame({'a': rng.integers(0, 3, n), 'b': rng.choice(['x', 'y'], n),
+                       'x1': rng.normal(size=n), 'x2': rng.normal(size=n)})
+    df['y'] = 1 + 2*df['x1'] - df['x2'] + rng.normal(size=n)
+    df.loc[::50, 'x2'] = np.nan
+    table = ols_by_group(df, 'y', ['x1', 'x2'], by=['a', 'b'])
+    for (a, b), row in table.iterrows():
+        part = df[(df['a'] == a) & (df['b'] == b)].dropna()
+        fit = sm.OLS(part['y'], sm.add_constant(part[['x1', 'x2']])).fit()
+        np.testing.assert_allclose(row[['Intercept', 'x1', 'x2']], fit.params)
+        np.testing.assert_allclose(row[['Intercept_se', 'x1_se', 'x2_se']], fit.bse)
+
+
+def test_no_intercept_and_degenerate_groups():
+    x = np.array([1.0, 2.0, 3.0, 4.0, 5.0, 1.0, 1.0, 1.0, 7.0])
+    y = np.array([2.1, 3.9, 6.2, 7.8, 10.1, 1.0, 2.0, 3.0, 1.0])
+    groups = np.array([0, 0, 0, 0, 0, 1, 1, 1, 2])
+    fits = GroupedOLS(y, x, groups, intercept=False)
+    ref = sm.OLS(y[:5], x[:5]).fit()
+    np.testing.assert_allclose(fits.params[0], ref.params)
+    np.testing.assert_allclose(fits.bse[0], ref.bse)
+
+    fits = GroupedOLS(y, x, groups)
+    # group 1 has a constant x and group 2 a single row
+    assert np.isnan(fits.params[1:]).all()
+    assert len(fits) == 3
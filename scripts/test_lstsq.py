@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+import pytest
+import statsmodels.api as sm
+
+from lstsq import (lstsq, condition_number, vif, RecursiveLstsq, chunked_lstsq,
+                   design_chunks, column_scale)
+
+
+def design(N=500, k=4, noise=1.0, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.normal(size=(N, k))
+    if noise < 1:
+        # nearly collinear predictors
+        x = x[:, :1] + noise * x
+    X = np.column_stack([np.ones(N), x * 10.0**np.arange(k)])
+    y = X @ np.arange(1, k + 2) + rng.normal(size=N)
+    return X, y
+
+
+@pytest.mark.parametrize('method', ['auto', 'cholesky', 'qr', 'svd'])
+def test_matches_statsmodels(method):
+    X, y = design()
+    fit = lstsq(X, y, method=method)
+    ref = sm.OLS(y, X).fit()
+    np.testing.assert_allclose(fit.coef, ref.params, rtol=1e-9)
+    np.testing.assert_allclose(fit.bse, ref.bse, rtol=1e-7)
+    assert fit.ssr == pytest.approx(ref.ssr)
+    assert fit.df_resid == ref.df_resid
+
+
+@pytest.mark.parametrize('noise', [1.0, 1e-3, 1e-6])
+def test_auto_matches_the_method_it_picks(noise):
+    X, y = design(noise=noise)
+    fit = lstsq(X, y)
+    same = lstsq(X, y, method=fit.method)
+    np.testing.assert_array_equal(fit.coef, same.coef)
+    np.testing.assert_array_equal(fit.cov, same.cov)
+    ref = np.linalg.lstsq(X, y, rcond=None)[0]
+    np.testing.assert_allclose(fit.coef, ref, rtol=1e-9 if noise == 1 else 1e-5)
+
+
+def test_auto_avoids_normal_equations_when_ill_conditioned():
+    X, y = design(noise=1e-5)
+    assert condition_number(X) > 1e5
+    assert lstsq(X, y).method == 'qr'
+    assert lstsq(*design()).method == 'cholesky'
+
+
+def test_rank_deficient():
+    X, y = design()
+    X = np.column_stack([X, X[:, 1] + X[:, 2]])
+    fit = lstsq(X, y)
+    assert fit.method == 'svd' and fit.rank == X.shape[1] - 1
+    np.testing.assert_allclose(X @ fit.coef, X @ np.linalg.lstsq(X, y, rcond=None)[0])
+
+
+def test_condition_number_and_vif():
+    X, y = design(noise=0.1)
+    Xs = X / column_scale(X)
+    assert condition_number(X) == pytest.approx(np.linalg.cond(Xs))
+    assert condition_number(X, scale=False) == pytest.approx(np.linalg.cond(X))
+    x = X[:, 1:]
+    ref = [1 / (1 - sm.OLS(x[:, j], sm.add_constant(np.delete(x, j, axis=1))).fit().rsquared)
+           for j in range(x.shape[1])]
+    np.testing.assert_allclose(vif(x), ref)
+
+
+def test_recursive_matches_refit():
+    X, y = design(N=900)
+    x = X[:, 1:]
+    fit = RecursiveLstsq()
+    fit.add(x[:300], y[:300], key='a')
+    fit.add(x[300:700], y[300:700], key='b')
+    fit.add(x[700:], y[700:], key='c')
+    ref = sm.OLS(y, X).fit()
+    np.testing.assert_allclose(fit.coef, ref.params, rtol=1e-9)
+    np.testing.assert_allclose(fit.bse, ref.bse, rtol=1e-7)
+    assert fit.rsquared == pytest.approx(ref.rsquared)
+
+    fit.remove('b')
+    keep = np.r_[0:300, 700:900]
+    ref = sm.OLS(y[keep], X[keep]).fit()
+    np.testing.assert_allclose(fit.coef, ref.params, rtol=1e-9)
+    np.testing.assert_allclose(fit.cov, ref.cov_params(), rtol=1e-7)
+    assert fit.ssr == pytest.approx(ref.ssr)
+    with pytest.raises(KeyError):
+        fit.add(x[:10], y[:10], key='a')
+
+
+def test_recursive_without_intercept():
+    X, y = design(N=200)
+    fit = RecursiveLstsq(intercept=False)
+    fit.add(X[:120], y[:120])
+    fit.add(X[120:], y[120:])
+    np.testing.assert_allclose(fit.coef, sm.OLS(y, X).fit().params, rtol=1e-9)
+
+
+def chunks_of(X, y, sizes):
+    edges = np.cumsum([0] + list(sizes))
+    return [(X[a:b], y[a:b]) for a, b in zip(edges[:-1], edges[1:])]
+
+
+@pytest.mark.parametrize('method', ['tsqr', 'normal'])
+@pytest.mark.parametrize('sizes', [[500], [100] * 5, [3] * 166 + [2], [2, 1, 0, 497]])
+def test_chunked_matches_lstsq(method, sizes):
+    X, y = design()
+    fit = chunked_lstsq(chunks_of(X, y, sizes), method=method)
+    ref = sm.OLS(y, X).fit()
+    np.testing.assert_allclose(fit.coef, ref.params, rtol=1e-8)
+    np.testing.assert_allclose(fit.bse, ref.bse, rtol=1e-6)
+    assert fit.ssr == pytest.approx(ref.ssr)
+
+
+def test_chunked_too_few_rows():
+    X, y = design(N=5)
+    with pytest.raises(ValueError):
+        chunked_lstsq(chunks_of(X[:3], y[:3], [1, 2]))
+    with pytest.raises(ValueError):
+        chunked_lstsq([])
+    # exactly determined
+    fit = chunked_lstsq(chunks_of(X, y, [2, 3]))
+    np.testing.assert_allclose(fit.coef, np.linalg.solve(X, y))
+
+
+def test_chunked_in_processes():
+    X, y = design(N=2000)
+    fit = chunked_lstsq(chunks_of(X, y, [250] * 8), processes=2)
+    np.testing.assert_allclose(fit.coef, np.linalg.lstsq(X, y, rcond=None)[0], rtol=1e-9)
+
+
+def test_design_chunks():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'y': rng.normal(size=100), 'a': rng.normal(size=100),
+                       'b': rng.normal(size=100)})
+    df.loc[::7, 'a'] = np.nan
+    frames = [df.iloc[i:i + 30] for i in range(0, 100, 30)]
+    fit = chunked_lstsq(design_chunks(frames, 'y', ['a', 'b']))
+    ref = sm.OLS.from_formula('y ~ a + b', df).fit()
+    np.testing.assert_allclose(fit.coef, ref.params, rtol=1e-9)
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+from scipy import stats
+
+from model2 import model2_regression, model2_pairs
+
+
+@pytest.fixture(scope='module')
+def xy():
+    rng = np.random.default_rng(0)
+    t = rng.normal(size=300)
+    x = 2 * t + rng.normal(scale=0.5, size=300)
+    y = -1.5 * t + 4 + rng.normal(scale=0.8, size=300)
+    return x, y
+
+
+def major_axis(x, y):
+    # slope of the first principal component
+    cov = np.cov(x, y)
+    w, v = np.linalg.eigh(cov)
+    return v[1, -1] / v[0, -1]
+
+
+def test_ols_matches_linregress(xy):
+    x, y = xy
+    ref = stats.linregress(x, y)
+    result = model2_regression(x, y, method='ols')
+    np.testing.assert_allclose(result['slope'], ref.slope)
+    np.testing.assert_allclose(result['intercept'], ref.intercept)
+    np.testing.assert_allclose(result['r'], ref.rvalue)
+    assert result['n'] == len(x)
+
+
+def test_rma_slope(xy):
+    x, y = xy
+    result = model2_regression(x, y, method='rma')
+    r = np.corrcoef(x, y)[0, 1]
+    slope = np.sign(r) * np.std(y) / np.std(x)
+    np.testing.assert_allclose(result['slope'], slope)
+    np.testing.assert_allclose(result['intercept'], y.mean() - slope * x.mean())
+
+
+def test_major_axis_and_deming(xy):
+    x, y = xy
+    ma = model2_regression(x, y, method='ma')
+    np.testing.assert_allclose(ma['slope'], major_axis(x, y))
+    np.testing.assert_allclose(ma['intercept'], y.mean() - ma['slope'] * x.mean())
+    deming = model2_regression(x, y, method='deming', delta=1.0)
+    np.testing.assert_allclose(deming['slope'], ma['slope'])
+    # Deming with a large error variance ratio approaches OLS of y on x
+    ols = model2_regression(x, y, method='ols')
+    deming = model2_regression(x, y, method='deming', delta=1e8)
+    np.testing.assert_allclose(deming['slope'], ols['slope'], rtol=1e-6)
+
+
+def test_many_pairs_and_missing_values(xy):
+    x, y = xy
+    x2 = x.copy()
+    x2[::7] = np.nan
+    result = model2_regression(np.column_stack([x, x2]), np.column_stack([y, y]))
+    ok = ~np.isnan(x2)
+    ref = model2_regression(x[ok], y[ok])
+    np.testing.assert_allclose(result['slope'][1], ref['slope'])
+    np.testing.assert_allclose(result['intercept'][1], ref['intercept'])
+    assert result['n'].tolist() == [len(x), ok.sum()]
+
+
+def test_bootstrap(xy):
+    x, y = xy
+    first = model2_regression(x, y, nboot=500, seed=1)
+    again = model2_regression(x, y, nboot=500, seed=1)
+    for key in ('slope_ci', 'intercept_ci', 'slope_se', 'intercept_se'):
+        np.testing.assert_array_equal(first[key], again[key])
+    lower, upper = first['slope_ci']
+    assert lower < first['slope'] < upper
+    # small blocks give the same resamples
+    blocks = model2_regression(x, y, nboot=500, seed=1, max_block=1000)
+    np.testing.assert_allclose(blocks['slope_se'], first['slope_se'])
+
+    # bootstrap standard error of the slope, resampling the rows
+    rng = np.random.default_rng(2)
+    slopes = []
+    for i in range(500):
+        rows = rng.integers(0, len(x), len(x))
+        slopes.append(model2_regression(x[rows], y[rows])['slope'])
+    np.testing.assert_allclose(first['slope_se'], np.std(slopes, ddof=1), rtol=0.2)
+
+
+def test_bootstrap_processes(xy):
+    x, y = xy
+    result = model2_regression(x, y, nboot=400, seed=1, processes=2)
+    ref = model2_regression(x, y, nboot=400, seed=1)
+    np.testing.assert_allclose(result['slope_se'], ref['slope_se'], rtol=0.3)
+    again = model2_regression(x, y, nboot=400, seed=1, processes=2)
+    np.testing.assert_array_equal(result['slope_ci'], again['slope_ci'])
+
+
+def test_model2_pairs(df07):
+    columns = ['CTDTMP', 'CTDSAL', 'NITRAT']
+    table = model2_pairs(df07, columns=columns, method='ma')
+    assert list(zip(table['x'], table['y'])) == [('CTDTMP', 'CTDSAL'),
+                                                 ('CTDTMP', 'NITRAT'),
+                                                 ('CTDSAL', 'NITRAT')]
+    for row in table.itertuples():
+        data = df07[[row.x, row.y]].dropna()
+        assert row.n == len(data)
+        np.testing.assert_allclose(row.slope, major_axis(data[row.x], data[row.y]))
+        np.testing.assert_allclose(row.r, np.corrcoef(data[row.x], data[row.y])[0, 1])
+
+    table = model2_pairs(df07, pairs=[('PHSPHT', 'NITRAT')], nboot=100, seed=0)
+    assert {'slope_se', 'slope_lower', 'slope_upper', 'intercept_lower'} <= set(table.columns)
+    assert table['slope_lower'][0] < table['slope'][0] < table['slope_upper'][0]
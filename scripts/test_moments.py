@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import netCDF4 as nc4
+import pytest
+from scipy import stats
+
+from moments import Moments, GroupedMoments, specimen_moments
+
+
+def test_chunked_moments_match_numpy():
+    x = np.random.default_rng(0).gamma(2.0, 3.0, 10000)
+    x[::97] = np.nan
+    m = Moments()
+    for chunk in np.array_split(x, 7):
+        m.update(chunk)
+    good = x[~np.isnan(x)]
+    assert m.n == len(good)
+    assert m.mean == pytest.approx(np.mean(good))
+    assert m.var() == pytest.approx(np.var(good))
+    assert m.std(ddof=1) == pytest.approx(np.std(good, ddof=1))
+    assert m.skew == pytest.approx(stats.skew(good))
+    assert (m.min, m.max) == (good.min(), good.max())
+
+    # merging accumulators of parts is the same as one pass
+    parts = [Moments(chunk) for chunk in np.array_split(x, 3)]
+    merged = parts[0] + parts[1]
+    merged.merge(parts[2])
+    assert merged.mean == pytest.approx(m.mean)
+    assert merged.var() == pytest.approx(m.var())
+    assert Moments.from_dict(merged.to_dict()).skew == pytest.approx(m.skew)
+
+
+def test_empty_moments():
+    m = Moments([np.nan])
+    assert m.n == 0 and np.isnan(m.mean) and np.isnan(m.var())
+
+
+def test_grouped_moments_match_groupby():
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({'species': rng.choice(['a', 'b', 'c'], 3000),
+                       'cruise': rng.integers(0, 4, 3000),
+                       'weight': rng.normal(10, 2, 3000)})
+    ref = df.groupby(['species', 'cruise'])['weight'].agg(['count', 'mean', 'std'])
+
+    g = GroupedMoments()
+    h = GroupedMoments()
+    for start in range(0, len(df), 700):
+        g.update_frame(df.iloc[start:start + 700], 'weight', ['species', 'cruise'])
+    for start in range(len(df), 0, -1000):
+        chunk = df.iloc[max(start - 1000, 0):start]
+        h.update(chunk['weight'], [chunk['species'], chunk['cruise']])
+    for result in (g.to_frame(ddof=1), GroupedMoments().merge(h).to_frame(ddof=1)):
+        result = result.loc[ref.index]
+        np.testing.assert_array_equal(result['n'], ref['count'])
+        np.testing.assert_allclose(result['mean'], ref['mean'])
+        np.testing.assert_allclose(result['std'], ref['std'])
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_specimen_moments(trawl_file, processes):
+    with nc4.Dataset(trawl_file) as ds:
+        df = pd.DataFrame({
+            'scientific_name': ds.variables['scientific_name'][:],
+            'cruise': ds.variables['cruise'][:],
+            'weight': ds.variables['weight'][:].filled(np.nan)})
+    table = specimen_moments(trawl_file, 'weight', by=['scientific_name', 'cruise'],
+                             chunksize=700, processes=processes)
+    ref = df.groupby(['scientific_name', 'cruise'])['weight'].agg(['count', 'mean', 'std', 'max'])
+    table = table.loc[list(ref.index)]
+    np.testing.assert_array_equal(table['n'], ref['count'])
+    np.testing.assert_allclose(table['mean'], ref['mean'])
+    np.testing.assert_allclose(table['std'], ref['std'] * np.sqrt((ref['count'] - 1) / ref['count']))
+    np.testing.assert_allclose(table['max'], ref['max'])
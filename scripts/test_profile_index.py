@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from profile_index import ProfileIndex, CAST_KEYS
+
+
+@pytest.fixture(scope='module')
+def bottles():
+    rng = np.random.default_rng(0)
+    nbottles = rng.integers(1, 25, 300)
+    cast = np.repeat(np.arange(len(nbottles)), nbottles)
+    df = pd.DataFrame({'EXPOCODE': np.where(cast < 150, 'A', 'B'),
+                       'STNNBR': cast // 3, 'CASTNO': cast % 3,
+                       'CTDPRS': rng.uniform(0, 1000, len(cast)).round(),
+                       'CTDTMP': rng.normal(8, 3, len(cast))})
+    df.loc[rng.random(len(df)) < 0.05, 'CTDPRS'] = np.nan
+    df.loc[rng.random(len(df)) < 0.05, 'CTDTMP'] = np.nan
+    # shuffle, so the casts are not contiguous in the table
+    return df.sample(frac=1, random_state=0).reset_index(drop=True)
+
+
+def mask(df, pmin, pmax):
+    keep = df['CTDPRS'].notna()
+    if pmin is not None:
+        keep &= df['CTDPRS'] >= pmin
+    if pmax is not None:
+        keep &= df['CTDPRS'] <= pmax
+    return keep
+
+
+RANGES = [(30, 300), (None, 10), (500, None), (None, None), (5000, None),
+          (None, -1), (300, 30)]
+
+
+@pytest.mark.parametrize('pmin,pmax', RANGES)
+def test_rows_match_mask(bottles, pmin, pmax):
+    profiles = ProfileIndex(bottles)
+    rows = profiles.rows(pmin, pmax)
+    np.testing.assert_array_equal(np.sort(rows), np.flatnonzero(mask(bottles, pmin, pmax)))
+    counts = bottles[mask(bottles, pmin, pmax)].groupby(list(CAST_KEYS)).size()
+    result = pd.Series(profiles.counts(pmin, pmax),
+                       index=pd.MultiIndex.from_frame(profiles.casts))
+    pd.testing.assert_series_equal(result[result > 0], counts, check_names=False,
+                                   check_dtype=False)
+
+
+@pytest.mark.parametrize('func', ['sum', 'count', 'mean', 'min', 'max', 'first', 'last'])
+@pytest.mark.parametrize('pmin,pmax', [(30, 300), (None, 100), (None, None)])
+def test_reduce_matches_groupby(bottles, func, pmin, pmax):
+    profiles = ProfileIndex(bottles)
+    result = pd.Series(profiles.reduce(bottles['CTDTMP'], func, pmin, pmax),
+                       index=pd.MultiIndex.from_frame(profiles.casts))
+
+    selected = bottles[mask(bottles, pmin, pmax)].dropna(subset=['CTDTMP'])
+    selected = selected.sort_values('CTDPRS', kind='stable')
+    ref = selected.groupby(list(CAST_KEYS))['CTDTMP'].agg(func)
+    if func in ('sum', 'count'):
+        assert (result.drop(ref.index) == 0).all()
+    else:
+        assert result.drop(ref.index).isna().all()
+    pd.testing.assert_series_equal(result[ref.index], ref, check_names=False,
+                                   check_dtype=False)
+
+
+def test_profile(bottles):
+    profiles = ProfileIndex(bottles)
+    for i in [0, 17, len(profiles) - 1]:
+        cast = profiles.casts.iloc[i]
+        same = (bottles[list(CAST_KEYS)] == cast.to_numpy()).all(axis=1)
+        ref = bottles[same & mask(bottles, 30, 300)].sort_values('CTDPRS')
+        rows = profiles.profile(i, 30, 300)
+        np.testing.assert_array_equal(bottles['CTDPRS'].to_numpy()[rows],
+                                      ref['CTDPRS'].to_numpy())
+
+
+def test_missing_pressures_are_never_selected():
+    df = pd.DataFrame({'EXPOCODE': 'A', 'STNNBR': 1, 'CASTNO': 1,
+                       'CTDPRS': [5, 50, np.nan, 100, np.nan],
+                       'CTDTMP': [1.0, 2.0, 3.0, 4.0, 5.0]})
+    profiles = ProfileIndex(df)
+    np.testing.assert_array_equal(profiles.rows(30), [1, 3])
+    np.testing.assert_array_equal(profiles.rows(5000), [])
+    np.testing.assert_array_equal(profiles.rows(), [0, 1, 3])
+    np.testing.assert_array_equal(profiles.profile(0, 30), [1, 3])
+    assert profiles.reduce(df['CTDTMP'], 'mean', 30)[0] == 3.0
+    assert profiles.reduce(df['CTDTMP'], 'last')[0] == 4.0
+
+
+def test_course_data(df07):
+    profiles = ProfileIndex(df07)
+    rows = profiles.rows(30, 300)
+    ii = (df07['CTDPRS'] >= 30) & (df07['CTDPRS'] <= 300)
+    np.testing.assert_array_equal(np.sort(rows), np.flatnonzero(ii))
+    surface = profiles.reduce(df07['CTDTMP'], 'mean', pmax=10)
+    ref = df07[df07['CTDPRS'] <= 10].groupby(['EXPOCODE', 'STNNBR', 'CASTNO'])['CTDTMP'].mean()
+    np.testing.assert_allclose(surface[~np.isnan(surface)], ref.dropna().to_numpy())
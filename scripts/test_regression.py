@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+import regression
+from regression import PolynomialSweep, LossLandscape, polyfit_sweep
+
+
+@pytest.fixture(scope='module')
+def length_weight():
+    rng = np.random.default_rng(0)
+    length = rng.uniform(20, 180, 2000)
+    weight = 1e-5 * length**3 * rng.lognormal(0, 0.15, len(length))
+    return length, weight
+
+
+def test_sweep_matches_polyfit(length_weight):
+    length, weight = length_weight
+    sweep = PolynomialSweep(length, weight, max_degree=8)
+    for N in sweep.degrees:
+        z = np.polyfit(length, weight, N)
+        p = np.poly1d(z)
+        np.testing.assert_allclose(sweep.coefficients(N), z, rtol=1e-6, atol=1e-12)
+        np.testing.assert_allclose(sweep.predict(length, N), p(length), rtol=1e-7, atol=1e-6)
+        np.testing.assert_allclose(sweep.poly1d(N)(length), p(length), rtol=1e-7, atol=1e-6)
+        rmse = np.sqrt(np.mean((weight - p(length))**2))
+        assert sweep.rmse[N] == pytest.approx(rmse, rel=1e-9)
+
+
+def test_cv_rmse_matches_refitting(length_weight):
+    length, weight = length_weight
+    sweep = PolynomialSweep(length, weight, max_degree=5)
+    cv = sweep.cv_rmse(nfolds=4, seed=1)
+
+    fold = np.random.default_rng(1).permutation(len(weight)) % 4
+    sse = np.zeros(6)
+    for k in range(4):
+        train, test = fold != k, fold == k
+        for N in range(6):
+            p = np.poly1d(np.polyfit(length[train], weight[train], N))
+            sse[N] += np.sum((weight[test] - p(length[test]))**2)
+    np.testing.assert_allclose(cv, np.sqrt(sse / len(weight)), rtol=1e-8)
+    assert sweep.cv_rmse(nfolds=4, seed=1) is cv
+
+
+
+@pytest.mark.filterwarnings('ignore::numpy.exceptions.RankWarning')
+@pytest.mark.parametrize('x', [[10, 10, 20, 20, 20, 30],
+                               [12.5, 30.0, 41.0, 55.5]])
+def test_degrees_without_a_unique_fit(x):
+    x = np.array(x, dtype=np.float64)
+    y = np.array([1.0, 2.0, 2.5, 3.5, 3.0, 1.5])[:len(x)]
+    sweep = PolynomialSweep(x, y, max_degree=10)
+    rank = len(np.unique(x))
+    assert sweep.rank == rank
+    assert len(sweep.rmse) == 11
+    for N in sweep.degrees:
+        z = np.polyfit(x, y, N)
+        rmse = np.sqrt(np.mean((y - np.polyval(z, x))**2))
+        assert sweep.rmse[N] == pytest.approx(rmse, abs=1e-9)
+        assert sweep.rmse[N] == sweep.rmse[min(N, rank - 1)]
+        np.testing.assert_allclose(sweep.coefficients(N), z, rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose(sweep.predict(x, N), np.polyval(z, x), atol=1e-8)
+
+    # cross-validation matches refitting for the degrees with a unique fit
+    # in every fold
+    cv = sweep.cv_rmse(nfolds=2, seed=0)
+    assert np.all(np.isfinite(cv))
+    fold = np.random.default_rng(0).permutation(len(y)) % 2
+    unique = min(len(np.unique(x[fold != k])) for k in range(2))
+    sse = np.zeros(unique)
+    for k in range(2):
+        train, test = fold != k, fold == k
+        for N in range(unique):
+            z = np.polyfit(x[train], y[train], N)
+            sse[N] += np.sum((y[test] - np.polyval(z, x[test]))**2)
+    np.testing.assert_allclose(cv[:unique], np.sqrt(sse / len(y)), rtol=1e-8)
+
+
+def test_polyfit_sweep_cache_is_bounded(length_weight):
+    length, weight = length_weight
+    regression._sweeps.clear()
+    first = polyfit_sweep(length, weight, 3)
+    assert polyfit_sweep(length, weight, 3) is first
+    for i in range(1, regression.MAX_SWEEPS + 1):
+        polyfit_sweep(length[i:], weight[i:], 3)
+    assert len(regression._sweeps) == regression.MAX_SWEEPS
+    assert polyfit_sweep(length, weight, 3) is not first
+
+
+def test_loss_landscape_matches_direct_rmse(length_weight):
+    length, weight = length_weight
+    loss = LossLandscape()
+    for start in range(0, len(weight), 300):
+        loss.update(weight[start:start + 300], length[start:start + 300])
+
+    c = np.arange(0, 31, 0.5)
+    direct = np.array([np.sqrt(np.mean((weight - ci)**2)) for ci in c])
+    np.testing.assert_allclose(loss.rmse_constant(c), direct)
+
+    a, b = np.meshgrid(np.linspace(-40, 10, 7), np.linspace(0, 0.6, 5))
+    direct = np.sqrt(np.mean((weight - a[..., None] - b[..., None]*length)**2, axis=-1))
+    np.testing.assert_allclose(loss.rmse_linear(a, b), direct)
+
+    assert loss.best_constant() == pytest.approx(np.mean(weight))
+    np.testing.assert_allclose(loss.best_linear(), np.polyfit(length, weight, 1)[::-1])
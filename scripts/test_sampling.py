@@ -0,0 +1,58 @@
+import numpy as np
+from scipy import stats
+
+from sampling import (subsample_weights, resample_blocks, resample_statistics,
+                      ci_coverage)
+
+
+def population():
+    return np.random.default_rng(42).gamma(2.0, 7.0, 5000)
+
+
+def test_resample_statistics_matches_loop():
+    x = population()
+    N, n_subsamples = 25, 1000
+    result = resample_statistics(x, N, n_subsamples, seed=3, ddof=1,
+                                 quantiles=[0.025, 0.975])
+
+    # the notebook loop, drawing the same subsamples
+    rng = np.random.default_rng(3)
+    means, stds = [], []
+    for n in range(n_subsamples):
+        sample = subsample_weights(x, N, rng)
+        means.append(np.mean(sample))
+        stds.append(np.std(sample, ddof=1))
+    np.testing.assert_allclose(result['mean'], means)
+    np.testing.assert_allclose(result['std'], stds)
+    np.testing.assert_allclose(result['quantiles'], np.quantile(means, [0.025, 0.975]))
+
+
+def test_block_size_does_not_change_the_draws():
+    x = population()
+    big = np.vstack(list(resample_blocks(x, 10, 100, seed=0)))
+    small = np.vstack(list(resample_blocks(x, 10, 100, seed=0, max_block=30)))
+    assert big.shape == (100, 10)
+    np.testing.assert_array_equal(big, small)
+
+
+def test_ci_coverage_matches_scipy_intervals():
+    x = population()
+    N, ntrial = 15, 500
+    result = ci_coverage(x, N, ntrial, seed=1, keep=ntrial)
+
+    count = 0
+    for sample in resample_blocks(x, N, ntrial, seed=1):
+        for row in sample:
+            lower, upper = stats.t.interval(0.95, N - 1, loc=np.mean(row),
+                                            scale=stats.sem(row))
+            count += lower <= np.mean(x) < upper
+    assert result['count'] == count
+    assert len(result['lower']) == ntrial
+
+
+def test_ci_coverage_is_near_nominal():
+    x = np.random.default_rng(0).normal(10, 2, 10000)
+    result = ci_coverage(x, 20, 20000, seed=0, max_block=2**12)
+    assert abs(result['coverage'] - 0.95) < 0.01
+    parallel = ci_coverage(x, 20, 2000, seed=0, processes=2)
+    assert parallel['ntrial'] == 2000 and len(parallel['lower']) == 200
@@ -0,0 +1,74 @@
+import numpy as np
+import netCDF4 as nc4
+import pytest
+
+from trawl import (SpecimenIndex, read_trawl_data_file, read_netcdf_where,
+                   iter_netcdf_chunks)
+
+
+def notebook_read_trawl_data_file(species_name, file_name):
+    '''read_trawl_data_file from the modeling and sampling notes.'''
+
+    ds = nc4.Dataset(file_name)
+    name = ds.variables['scientific_name'][:]
+    weight = ds.variables['weight'][:]
+    length = ds.variables['standard_length'][:]
+    ds.close()
+
+    indices = np.logical_and(name == species_name, length < 4000)
+    indices = np.logical_and(indices, ~np.isnan(weight))
+    return weight[indices], length[indices]
+
+
+@pytest.mark.parametrize('species', ['Engraulis mordax', 'Sardinops sagax',
+                                     'Not a fish'])
+def test_matches_notebook_function(trawl_file, species):
+    ref_weight, ref_length = notebook_read_trawl_data_file(species, trawl_file)
+    weight, length = read_trawl_data_file(species, trawl_file)
+    np.testing.assert_array_equal(weight, ref_weight)
+    np.testing.assert_array_equal(length, ref_length)
+    assert read_trawl_data_file(species, trawl_file)[0] is weight
+
+
+def test_specimen_rows(trawl_file):
+    index = SpecimenIndex(trawl_file)
+    with nc4.Dataset(trawl_file) as ds:
+        name = ds.variables['scientific_name'][:]
+    for species in index.species:
+        np.testing.assert_array_equal(np.sort(index.rows(species)),
+                                      np.flatnonzero(name == species))
+
+
+def test_read_netcdf_where(trawl_file):
+    with nc4.Dataset(trawl_file) as ds:
+        name = ds.variables['scientific_name'][:]
+        weight = ds.variables['weight'][:].filled(np.nan)
+        length = ds.variables['standard_length'][:].filled(np.nan)
+    keep = (name == 'Engraulis mordax') & (length < 100)
+
+    for chunksize in (37, 1000, 10**6):
+        df = read_netcdf_where(trawl_file, ['weight', 'standard_length'],
+                               {'scientific_name': 'Engraulis mordax',
+                                'standard_length': lambda v: v < 100},
+                               chunksize=chunksize)
+        np.testing.assert_array_equal(df.index, np.flatnonzero(keep))
+        np.testing.assert_array_equal(df['weight'], weight[keep])
+        np.testing.assert_array_equal(df['standard_length'], length[keep])
+
+
+def test_read_netcdf_where_lists_and_no_match(trawl_file):
+    species = ['Sardinops sagax', 'Icichthys lockingtoni']
+    df = read_netcdf_where(trawl_file, where={'scientific_name': species})
+    assert set(df['scientific_name']) == set(species)
+    assert {'weight', 'standard_length', 'cruise'} <= set(df.columns)
+
+    none = read_netcdf_where(trawl_file, ['weight'], {'cruise': 99})
+    assert len(none) == 0
+
+
+def test_iter_netcdf_chunks(trawl_file):
+    chunks = list(iter_netcdf_chunks(trawl_file, ['weight', 'cruise'], chunksize=999))
+    with nc4.Dataset(trawl_file) as ds:
+        cruise = ds.variables['cruise'][:]
+    np.testing.assert_array_equal(np.concatenate([c['cruise'] for c in chunks]), cruise)
+    assert len(chunks) == 6
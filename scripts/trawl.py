@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''A module for reading the SWFSC trawl specimen data (FRDCPSTrawlLHSpecimen).
+
+In the modeling and sampling notebook, read_trawl_data_file opens the netCDF
+file and reads the names, weights and lengths of every specimen each time a
+widget slider moves. Here the file is read once into a SpecimenIndex, with
+the specimens sorted by species, so getting the data for a species is a
+dictionary lookup:
+
+    specimens = SpecimenIndex(file_name)
+    weight, length = specimens.get('Engraulis mordax')
+
+read_trawl_data_file is a drop-in replacement for the notebook function that
+keeps one SpecimenIndex per file.
+
+read_netcdf_where replaces xr.open_dataset(...).to_dataframe() followed by
+a selection of rows. The conditions are tested first, reading only the
+variables they need, and only the matching rows of the requested variables
+are read:
+
+    df = read_netcdf_where(TRAWL_FILE, ['weight', 'standard_length'],
+                           {'scientific_name': 'Engraulis mordax',
+                            'standard_length': lambda v: v < 1e8})
+'''
+
+import os
+
+import numpy as np
+import pandas as pd
+import netCDF4 as nc4
+
+TRAWL_FILE = 'data/trawl_swfsc/FRDCPSTrawlLHSpecimen_8b4e_b841_9c81.nc'
+
+
+def read_netcdf_variable(ds, name, rows=slice(None)):
+    '''
+    Read a netCDF variable as a plain numpy array
+
+    Character arrays (how ERDDAP stores strings) are converted to strings,
+    and masked values of numeric variables become NaN.
+
+    Inputs:
+        ds - open netCDF4.Dataset
+        name - name of the variable
+        rows - slice of rows to read (default: all of them)
+    Returns: numpy array
+    '''
+
+    values = ds.variables[name][rows]
+    if values.dtype.kind == 'S' and values.ndim == 2:
+        values = nc4.chartostring(values)
+    if values.dtype.kind == 'S':
+        values = values.astype(str)
+    if np.ma.isMaskedArray(values):
+        if values.dtype.kind == 'f':
+            values = values.filled(np.nan)
+        else:
+            values = values.data
+    return np.asarray(values)
+
+
+def iter_netcdf_chunks(file_name, variables, chunksize=100000, start=0, stop=None):
+    '''
+    Read variables of a netCDF file in blocks of rows
+
+    Inputs:
+        file_name - path to the netCDF file
+        variables - list of variable names (sharing the row dimension)
+        chunksize - number of rows per block
+        start, stop - range of rows to read (default: all of them)
+    Yields: dictionaries of numpy arrays, one per variable
+    '''
+
+    ds = nc4.Dataset(file_name)
+    try:
+        if stop is None:
+            stop = ds.variables[variables[0]].shape[0]
+        for i in range(start, stop, chunksize):
+            rows = slice(i, min(i + chunksize, stop))
+            yield {name: read_netcdf_variable(ds, name, rows) for name in variables}
+    finally:
+        ds.close()
+
+
+def _test(values, condition):
+    '''Rows of values meeting a condition (a function, a list of allowed
+    values, or a single value).'''
+
+    if callable(condition):
+        return np.asarray(condition(values), dtype=bool)
+    if isinstance(condition, (list, tuple, set, np.ndarray)):
+        return np.isin(values, list(condition))
+    return values == condition
+
+
+def read_netcdf_where(file_name, variables=None, where=None, chunksize=1000000):
+    '''
+    Read the rows of a netCDF file that meet a set of conditions
+
+    The file is read in blocks of rows. In each block, the conditions are
+    tested one variable at a time, stopping as soon as no rows are left, and
+    the requested variables are read only for the span of rows that match.
+
+    Inputs:
+        file_name - path to the netCDF file
+        variables - list of variables to return (default: all variables with
+                    the same row dimension as the first condition)
+        where - dictionary of conditions, {variable: condition}, where a
+                condition is a function returning a boolean array (e.g.
+                lambda v: v < 1e8), a list of allowed values, or a single
+                value to match
+        chunksize - number of rows read at once
+    Returns: Pandas dataframe of the matching rows, indexed by row number in
+             the file
+    '''
+
+    where = where or {}
+    ds = nc4.Dataset(file_name)
+    try:
+        first = list(where)[0] if where else variables[0]
+        dim = ds.variables[first].dimensions[0]
+        nrows = len(ds.dimensions[dim])
+        if variables is None:
+            variables = [name for name, v in ds.variables.items()
+                         if len(v.dimensions) > 0 and v.dimensions[0] == dim]
+
+        rows = []
+        columns = {name: [] for name in variables}
+        for start in range(0, nrows, chunksize):
+            stop = min(start + chunksize, nrows)
+            keep = np.ones(stop - start, dtype=bool)
+            for name, condition in where.items():
+                span = np.flatnonzero(keep)
+                if len(span) == 0:
+                    break
+                # read only the part of the block that can still match
+                lo, hi = start + span[0], start + span[-1] + 1
+                values = read_netcdf_variable(ds, name, slice(lo, hi))
+                keep[lo - start:hi - start] &= _test(values, condition)
+
+            found = np.flatnonzero(keep)
+            if len(found) == 0:
+                continue
+            lo, hi = start + found[0], start + found[-1] + 1
+            rows.append(start + found)
+            for name in variables:
+                values = read_netcdf_variable(ds, name, slice(lo, hi))
+                columns[name].append(values[start + found - lo])
+    finally:
+        ds.close()
+
+    index = pd.Index(np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64),
+                     name=dim)
+    return pd.DataFrame({name: np.concatenate(v) if v else np.zeros(0)
+                         for name, v in columns.items()}, index=index)
+
+
+class SpecimenIndex:
+    '''
+    Weights and lengths of the trawl specimens, grouped by species
+
+    Inputs:
+        file_name - path to the FRDCPSTrawlLHSpecimen netCDF file
+        max_length - specimens with standard_length at or above this value
+                     (fill values) are dropped, as in read_trawl_data_file
+    '''
+
+    def __init__(self, file_name=TRAWL_FILE, max_length=4000):
+        self.file_name = file_name
+        self.max_length = max_length
+
+        ds = nc4.Dataset(file_name)
+        try:
+            name = read_netcdf_variable(ds, 'scientific_name')
+            weight = read_netcdf_variable(ds, 'weight')
+            length = read_netcdf_variable(ds, 'standard_length')
+        finally:
+            ds.close()
+
+        # sort by species, so each species is one contiguous range of rows
+        self.species, codes = np.unique(name, return_inverse=True)
+        self.order = np.argsort(codes, kind='stable')
+        self.weight = np.asarray(weight, dtype=np.float64)[self.order]
+        self.length = np.asarray(length, dtype=np.float64)[self.order]
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(
+            codes, minlength=len(self.species)))])
+        self.ranges = {s: (offsets[i], offsets[i+1])
+                       for i, s in enumerate(self.species)}
+        self._clean = {}
+
+    def rows(self, species_name):
+        '''Row numbers in the file of all specimens of a species.'''
+
+        start, stop = self.ranges.get(species_name, (0, 0))
+        return self.order[start:stop]
+
+    def get(self, species_name):
+        '''
+        Weights and lengths of one species, without missing values
+
+        Input: scientific name of the species
+        Returns: weight and length arrays (same as read_trawl_data_file);
+                 the arrays are shared between calls, so copy them before
+                 modifying them
+        '''
+
+        if species_name not in self._clean:
+            start, stop = self.ranges.get(species_name, (0, 0))
+            weight = self.weight[start:stop]
+            length = self.length[start:stop]
+            good = (length < self.max_length) & ~np.isnan(weight)
+            weight = weight[good]
+            length = length[good]
+            weight.flags.writeable = False
+            length.flags.writeable = False
+            self._clean[species_name] = (weight, length)
+        return self._clean[species_name]
+
+
+# one SpecimenIndex for each file, rebuilt if the file is modified
+_indexes = {}
+
+
+def specimen_index(file_name=TRAWL_FILE):
+    '''
+    SpecimenIndex of a file, built the first time the file is used
+
+    Input: path to the netCDF file
+    Returns: SpecimenIndex
+    '''
+
+    key = os.path.abspath(file_name)
+    mtime = os.path.getmtime(file_name)
+    if key not in _indexes or _indexes[key][0] != mtime:
+        _indexes[key] = (mtime, SpecimenIndex(file_name))
+    return _indexes[key][1]
+
+
+def read_trawl_data_file(species_name, file_name=TRAWL_FILE):
+    '''
+    Read the weight and length data of one species from the trawl data file
+
+    Inputs:
+        species_name - scientific name of the species
+        file_name - path to the netCDF file
+    Returns: weight and length arrays, without missing values
+    '''
+
+    return specimen_index(file_name).get(species_name)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    file_name = sys.argv[1] if len(sys.argv) > 1 else TRAWL_FILE
+
+    t0 = time.perf_counter()
+    read_trawl_data_file('Engraulis mordax', file_name)
+    t1 = time.perf_counter()
+    n = 1000
+    for i in range(n):
+        weight, length = read_trawl_data_file('Engraulis mordax', file_name)
+    t2 = time.perf_counter()
+
+    print('first call:  {:10.1f} us'.format(1e6*(t1-t0)))
+    print('repeat call: {:10.1f} us'.format(1e6*(t2-t1)/n))
+    print(len(weight), 'specimens')
+
+    import xarray as xr
+
+    t0 = time.perf_counter()
+    ds = xr.open_dataset(file_name)
+    df = ds.to_dataframe()
+    dfsub = df.loc[(df['scientific_name'] == 'Engraulis mordax') &
+                   (ds['standard_length'].values < 1e8)]
+    t1 = time.perf_counter()
+    dfwhere = read_netcdf_where(file_name, ['weight', 'standard_length'],
+                                {'scientific_name': 'Engraulis mordax',
+                                 'standard_length': lambda v: v < 1e8})
+    t2 = time.perf_counter()
+    print('to_dataframe + selection: {:8.1f} ms'.format(1e3*(t1-t0)))
+    print('read_netcdf_where:        {:8.1f} ms'.format(1e3*(t2-t1)))
+    print('same rows:', np.array_equal(dfsub['weight'].to_numpy(),
+                                       dfwhere['weight'].to_numpy(), equal_nan=True))